@@ -19,7 +19,7 @@ from torch.utils.data import DataLoader
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = BASE_DIR
 sys.path.append(os.path.join(ROOT_DIR, 'models'))
-from ap_helper import APCalculator, parse_predictions, parse_groundtruths
+from ap_helper import APCalculatorStreaming, parse_predictions, parse_groundtruths
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--data_path', default='/scratch/cluster/yanght/Dataset/sunrgbd/', help='path to dataset')
@@ -33,17 +33,24 @@ parser.add_argument('--batch_size', type=int, default=8, help='Batch Size during
 parser.add_argument('--vote_factor', type=int, default=1, help='Number of votes generated from each seed [default: 1]')
 parser.add_argument('--cluster_sampling', default='vote_fps', help='Sampling strategy for vote clusters: vote_fps, seed_fps, random [default: vote_fps]')
 parser.add_argument('--ap_iou_thresh', type=float, default=0.25, help='AP IoU threshold [default: 0.25]')
+parser.add_argument('--coco_ap', action='store_true', help='Also report mAP averaged over IoU thresholds 0.25:0.05:0.75.')
+parser.add_argument('--single_nms_ap', action='store_true', help='Score AP at 2*ap_iou_thresh on the NMS-0.25 predictions instead of a separate NMS-0.5 parse.')
 parser.add_argument('--no_height', action='store_true', help='Do NOT use height signal in input.')
 parser.add_argument('--use_color', action='store_true', help='Use RGB color in input.')
+parser.add_argument('--use_packed_sunrgbd', action='store_true', help='Read SUN RGB-D from the store of sunrgbd/pack_sunrgbd_data.py')
 parser.add_argument('--use_sunrgbd_v2', action='store_true', help='Use SUN RGB-D V2 box labels.')
 parser.add_argument('--use_3d_nms', action='store_true', help='Use 3D NMS instead of 2D NMS.')
 parser.add_argument('--use_cls_nms', action='store_true', help='Use per class NMS.')
+parser.add_argument('--use_rotated_nms', action='store_true', help='NMS on oriented boxes instead of their axis aligned extents.')
 parser.add_argument('--use_old_type_nms', action='store_true', help='Use old type of NMS, IoBox2Area.')
 parser.add_argument('--per_class_proposal', action='store_true', help='Duplicate each proposal num_class times.')
 parser.add_argument('--nms_iou', type=float, default=0.25, help='NMS IoU threshold. [default: 0.25]')
 parser.add_argument('--conf_thresh', type=float, default=0.05, help='Filter out predictions with obj prob less than it. [default: 0.05]')
 parser.add_argument('--faster_eval', action='store_true', help='Faster evaluation by skippling empty bounding box removal.')
 parser.add_argument('--shuffle_dataset', action='store_true', help='Shuffle the dataset (random order).')
+parser.add_argument('--fused_backbone', action='store_true', help='Run the 4 backbone towers as one stacked network with grouped convs.')
+parser.add_argument('--fused_voting', action='store_true', help='Compute the 4 vote sets with one stacked voting module.')
+parser.add_argument('--fused_primitives', action='store_true', help='Run the z/xy/line primitive modules as one stacked module.')
 FLAGS = parser.parse_args()
 
 if FLAGS.use_cls_nms:
@@ -77,7 +84,7 @@ if FLAGS.dataset == 'sunrgbd':
     DATASET_CONFIG = SunrgbdDatasetConfig()
     TEST_DATASET = SunrgbdDetectionVotesDataset(FLAGS.data_path, 'val', num_points=NUM_POINT,
         augment=False, use_color=FLAGS.use_color, use_height=(not FLAGS.no_height),
-        use_v1=(not FLAGS.use_sunrgbd_v2))
+        use_v1=(not FLAGS.use_sunrgbd_v2), use_packed=FLAGS.use_packed_sunrgbd)
 elif FLAGS.dataset == 'scannet':
     sys.path.append(os.path.join(ROOT_DIR, 'scannet'))
     from scannet_detection_dataset_hd import ScannetDetectionDataset, MAX_NUM_OBJ
@@ -107,7 +114,10 @@ net = Detector(num_class=DATASET_CONFIG.num_class,
                num_proposal=FLAGS.num_target,
                input_feature_dim=num_input_channel,
                vote_factor=FLAGS.vote_factor,
-               sampling=FLAGS.cluster_sampling)
+               sampling=FLAGS.cluster_sampling,
+               fused_backbone=FLAGS.fused_backbone,
+               fused_voting=FLAGS.fused_voting,
+               fused_primitives=FLAGS.fused_primitives)
 
 if torch.cuda.device_count() > 1:
     log_string("Let's use %d GPUs!" % (torch.cuda.device_count()))
@@ -129,30 +139,44 @@ if CHECKPOINT_PATH is not None and os.path.isfile(CHECKPOINT_PATH):
         net.load_state_dict(checkpoint_multigpu)
     else:
         net.load_state_dict(checkpoint['model_state_dict'])
-    optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+    if not (FLAGS.fused_backbone or FLAGS.fused_voting or FLAGS.fused_primitives):
+        # Optimizer state follows the layout of the separate modules
+        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
     epoch = checkpoint['epoch']
     log_string("Loaded checkpoint %s (epoch: %d)"%(CHECKPOINT_PATH, epoch))
 
 # Used for AP calculation
 CONFIG_DICT = {'remove_empty_box':False, 'use_3d_nms':True,
     'nms_iou':0.25, 'use_old_type_nms':False, 'cls_nms':True,
+    'rotated_nms':FLAGS.use_rotated_nms,
     'per_class_proposal': True, 'conf_thresh':0.05,
     'dataset_config':DATASET_CONFIG}
 
 CONFIG_DICT_L = {'remove_empty_box':False, 'use_3d_nms':True,
     'nms_iou':0.5, 'use_old_type_nms':False, 'cls_nms':True,
+    'rotated_nms':FLAGS.use_rotated_nms,
     'per_class_proposal': True, 'conf_thresh':0.05,
     'dataset_config':DATASET_CONFIG}
 
+# AP thresholds evaluated on the CONFIG_DICT predictions from one IoU pass.
+# 2*ap_iou_thresh is scored on the CONFIG_DICT_L predictions unless --single_nms_ap
+AP_IOU_THRESHS = [FLAGS.ap_iou_thresh]
+if FLAGS.single_nms_ap:
+    AP_IOU_THRESHS.append(FLAGS.ap_iou_thresh*2)
+COCO_IOU_THRESHS = [round(0.25+0.05*i, 2) for i in range(11)] # 0.25:0.05:0.75
+if FLAGS.coco_ap:
+    AP_IOU_THRESHS += [t for t in COCO_IOU_THRESHS if t not in AP_IOU_THRESHS]
+
 # ------------------------------------------------------------------------- GLOBAL CONFIG END
 
 def evaluate_one_epoch():
     stat_dict = {}
 
-    ap_calculator = APCalculator(ap_iou_thresh=FLAGS.ap_iou_thresh,
-        class2type_map=DATASET_CONFIG.class2type)
-    ap_calculator_l = APCalculator(ap_iou_thresh=FLAGS.ap_iou_thresh*2,
+    ap_calculator = APCalculatorStreaming(ap_iou_thresh=AP_IOU_THRESHS,
         class2type_map=DATASET_CONFIG.class2type)
+    if not FLAGS.single_nms_ap:
+        ap_calculator_l = APCalculatorStreaming(ap_iou_thresh=FLAGS.ap_iou_thresh*2,
+            class2type_map=DATASET_CONFIG.class2type)
 
     net.eval() # set model to eval mode (for bn and dp)
     for batch_idx, batch_data_label in enumerate(TEST_DATALOADER):
@@ -182,21 +206,28 @@ def evaluate_one_epoch():
         batch_gt_map_cls = parse_groundtruths(end_points, CONFIG_DICT) 
         ap_calculator.step(batch_pred_map_cls, batch_gt_map_cls)
 
-        batch_pred_map_cls = parse_predictions(end_points, CONFIG_DICT_L, opt_ang=(FLAGS.dataset == 'sunrgbd'))
-        batch_gt_map_cls = parse_groundtruths(end_points, CONFIG_DICT_L) 
-        ap_calculator_l.step(batch_pred_map_cls, batch_gt_map_cls)
-
+        if not FLAGS.single_nms_ap:
+            batch_pred_map_cls = parse_predictions(end_points, CONFIG_DICT_L, opt_ang=(FLAGS.dataset == 'sunrgbd'))
+            batch_gt_map_cls = parse_groundtruths(end_points, CONFIG_DICT_L) 
+            ap_calculator_l.step(batch_pred_map_cls, batch_gt_map_cls)
 
     # Log statistics
     for key in sorted(stat_dict.keys()):
         log_string('eval mean %s: %f'%(key, stat_dict[key]/(float(batch_idx+1))))
 
-    metrics_dict = ap_calculator.compute_metrics()
-    for key in metrics_dict:
-        log_string('iou = 0.25, eval %s: %f'%(key, metrics_dict[key]))
-    metrics_dict = ap_calculator_l.compute_metrics()
-    for key in metrics_dict:
-        log_string('iou = 0.5, eval %s: %f'%(key, metrics_dict[key]))
+    metrics_list = ap_calculator.compute_metrics()
+    if FLAGS.single_nms_ap:
+        main_metrics = metrics_list[:2]
+    else:
+        main_metrics = [metrics_list[0], ap_calculator_l.compute_metrics()]
+    for thresh, metrics_dict in zip([FLAGS.ap_iou_thresh, FLAGS.ap_iou_thresh*2], main_metrics):
+        for key in metrics_dict:
+            log_string('iou = %g, eval %s: %f'%(thresh, key, metrics_dict[key]))
+    if FLAGS.coco_ap:
+        for thresh in COCO_IOU_THRESHS:
+            metrics_dict = metrics_list[AP_IOU_THRESHS.index(thresh)]
+            log_string('iou = %g, eval mAP: %f, AR: %f'%(thresh, metrics_dict['mAP'], metrics_dict['AR']))
+        log_string('eval mAP@[0.25:0.75]: %f'%(np.mean([metrics_list[AP_IOU_THRESHS.index(t)]['mAP'] for t in COCO_IOU_THRESHS])))
 
     mean_loss = stat_dict['loss']/float(batch_idx+1)
     return mean_loss
@@ -9,15 +9,14 @@ import os
 import sys
 import numpy as np
 import torch
+from concurrent.futures import ThreadPoolExecutor
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 from eval_det import eval_det_cls, eval_det_multiprocessing
-from eval_det import get_iou_obb
-from nms import nms_2d_faster, nms_3d_faster, nms_3d_faster_samecls
-from box_util import get_3d_box
-sys.path.append(os.path.join(ROOT_DIR, 'sunrgbd'))
-from sunrgbd_utils import extract_pc_in_box3d
+from eval_det import get_iou_obb, match_dets, eval_det_cls_from_matches
+from nms import nms_faster_batch_pytorch, nms_rotated_batch_pytorch
+from box_util import get_3d_box_batch_pytorch, box3d_point_count_batch_pytorch
 
 def flip_axis_to_camera(pc):
     ''' Flip X-right,Y-forward,Z-up to X-right,Y-down,Z-forward
@@ -28,12 +27,27 @@ def flip_axis_to_camera(pc):
     pc2[...,1] *= -1
     return pc2
 
+def flip_axis_to_camera_pytorch(pc):
+    ''' flip_axis_to_camera for (...,3) torch tensors '''
+    pc2 = pc[...,[0,2,1]] # advanced indexing copies
+    pc2[...,1] *= -1
+    return pc2
+
 def flip_axis_to_depth(pc):
     pc2 = np.copy(pc)
     pc2[...,[0,1,2]] = pc2[...,[0,2,1]] # depth X,Y,Z = cam X,Z,-Y
     pc2[...,2] *= -1
     return pc2
 
+def get_3d_box_upright_camera(center, heading_class, heading_residual, size_class, size_residual, dataset_config):
+    ''' Decode (B,K) box parameters to (B,K,8,3) corners in upright camera
+    coords with one batched op on the device of the inputs (in float64 like
+    class2angle/class2size/get_3d_box) '''
+    heading_angle = dataset_config.class2angle_batch(heading_class.detach(), heading_residual.detach().double())
+    box_size = dataset_config.class2size_batch(size_class.detach().long(), size_residual.detach().double())
+    center_upright_camera = flip_axis_to_camera_pytorch(center.detach().double())
+    return get_3d_box_batch_pytorch(box_size, heading_angle, center_upright_camera)
+
 def softmax(x):
     ''' Numpy function for softmax'''
     shape = x.shape
@@ -50,7 +64,7 @@ def parse_predictions(end_points, config_dict, opt_ang=False, opt_sem=False):
             size_scores, size_residuals, sem_cls_scores}
         config_dict: dict
             {dataset_config, remove_empty_box, use_3d_nms, nms_iou,
-            use_old_type_nms, conf_thresh, per_class_proposal}
+            use_old_type_nms, cls_nms, rotated_nms, conf_thresh, per_class_proposal}
 
     Returns:
         batch_pred_map_cls: a list of len == batch size (BS)
@@ -77,10 +91,10 @@ def parse_predictions(end_points, config_dict, opt_ang=False, opt_sem=False):
     pred_size_residual.squeeze_(2)
     
     if opt_sem:
-        pred_sem_cls = torch.argmax(end_points['sem_cls_scores'+'opt'], -1) # B,num_proposal
+        pred_sem_cls = torch.argmax(end_points['sem_cls_scores'+'opt'], -1).cpu().numpy() # B,num_proposal
         sem_cls_probs = softmax(end_points['sem_cls_scores'+'opt'].detach().cpu().numpy()) # B,num_proposal,10
     else:
-        pred_sem_cls = torch.argmax(end_points['sem_cls_scores'+'center'], -1) # B,num_proposal
+        pred_sem_cls = torch.argmax(end_points['sem_cls_scores'+'center'], -1).cpu().numpy() # B,num_proposal
         sem_cls_probs = softmax(end_points['sem_cls_scores'+'center'].detach().cpu().numpy()) # B,num_proposal,10
     pred_sem_cls_prob = np.max(sem_cls_probs,-1) # B,num_proposal
 
@@ -88,17 +102,10 @@ def parse_predictions(end_points, config_dict, opt_ang=False, opt_sem=False):
     # Since we operate in upright_depth coord for points, while util functions
     # assume upright_camera coord.
     bsize = pred_center.shape[0]
-    pred_corners_3d_upright_camera = np.zeros((bsize, num_proposal, 8, 3))
-    pred_center_upright_camera = flip_axis_to_camera(pred_center.detach().cpu().numpy())
-
-    for i in range(bsize):
-        for j in range(num_proposal):
-            heading_angle = config_dict['dataset_config'].class2angle(\
-                pred_heading_class[i,j].detach().cpu().numpy(), pred_heading_residual[i,j].detach().cpu().numpy())
-            box_size = config_dict['dataset_config'].class2size(\
-                int(pred_size_class[i,j].detach().cpu().numpy()), pred_size_residual[i,j].detach().cpu().numpy())     
-            corners_3d_upright_camera = get_3d_box(box_size, heading_angle, pred_center_upright_camera[i,j,:])
-            pred_corners_3d_upright_camera[i,j] = corners_3d_upright_camera
+    pred_corners_3d_upright_camera_gpu = get_3d_box_upright_camera(pred_center,
+        pred_heading_class, pred_heading_residual, pred_size_class, pred_size_residual,
+        config_dict['dataset_config']) # B,num_proposal,8,3
+    pred_corners_3d_upright_camera = pred_corners_3d_upright_camera_gpu.cpu().numpy()
 
     K = pred_center.shape[1] # K==num_proposal
     nonempty_box_mask = np.ones((bsize, K))
@@ -106,79 +113,41 @@ def parse_predictions(end_points, config_dict, opt_ang=False, opt_sem=False):
     if config_dict['remove_empty_box']:
         # -------------------------------------
         # Remove predicted boxes without any point within them..
-        batch_pc = end_points['point_clouds'].cpu().numpy()[:,:,0:3] # B,N,3
-        for i in range(bsize):
-            pc = batch_pc[i,:,:] # (N,3)
-            for j in range(K):
-                box3d = pred_corners_3d_upright_camera[i,j,:,:] # (8,3)
-                box3d = flip_axis_to_depth(box3d)
-                pc_in_box,inds = extract_pc_in_box3d(pc, box3d)
-                if len(pc_in_box) < 5:
-                    nonempty_box_mask[i,j] = 0
+        batch_pc = flip_axis_to_camera_pytorch(end_points['point_clouds'][:,:,0:3]) # B,N,3
+        num_pc_in_box = box3d_point_count_batch_pytorch(batch_pc, pred_corners_3d_upright_camera_gpu) # B,K
+        nonempty_box_mask[num_pc_in_box.cpu().numpy() < 5] = 0
         # -------------------------------------
 
     obj_logits = end_points['objectness_scores'+'opt'].detach().cpu().numpy()
     obj_prob = softmax(obj_logits)[:,:,1] # (B,K)
     
-    if not config_dict['use_3d_nms']:
-        # ---------- NMS input: pred_with_prob in (B,K,7) -----------
-        pred_mask = np.zeros((bsize, K))
-        for i in range(bsize):
-            boxes_2d_with_prob = np.zeros((K,5))
-            for j in range(K):
-                boxes_2d_with_prob[j,0] = np.min(pred_corners_3d_upright_camera[i,j,:,0])
-                boxes_2d_with_prob[j,2] = np.max(pred_corners_3d_upright_camera[i,j,:,0])
-                boxes_2d_with_prob[j,1] = np.min(pred_corners_3d_upright_camera[i,j,:,2])
-                boxes_2d_with_prob[j,3] = np.max(pred_corners_3d_upright_camera[i,j,:,2])
-                boxes_2d_with_prob[j,4] = obj_prob[i,j]
-            nonempty_box_inds = np.where(nonempty_box_mask[i,:]==1)[0]
-            pick = nms_2d_faster(boxes_2d_with_prob[nonempty_box_mask[i,:]==1,:],
-                config_dict['nms_iou'], config_dict['use_old_type_nms'])
-            assert(len(pick)>0)
-            pred_mask[i, nonempty_box_inds[pick]] = 1
-        end_points['pred_mask'] = pred_mask
-        # ---------- NMS output: pred_mask in (B,K) -----------
-    elif config_dict['use_3d_nms'] and (not config_dict['cls_nms']):
-        # ---------- NMS input: pred_with_prob in (B,K,7) -----------
-        pred_mask = np.zeros((bsize, K))
-        for i in range(bsize):
-            boxes_3d_with_prob = np.zeros((K,7))
-            for j in range(K):
-                boxes_3d_with_prob[j,0] = np.min(pred_corners_3d_upright_camera[i,j,:,0])
-                boxes_3d_with_prob[j,1] = np.min(pred_corners_3d_upright_camera[i,j,:,1])
-                boxes_3d_with_prob[j,2] = np.min(pred_corners_3d_upright_camera[i,j,:,2])
-                boxes_3d_with_prob[j,3] = np.max(pred_corners_3d_upright_camera[i,j,:,0])
-                boxes_3d_with_prob[j,4] = np.max(pred_corners_3d_upright_camera[i,j,:,1])
-                boxes_3d_with_prob[j,5] = np.max(pred_corners_3d_upright_camera[i,j,:,2])
-                boxes_3d_with_prob[j,6] = obj_prob[i,j]
-            nonempty_box_inds = np.where(nonempty_box_mask[i,:]==1)[0]
-            pick = nms_3d_faster(boxes_3d_with_prob[nonempty_box_mask[i,:]==1,:],
-                config_dict['nms_iou'], config_dict['use_old_type_nms'])
-            assert(len(pick)>0)
-            pred_mask[i, nonempty_box_inds[pick]] = 1
-        end_points['pred_mask'] = pred_mask
-        # ---------- NMS output: pred_mask in (B,K) -----------
-    elif config_dict['use_3d_nms'] and config_dict['cls_nms']:
-        # ---------- NMS input: pred_with_prob in (B,K,8) -----------
-        pred_mask = np.zeros((bsize, K))
-        for i in range(bsize):
-            boxes_3d_with_prob = np.zeros((K,8))
-            for j in range(K):
-                boxes_3d_with_prob[j,0] = np.min(pred_corners_3d_upright_camera[i,j,:,0])
-                boxes_3d_with_prob[j,1] = np.min(pred_corners_3d_upright_camera[i,j,:,1])
-                boxes_3d_with_prob[j,2] = np.min(pred_corners_3d_upright_camera[i,j,:,2])
-                boxes_3d_with_prob[j,3] = np.max(pred_corners_3d_upright_camera[i,j,:,0])
-                boxes_3d_with_prob[j,4] = np.max(pred_corners_3d_upright_camera[i,j,:,1])
-                boxes_3d_with_prob[j,5] = np.max(pred_corners_3d_upright_camera[i,j,:,2])
-                boxes_3d_with_prob[j,6] = obj_prob[i,j]
-                boxes_3d_with_prob[j,7] = pred_sem_cls[i,j] # only suppress if the two boxes are of the same class!!
-            nonempty_box_inds = np.where(nonempty_box_mask[i,:]==1)[0]
-            pick = nms_3d_faster_samecls(boxes_3d_with_prob[nonempty_box_mask[i,:]==1,:],
-                config_dict['nms_iou'], config_dict['use_old_type_nms'])
-            assert(len(pick)>0)
-            pred_mask[i, nonempty_box_inds[pick]] = 1
-        end_points['pred_mask'] = pred_mask
-        # ---------- NMS output: pred_mask in (B,K) -----------
+    # ---------- NMS input: boxes, scores (and classes) in (B,K) -----------
+    device = pred_corners_3d_upright_camera_gpu.device
+    if config_dict['use_3d_nms'] and config_dict['cls_nms']:
+        nms_cls = torch.from_numpy(pred_sem_cls).to(device) # only suppress if the two boxes are of the same class!!
+    else:
+        nms_cls = None
+    obj_prob_gpu = torch.from_numpy(obj_prob).to(device)
+    nonempty_box_mask_gpu = torch.from_numpy(nonempty_box_mask==1).to(device)
+    if config_dict['rotated_nms']:
+        # Oriented boxes: bird's eye view polygon overlap (times height overlap in 3D)
+        pred_mask = nms_rotated_batch_pytorch(pred_corners_3d_upright_camera_gpu, obj_prob_gpu,
+            config_dict['nms_iou'], config_dict['use_old_type_nms'], cls=nms_cls,
+            valid=nonempty_box_mask_gpu, use_3d=config_dict['use_3d_nms'])
+    else:
+        if not config_dict['use_3d_nms']:
+            # Bird's eye view boxes (x1,z1,x2,z2) in camera coords
+            corners_2d = pred_corners_3d_upright_camera_gpu[...,[0,2]]
+            boxes = torch.cat((corners_2d.min(2)[0], corners_2d.max(2)[0]), -1)
+        else:
+            boxes = torch.cat((pred_corners_3d_upright_camera_gpu.min(2)[0], pred_corners_3d_upright_camera_gpu.max(2)[0]), -1)
+        pred_mask = nms_faster_batch_pytorch(boxes, obj_prob_gpu,
+            config_dict['nms_iou'], config_dict['use_old_type_nms'], cls=nms_cls,
+            valid=nonempty_box_mask_gpu)
+    pred_mask = pred_mask.cpu().numpy().astype(np.float64)
+    assert(np.all(pred_mask.sum(1)>0))
+    end_points['pred_mask'] = pred_mask
+    # ---------- NMS output: pred_mask in (B,K) -----------
 
     batch_pred_map_cls = [] # a list (len: batch_size) of list (len: num of predictions per sample) of tuples of pred_cls, pred_box and conf (0-1)
     for i in range(bsize):
@@ -217,20 +186,15 @@ def parse_groundtruths(end_points, config_dict):
     heading_residual_label = end_points['heading_residual_label']
     size_class_label = end_points['size_class_label']
     size_residual_label = end_points['size_residual_label']
-    box_label_mask = end_points['box_label_mask']
-    sem_cls_label = end_points['sem_cls_label']
+    box_label_mask = end_points['box_label_mask'].cpu().numpy()
+    sem_cls_label = end_points['sem_cls_label'].cpu().numpy()
     bsize = center_label.shape[0]
 
     K2 = center_label.shape[1] # K2==MAX_NUM_OBJ
-    gt_corners_3d_upright_camera = np.zeros((bsize, K2, 8, 3))
-    gt_center_upright_camera = flip_axis_to_camera(center_label[:,:,0:3].detach().cpu().numpy())
-    for i in range(bsize):
-        for j in range(K2):
-            if box_label_mask[i,j] == 0: continue
-            heading_angle = config_dict['dataset_config'].class2angle(heading_class_label[i,j].detach().cpu().numpy(), heading_residual_label[i,j].detach().cpu().numpy())
-            box_size = config_dict['dataset_config'].class2size(int(size_class_label[i,j].detach().cpu().numpy()), size_residual_label[i,j].detach().cpu().numpy())
-            corners_3d_upright_camera = get_3d_box(box_size, heading_angle, gt_center_upright_camera[i,j,:])
-            gt_corners_3d_upright_camera[i,j] = corners_3d_upright_camera
+    gt_corners_3d_upright_camera = get_3d_box_upright_camera(center_label[:,:,0:3],
+        heading_class_label, heading_residual_label, size_class_label, size_residual_label,
+        config_dict['dataset_config']).cpu().numpy() # B,K2,8,3
+    gt_corners_3d_upright_camera[box_label_mask == 0] = 0
 
     batch_gt_map_cls = []
     for i in range(bsize):
@@ -244,8 +208,9 @@ class APCalculator(object):
     def __init__(self, ap_iou_thresh=0.25, class2type_map=None):
         """
         Args:
-            ap_iou_thresh: float between 0 and 1.0
+            ap_iou_thresh: float between 0 and 1.0, or a list of them
                 IoU threshold to judge whether a prediction is positive.
+                All thresholds of a list share one IoU computation.
             class2type_map: [optional] dict {class_int:class_name}
         """
         self.ap_iou_thresh = ap_iou_thresh
@@ -270,8 +235,16 @@ class APCalculator(object):
     
     def compute_metrics(self):
         """ Use accumulated predictions and groundtruths to compute Average Precision.
+        Returns one metrics dict, or a list of them (one per threshold) if
+        ap_iou_thresh is a list.
         """
         rec, prec, ap = eval_det_multiprocessing(self.pred_map_cls, self.gt_map_cls, ovthresh=self.ap_iou_thresh, get_iou_func=get_iou_obb)
+        if not isinstance(self.ap_iou_thresh, (list, tuple)):
+            return self.metrics_dict(rec, ap)
+        return [self.metrics_dict({key: rec[key][i] for key in rec}, {key: ap[key][i] for key in ap})
+            for i in range(len(self.ap_iou_thresh))]
+
+    def metrics_dict(self, rec, ap):
         ret_dict = {} 
         for key in sorted(ap.keys()):
             clsname = self.class2type_map[key] if self.class2type_map else str(key)
@@ -293,3 +266,71 @@ class APCalculator(object):
         self.gt_map_cls = {} # {scan_id: [(classname, bbox)]}
         self.pred_map_cls = {} # {scan_id: [(classname, bbox, score)]}
         self.scan_cnt = 0
+
+class APCalculatorStreaming(APCalculator):
+    ''' APCalculator that matches each scene with its groundtruth in a
+    background thread as the batches arrive (overlapping the next forward
+    pass). Only the per detection (score, best GT, IoU) arrays are kept, so
+    compute_metrics is a sort and a cumulative sum per class. '''
+    def __init__(self, ap_iou_thresh=0.25, class2type_map=None):
+        self.executor = ThreadPoolExecutor(max_workers=1) # scenes are matched in order
+        self.pending = []
+        super().__init__(ap_iou_thresh, class2type_map)
+
+    def step(self, batch_pred_map_cls, batch_gt_map_cls):
+        bsize = len(batch_pred_map_cls)
+        assert(bsize == len(batch_gt_map_cls))
+        for i in range(bsize):
+            self.pending.append(self.executor.submit(self.match_scene, batch_pred_map_cls[i], batch_gt_map_cls[i]))
+            self.scan_cnt += 1
+
+    def match_scene(self, pred_map_cls, gt_map_cls):
+        pred = {} # {classname: [(bbox, score)]}
+        gt = {} # {classname: [bbox]}
+        for classname, bbox, score in pred_map_cls:
+            pred.setdefault(classname, []).append((bbox, score))
+        for classname, bbox in gt_map_cls:
+            gt.setdefault(classname, []).append(bbox)
+        for classname in pred:
+            if classname not in self.matches:
+                self.matches[classname] = ([], [], []) # confidence, gt ids, ovmax
+            BB = np.array([bbox for bbox, score in pred[classname]]).astype(float)
+            BBGT = np.array(gt.get(classname, [])).astype(float)
+            jmax, ovmax = match_dets(BB, BBGT, get_iou_obb)
+            self.matches[classname][0].append(np.array([score for bbox, score in pred[classname]]))
+            self.matches[classname][1].append(jmax + self.npos.get(classname, 0))
+            self.matches[classname][2].append(ovmax)
+        for classname in gt:
+            self.npos[classname] = self.npos.get(classname, 0) + len(gt[classname])
+
+    def wait(self):
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+    def compute_metrics(self):
+        self.wait()
+        multi_thresh = isinstance(self.ap_iou_thresh, (list, tuple))
+        rec, ap = {}, {}
+        # Same class order as eval_det_multiprocessing: predicted classes first
+        for classname in list(self.matches) + [c for c in self.npos if c not in self.matches]:
+            if classname in self.matches:
+                confidence, gt_ids, ovmax = [np.concatenate(m) for m in self.matches[classname]]
+                rec[classname], _, ap[classname] = eval_det_cls_from_matches(confidence, gt_ids, ovmax,
+                    self.npos.get(classname, 0), self.ap_iou_thresh)
+            elif multi_thresh:
+                rec[classname] = [0] * len(self.ap_iou_thresh)
+                ap[classname] = [0] * len(self.ap_iou_thresh)
+            else:
+                rec[classname] = 0
+                ap[classname] = 0
+        if not multi_thresh:
+            return self.metrics_dict(rec, ap)
+        return [self.metrics_dict({key: rec[key][i] for key in rec}, {key: ap[key][i] for key in ap})
+            for i in range(len(self.ap_iou_thresh))]
+
+    def reset(self):
+        self.wait()
+        self.matches = {} # {classname: ([confidence], [gt ids], [ovmax]) per scene}
+        self.npos = {} # {classname: number of gt boxes}
+        self.scan_cnt = 0
@@ -17,6 +17,7 @@ sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 sys.path.append(os.path.join(ROOT_DIR, 'pointnet2'))
 
 from pointnet2_modules import PointnetSAModuleVotes, PointnetSAModuleVotesWith, PointnetFPModule, PointnetPlaneVotes
+from pointnet2_modules import PointnetSAModuleVotesStacked, PointnetFPModuleStacked
 
 class Pointnet2Backbone(nn.Module):
     r"""
@@ -108,38 +109,21 @@ class Pointnet2Backbone(nn.Module):
         end_points['sa0_features'+mode] = features
         
         # --------- 4 SET ABSTRACTION LAYERS ---------
-        if mode != '':
-            ### Reuse inds from point
-            xyz, features, fps_inds = self.sa1(xyz, features, inds=end_points['sa1_inds'])
-        else:
-            xyz, features, fps_inds = self.sa1(xyz, features)
-        end_points['sa1_inds'+mode] = fps_inds
-        end_points['sa1_xyz'+mode] = xyz
-        end_points['sa1_features'+mode] = features
-
-        if mode != '':
-            xyz, features, fps_inds = self.sa2(xyz, features, inds=end_points['sa2_inds']) # this fps_inds is just 0,1,...,1023
-        else:
-            xyz, features, fps_inds = self.sa2(xyz, features) # this fps_inds is just 0,1,...,1023
-        end_points['sa2_inds'+mode] = fps_inds
-        end_points['sa2_xyz'+mode] = xyz
-        end_points['sa2_features'+mode] = features
-
-        if mode != '':
-            xyz, features, fps_inds = self.sa3(xyz, features, inds=end_points['sa3_inds']) # this fps_inds is just 0,1,...,511
-        else:
-            xyz, features, fps_inds = self.sa3(xyz, features) # this fps_inds is just 0,1,...,1023
-        end_points['sa3_inds'+mode] = fps_inds
-        end_points['sa3_xyz'+mode] = xyz
-        end_points['sa3_features'+mode] = features
-
-        if mode != '':
-            xyz, features, fps_inds = self.sa4(xyz, features, inds=end_points['sa4_inds']) # this fps_inds is just 0,1,...,255
-        else:
-            xyz, features, fps_inds = self.sa4(xyz, features) # this fps_inds is just 0,1,...,255
-        end_points['sa4_inds'+mode] = fps_inds
-        end_points['sa4_xyz'+mode] = xyz
-        end_points['sa4_features'+mode] = features
+        # Towers with mode != '' reuse the sampling of the first tower, so the
+        # xyz at every level is identical and so are the ball query indices
+        # and grouped xyz: take them from end_points instead of recomputing
+        for k, sa in enumerate([self.sa1, self.sa2, self.sa3, self.sa4], 1):
+            prefix = 'sa%d_' % k
+            if mode != '':
+                ### Reuse inds and grouping from point
+                group = (end_points[prefix+'grouped_idx'], end_points[prefix+'grouped_xyz'])
+                xyz, features, fps_inds = sa(xyz, features, inds=end_points[prefix+'inds'], group=group)
+            else:
+                xyz, features, fps_inds, group = sa(xyz, features, ret_group=True)
+                end_points[prefix+'grouped_idx'], end_points[prefix+'grouped_xyz'] = group
+            end_points[prefix+'inds'+mode] = fps_inds # for sa2-sa4 this is just 0,1,...,npoint-1
+            end_points[prefix+'xyz'+mode] = xyz
+            end_points[prefix+'features'+mode] = features
 
         # --------- 2 FEATURE UPSAMPLING LAYERS --------
         features = self.fp1(end_points['sa3_xyz'+mode], end_points['sa4_xyz'+mode], end_points['sa3_features'+mode], end_points['sa4_features'+mode])
@@ -150,6 +134,122 @@ class Pointnet2Backbone(nn.Module):
         end_points['fp2_inds'+mode] = end_points['sa1_inds'+mode][:,0:num_seed] # indices among the entire input point clouds
         return end_points
 
+class Pointnet2BackboneStacked(nn.Module):
+    r"""
+       Several Pointnet2Backbone towers fused into one network. The towers
+       share sampling and grouping and their weights are stacked so every
+       MLP layer is a single grouped 1x1 conv (groups=num_towers).
+       Use pytorch_utils.stack_state_dict to load weights of separate towers.
+
+       Parameters
+       ----------
+       input_feature_dim: int
+            Number of input channels in the feature descriptor for each point.
+            e.g. 3 for RGB.
+       modes: list of str
+            end_points suffix of every tower, same as the mode argument of
+            Pointnet2Backbone.forward
+    """
+    def __init__(self, input_feature_dim=0, modes=('', 'net1', 'net2', 'net3')):
+        super().__init__()
+
+        self.modes = list(modes)
+        num_towers = len(self.modes)
+
+        self.sa1 = PointnetSAModuleVotesStacked(
+                npoint=2048,
+                radius=0.2,
+                nsample=64,
+                mlp=[input_feature_dim, 64, 64, 128],
+                num_towers=num_towers,
+                normalize_xyz=True
+            )
+
+        self.sa2 = PointnetSAModuleVotesStacked(
+                npoint=1024,
+                radius=0.4,
+                nsample=32,
+                mlp=[128, 128, 128, 256],
+                num_towers=num_towers,
+                normalize_xyz=True
+            )
+
+        self.sa3 = PointnetSAModuleVotesStacked(
+                npoint=512,
+                radius=0.8,
+                nsample=16,
+                mlp=[256, 128, 128, 256],
+                num_towers=num_towers,
+                normalize_xyz=True
+            )
+
+        self.sa4 = PointnetSAModuleVotesStacked(
+                npoint=256,
+                radius=1.2,
+                nsample=16,
+                mlp=[256, 128, 128, 256],
+                num_towers=num_towers,
+                normalize_xyz=True
+            )
+
+        self.fp1 = PointnetFPModuleStacked(mlp=[256+256,256,256], num_towers=num_towers)
+        self.fp2 = PointnetFPModuleStacked(mlp=[256+256,256,256], num_towers=num_towers)
+
+    def _break_up_pc(self, pc):
+        xyz = pc[..., 0:3].contiguous()
+        features = (
+            pc[..., 3:].transpose(1, 2).contiguous()
+            if pc.size(-1) > 3 else None
+        )
+
+        return xyz, features
+
+    def forward(self, pointcloud: torch.cuda.FloatTensor, end_points=None):
+        r"""
+            Forward pass of the network
+
+            Parameters
+            ----------
+            pointcloud: Variable(torch.cuda.FloatTensor)
+                (B, N, 3 + input_feature_dim) tensor
+                Point cloud to run predicts on
+                Each point in the point-cloud MUST
+                be formated as (x, y, z, features...)
+
+            Returns
+            ----------
+            end_points: same keys as running Pointnet2Backbone once per mode
+        """
+        if not end_points: end_points = {}
+        num_towers = len(self.modes)
+
+        xyz, features = self._break_up_pc(pointcloud)
+        for mode in self.modes:
+            end_points['sa0_xyz'+mode] = xyz
+            end_points['sa0_features'+mode] = features
+        if features is not None:
+            features = features.repeat(1, num_towers, 1)
+
+        # --------- 4 SET ABSTRACTION LAYERS ---------
+        stacked = {}
+        for k, sa in enumerate([self.sa1, self.sa2, self.sa3, self.sa4], 1):
+            xyz, features, fps_inds = sa(xyz, features)
+            stacked[k] = features
+            for mode, tower_features in zip(self.modes, features.chunk(num_towers, dim=1)):
+                end_points['sa%d_inds'%k+mode] = fps_inds
+                end_points['sa%d_xyz'%k+mode] = xyz
+                end_points['sa%d_features'%k+mode] = tower_features
+
+        # --------- 2 FEATURE UPSAMPLING LAYERS --------
+        features = self.fp1(end_points['sa3_xyz'], end_points['sa4_xyz'], stacked[3], stacked[4])
+        features = self.fp2(end_points['sa2_xyz'], end_points['sa3_xyz'], stacked[2], features)
+        num_seed = end_points['sa2_xyz'].shape[1]
+        for mode, tower_features in zip(self.modes, features.chunk(num_towers, dim=1)):
+            end_points['fp2_features'+mode] = tower_features
+            end_points['fp2_xyz'+mode] = end_points['sa2_xyz']
+            end_points['fp2_inds'+mode] = end_points['sa1_inds'][:,0:num_seed] # indices among the entire input point clouds
+        return end_points
+
 class Pointnet2BackboneRefine(nn.Module):
     r"""
        Backbone network for point cloud feature learning.
@@ -250,14 +350,14 @@ class Pointnet2BackboneRefine(nn.Module):
         #center_matching = torch.max(matching.view(batch_size, 18, 256), dim=1)[0]
         center_matching = end_points['match_center']
 
-        center_sem = torch.cuda.FloatTensor(batch_size, 256, 18).zero_()### Need to change to config sem later
+        center_sem = torch.zeros(batch_size, 256, 18, device=pointcloud.device)### Need to change to config sem later
         center_sem.scatter_(2, matching_sem[:,:256].unsqueeze(-1), 1) # src==1 so it's *one-hot* (B,K,num_size_cluster)
-        cue_sem = torch.cuda.FloatTensor(batch_size, 256*18, 18).zero_()
+        cue_sem = torch.zeros(batch_size, 256*18, 18, device=pointcloud.device)
         cue_sem.scatter_(2, matching_sem[:,256:].unsqueeze(-1), 1) # src==1 so it's *one-hot* (B,K,num_size_cluster)
 
         center_feature = torch.cat(((center_points[:,:,2] - floor_height.unsqueeze(-1)).unsqueeze(1), center_matching.unsqueeze(1), center_sem.transpose(2,1).contiguous()), dim=1) ### Need to make the floor height an option
         cue_feature = torch.cat(((cue_points[:,:,2] - floor_height.unsqueeze(-1)).unsqueeze(1), matching.unsqueeze(1), cue_sem.transpose(2,1).contiguous()), dim=1)
-        other_features = torch.cat((features, torch.cuda.FloatTensor(batch_size, 19, features.shape[-1]).zero_()), dim=1)
+        other_features = torch.cat((features, torch.zeros(batch_size, 19, features.shape[-1], device=features.device)), dim=1)
         
         features = torch.cat((center_feature, cue_feature, other_features), dim=2)
         #features = torch.cat((cue_feature, other_features), dim=2)
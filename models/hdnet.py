@@ -19,12 +19,14 @@ ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 import pc_util
+sys.path.append(os.path.join(ROOT_DIR, 'pointnet2'))
+from pytorch_utils import stack_state_dict
 
-from backbone_module import Pointnet2Backbone
-from voting_module import VotingModule
+from backbone_module import Pointnet2Backbone, Pointnet2BackboneStacked
+from voting_module import VotingModule, VotingModuleStacked
 
 from proposal_module_refine import ProposalModuleRefine
-from proposal_module_surface import PrimitiveModule
+from proposal_module_surface import PrimitiveModule, PrimitiveModuleStacked
 
 from dump_helper import dump_results
 from loss_helper import get_loss
@@ -46,10 +48,20 @@ class HDNet(nn.Module):
             Number of proposals/detections generated from the network. Each proposal is a 3D OBB with a semantic class.
         vote_factor: (default: 1)
             Number of votes generated from each seed point.
+        fused_backbone: (default: False)
+            Run the 4 backbone towers as one Pointnet2BackboneStacked (grouped convs).
+            Checkpoints with separate towers are converted when loaded.
+        fused_voting: (default: False)
+            Compute the 4 vote sets with one VotingModuleStacked (grouped convs).
+            Checkpoints with separate voting modules are converted when loaded.
+        fused_primitives: (default: False)
+            Run pnet_z, pnet_xy and pnet_line as one PrimitiveModuleStacked.
+            Checkpoints with separate primitive modules are converted when loaded.
     """
 
     def __init__(self, num_class, num_heading_bin, num_size_cluster, mean_size_arr,
-        input_feature_dim=0, num_proposal=128, vote_factor=1, sampling='vote_fps', with_angle=False):
+        input_feature_dim=0, num_proposal=128, vote_factor=1, sampling='vote_fps', with_angle=False,
+        fused_backbone=False, fused_voting=False, fused_primitives=False):
         super().__init__()
 
         self.num_class = num_class
@@ -60,12 +72,21 @@ class HDNet(nn.Module):
         self.num_proposal = num_proposal
         self.vote_factor = vote_factor
         self.sampling=sampling
+        self.fused_backbone = fused_backbone
+        self.fused_voting = fused_voting
+        self.fused_primitives = fused_primitives
+        if self.fused_backbone or self.fused_voting or self.fused_primitives:
+            self._register_load_state_dict_pre_hook(self._stack_state_dict_hook)
 
         # Backbone point feature learning: 4 bb tower
-        self.backbone_net1 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
-        self.backbone_net2 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
-        self.backbone_net3 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
-        self.backbone_net4 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
+        if self.fused_backbone:
+            self.backbone_net = Pointnet2BackboneStacked(input_feature_dim=self.input_feature_dim,
+                                                         modes=['', 'net1', 'net2', 'net3'])
+        else:
+            self.backbone_net1 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
+            self.backbone_net2 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
+            self.backbone_net3 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
+            self.backbone_net4 = Pointnet2Backbone(input_feature_dim=self.input_feature_dim) ### Just xyz + height
 
         ### Feature concatenation
         self.conv_agg1 = torch.nn.Conv1d(256*4,256*2,1) 
@@ -87,22 +108,52 @@ class HDNet(nn.Module):
         self.conv_flag_line2 = torch.nn.Conv1d(128,2,1) 
         
         # Hough voting and clustering
-        self.vgen = VotingModule(self.vote_factor, 256)
-        self.vgen_z = VotingModule(self.vote_factor, 256)
-        self.vgen_xy = VotingModule(self.vote_factor, 256)
-        self.vgen_line = VotingModule(self.vote_factor, 256)
+        if self.fused_voting:
+            ### Stacked in the order vgen, vgen_z, vgen_xy, vgen_line
+            self.vgen_stacked = VotingModuleStacked(self.vote_factor, 256, 4)
+        else:
+            self.vgen = VotingModule(self.vote_factor, 256)
+            self.vgen_z = VotingModule(self.vote_factor, 256)
+            self.vgen_xy = VotingModule(self.vote_factor, 256)
+            self.vgen_line = VotingModule(self.vote_factor, 256)
     
         # Vote aggregation and detection
-        self.pnet_z = PrimitiveModule(num_class, num_heading_bin, num_size_cluster,
-                                     mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numd=2)
-        self.pnet_xy = PrimitiveModule(num_class, num_heading_bin, num_size_cluster,
-                                     mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numd=1)
-        self.pnet_line = PrimitiveModule(num_class, num_heading_bin, num_size_cluster,
-                                        mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numd=0)
+        if self.fused_primitives:
+            ### Stacked in the order pnet_z, pnet_xy, pnet_line
+            self.pnet_primitives = PrimitiveModuleStacked(num_class, num_heading_bin, num_size_cluster,
+                                                          mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numds=(2, 1, 0))
+        else:
+            self.pnet_z = PrimitiveModule(num_class, num_heading_bin, num_size_cluster,
+                                         mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numd=2)
+            self.pnet_xy = PrimitiveModule(num_class, num_heading_bin, num_size_cluster,
+                                         mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numd=1)
+            self.pnet_line = PrimitiveModule(num_class, num_heading_bin, num_size_cluster,
+                                            mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numd=0)
         
         self.pnet_final = ProposalModuleRefine(num_class, num_heading_bin, num_size_cluster,
                                    mean_size_arr, num_proposal, sampling, seed_feat_dim=256, with_angle=with_angle)
         
+    def _stack_state_dict_hook(self, state_dict, prefix, *args):
+        # Convert checkpoints saved with separate backbone_net1..4 / vgen* / pnet_* in place
+        stacked = []
+        primitives = ['pnet_z', 'pnet_xy', 'pnet_line']
+        if self.fused_primitives:
+            # The conv3 heads differ in width per primitive and are kept apart
+            for i, name in enumerate(primitives):
+                head = prefix + name + '.conv3.'
+                for k in [k for k in state_dict if k.startswith(head)]:
+                    state_dict[prefix + 'pnet_primitives.conv3.%d.' % i + k[len(head):]] = state_dict.pop(k)
+            stacked.append(([prefix + name + '.' for name in primitives], prefix + 'pnet_primitives.'))
+        if self.fused_backbone:
+            stacked.append(([prefix + 'backbone_net%d.' % i for i in range(1, 5)], prefix + 'backbone_net.'))
+        if self.fused_voting:
+            stacked.append(([prefix + name + '.' for name in ['vgen', 'vgen_z', 'vgen_xy', 'vgen_line']], prefix + 'vgen_stacked.'))
+        for prefixes, stacked_prefix in stacked:
+            if any(k.startswith(prefixes[0]) for k in state_dict):
+                converted = stack_state_dict(state_dict, prefixes, stacked_prefix)
+                state_dict.clear()
+                state_dict.update(converted)
+
     def forward(self, inputs, end_points, mode=""):
         """ Forward pass of the network
 
@@ -120,10 +171,13 @@ class HDNet(nn.Module):
         """
         batch_size = inputs['point_clouds'].shape[0]
 
-        end_points = self.backbone_net1(inputs['point_clouds'], end_points)
-        end_points = self.backbone_net2(inputs['point_clouds'], end_points, mode='net1')
-        end_points = self.backbone_net3(inputs['point_clouds'], end_points, mode='net2')
-        end_points = self.backbone_net4(inputs['point_clouds'], end_points, mode='net3')
+        if self.fused_backbone:
+            end_points = self.backbone_net(inputs['point_clouds'], end_points)
+        else:
+            end_points = self.backbone_net1(inputs['point_clouds'], end_points)
+            end_points = self.backbone_net2(inputs['point_clouds'], end_points, mode='net1')
+            end_points = self.backbone_net3(inputs['point_clouds'], end_points, mode='net2')
+            end_points = self.backbone_net4(inputs['point_clouds'], end_points, mode='net3')
 
         ### Extract feature here
         xyz = end_points['fp2_xyz']
@@ -154,33 +208,55 @@ class HDNet(nn.Module):
         net_flag_line = self.conv_flag_line2(net_flag_line)
         end_points["pred_flag_line"] = net_flag_line
 
-        proposal_xyz, proposal_features, center_offset, center_residual = self.vgen(xyz, features_hd_discriptor)
-        proposal_features_norm = torch.norm(proposal_features, p=2, dim=1)
-        proposal_features = proposal_features.div(proposal_features_norm.unsqueeze(1))
-        end_points['vote_xyz'] = proposal_xyz
-        end_points['vote_features'] = proposal_features
+        if self.fused_voting:
+            votes_xyz, votes_features, _, _ = self.vgen_stacked(xyz, features_hd_discriptor)
+            votes_features_norm = torch.norm(votes_features, p=2, dim=2)
+            votes_features = votes_features.div(votes_features_norm.unsqueeze(2))
+            proposal_xyz, voted_z, voted_xy, voted_line = [v.contiguous() for v in votes_xyz.unbind(1)]
+            proposal_features, voted_z_feature, voted_xy_feature, voted_line_feature = [v.contiguous() for v in votes_features.unbind(1)]
+            end_points['vote_xyz'] = proposal_xyz
+            end_points['vote_features'] = proposal_features
+            end_points['vote_z'] = voted_z
+            end_points['vote_z_feature'] = voted_z_feature
+            end_points['vote_xy'] = voted_xy
+            end_points['vote_xy_feature'] = voted_xy_feature
+            end_points['vote_line'] = voted_line
+            end_points['vote_line_feature'] = voted_line_feature
+        else:
+            proposal_xyz, proposal_features, center_offset, center_residual = self.vgen(xyz, features_hd_discriptor)
+            proposal_features_norm = torch.norm(proposal_features, p=2, dim=1)
+            proposal_features = proposal_features.div(proposal_features_norm.unsqueeze(1))
+            end_points['vote_xyz'] = proposal_xyz
+            end_points['vote_features'] = proposal_features
         
-        voted_z, voted_z_feature, z_offset, z_residual = self.vgen_z(xyz, features_hd_discriptor)
-        voted_z_feature_norm = torch.norm(voted_z_feature, p=2, dim=1)
-        voted_z_feature = voted_z_feature.div(voted_z_feature_norm.unsqueeze(1))
-        end_points['vote_z'] = voted_z
-        end_points['vote_z_feature'] = voted_z_feature
-
-        voted_xy, voted_xy_feature, xy_offset, xy_residual = self.vgen_xy(xyz, features_hd_discriptor)
-        voted_xy_feature_norm = torch.norm(voted_xy_feature, p=2, dim=1)
-        voted_xy_feature = voted_xy_feature.div(voted_xy_feature_norm.unsqueeze(1))
-        end_points['vote_xy'] = voted_xy
-        end_points['vote_xy_feature'] = voted_xy_feature
-
-        voted_line, voted_line_feature, line_offset, line_residual = self.vgen_line(xyz, features_hd_discriptor)
-        voted_line_feature_norm = torch.norm(voted_line_feature, p=2, dim=1)
-        voted_line_feature = voted_line_feature.div(voted_line_feature_norm.unsqueeze(1))
-        end_points['vote_line'] = voted_line
-        end_points['vote_line_feature'] = voted_line_feature
+            voted_z, voted_z_feature, z_offset, z_residual = self.vgen_z(xyz, features_hd_discriptor)
+            voted_z_feature_norm = torch.norm(voted_z_feature, p=2, dim=1)
+            voted_z_feature = voted_z_feature.div(voted_z_feature_norm.unsqueeze(1))
+            end_points['vote_z'] = voted_z
+            end_points['vote_z_feature'] = voted_z_feature
+
+            voted_xy, voted_xy_feature, xy_offset, xy_residual = self.vgen_xy(xyz, features_hd_discriptor)
+            voted_xy_feature_norm = torch.norm(voted_xy_feature, p=2, dim=1)
+            voted_xy_feature = voted_xy_feature.div(voted_xy_feature_norm.unsqueeze(1))
+            end_points['vote_xy'] = voted_xy
+            end_points['vote_xy_feature'] = voted_xy_feature
+
+            voted_line, voted_line_feature, line_offset, line_residual = self.vgen_line(xyz, features_hd_discriptor)
+            voted_line_feature_norm = torch.norm(voted_line_feature, p=2, dim=1)
+            voted_line_feature = voted_line_feature.div(voted_line_feature_norm.unsqueeze(1))
+            end_points['vote_line'] = voted_line
+            end_points['vote_line_feature'] = voted_line_feature
         
-        center_z, feature_z, end_points = self.pnet_z(voted_z, voted_z_feature, end_points, mode='_z')
-        center_xy, feature_xy, end_points = self.pnet_xy(voted_xy, voted_xy_feature, end_points, mode='_xy')
-        center_line, feature_line, end_points = self.pnet_line(voted_line, voted_line_feature, end_points, mode='_line')
+        if self.fused_primitives:
+            primitive_xyz = torch.stack((voted_z, voted_xy, voted_line), 1)
+            primitive_features = torch.cat((voted_z_feature, voted_xy_feature, voted_line_feature), 1)
+            centers, features, end_points = self.pnet_primitives(primitive_xyz, primitive_features, end_points, modes=['_z', '_xy', '_line'])
+            center_z, center_xy, center_line = centers
+            feature_z, feature_xy, feature_line = features
+        else:
+            center_z, feature_z, end_points = self.pnet_z(voted_z, voted_z_feature, end_points, mode='_z')
+            center_xy, feature_xy, end_points = self.pnet_xy(voted_xy, voted_xy_feature, end_points, mode='_xy')
+            center_line, feature_line, end_points = self.pnet_line(voted_line, voted_line_feature, end_points, mode='_line')
 
         end_points = self.pnet_final(proposal_xyz, proposal_features, center_z, feature_z, center_xy, feature_xy, center_line, feature_line, end_points)
         return end_points
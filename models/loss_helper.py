@@ -124,6 +124,7 @@ def compute_proposal_loss(end_points, mode=''):
     
     aggregated_vote_xyz = end_points['aggregated_vote_xyz'+'center'] ### Vote xyz is the same for all
     K = aggregated_vote_xyz.shape[1]
+    device = aggregated_vote_xyz.device
 
     dist1, ind1, dist2, _ = nn_distance(aggregated_vote_xyz, gt_center) # dist1: BxK, dist2: BxK2
 
@@ -134,8 +135,8 @@ def compute_proposal_loss(end_points, mode=''):
     # objectness_label: 1 if pred object center is within NEAR_THRESHOLD of any GT object
     # objectness_mask: 0 if pred object center is in gray zone (DONOTCARE), 1 otherwise
     euclidean_dist1 = torch.sqrt(dist1+1e-6)
-    objectness_label = torch.zeros((B,K), dtype=torch.long).cuda()
-    objectness_mask = torch.zeros((B,K)).cuda()
+    objectness_label = torch.zeros((B,K), dtype=torch.long, device=device)
+    objectness_mask = torch.zeros((B,K), device=device)
     
     ### Get the corresponding proposal with detected object proposal
     if mode == 'opt':
@@ -175,12 +176,12 @@ def compute_proposal_loss(end_points, mode=''):
         
         euclidean_dist_surface = torch.sqrt(dist_surface+1e-6)
         euclidean_dist_line = torch.sqrt(dist_line+1e-6)
-        objectness_label_surface = torch.zeros((B,K*6), dtype=torch.long).cuda()
-        objectness_mask_surface = torch.zeros((B,K*6)).cuda()
-        objectness_label_line = torch.zeros((B,K*12), dtype=torch.long).cuda()
-        objectness_mask_line = torch.zeros((B,K*12)).cuda()
-        objectness_label_surface_sem = torch.zeros((B,K*6), dtype=torch.long).cuda()
-        objectness_label_line_sem = torch.zeros((B,K*12), dtype=torch.long).cuda()
+        objectness_label_surface = torch.zeros((B,K*6), dtype=torch.long, device=device)
+        objectness_mask_surface = torch.zeros((B,K*6), device=device)
+        objectness_label_line = torch.zeros((B,K*12), dtype=torch.long, device=device)
+        objectness_mask_line = torch.zeros((B,K*12), device=device)
+        objectness_label_surface_sem = torch.zeros((B,K*6), dtype=torch.long, device=device)
+        objectness_label_line_sem = torch.zeros((B,K*12), dtype=torch.long, device=device)
         
         euclidean_dist_obj_surface = torch.sqrt(torch.sum((pred_obj_surface_center - surface_sel)**2, dim=-1)+1e-6)
         euclidean_dist_obj_line = torch.sqrt(torch.sum((pred_obj_line_center - line_sel)**2, dim=-1)+1e-6)
@@ -209,12 +210,12 @@ def compute_proposal_loss(end_points, mode=''):
         temp_objectness_label = torch.cat((objectness_label_surface, objectness_label_line), 1)
         temp_objectness_label_sem = torch.cat((objectness_label_surface_sem, objectness_label_line_sem), 1)
         temp_objectness_mask = torch.cat((objectness_mask_surface, objectness_mask_line), 1)
-        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS_REFINE).cuda(), reduction='none')
+        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS_REFINE).to(device), reduction='none')
         objectness_loss = criterion(objectness_scores.transpose(2,1), temp_objectness_label)
         objectness_loss = torch.sum(objectness_loss * temp_objectness_mask)/(torch.sum(temp_objectness_mask)+1e-6)
 
         objectness_scores_sem = end_points["match_scores_sem"]#match scores for the semantics of primitives
-        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS_REFINE).cuda(), reduction='none')
+        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS_REFINE).to(device), reduction='none')
         objectness_loss_sem = criterion(objectness_scores_sem.transpose(2,1), temp_objectness_label_sem)
         objectness_loss_sem = torch.sum(objectness_loss_sem * temp_objectness_mask)/(torch.sum(temp_objectness_mask)+1e-6)
 
@@ -236,7 +237,7 @@ def compute_proposal_loss(end_points, mode=''):
         objectness_scores = end_points['objectness_scores'+mode]
         objectness_match_mask = (torch.sum(temp_objectness_label.view(B, 18, K), dim=1) >= 1).float()
         
-        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS).cuda(), reduction='none')
+        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS).to(device), reduction='none')
         objectness_loss_refine = criterion(objectness_scores.transpose(2,1), objectness_label)
         objectness_loss_refine1 = torch.sum(objectness_loss_refine * objectness_match_mask)/(torch.sum(objectness_match_mask)+1e-6)
         objectness_loss_refine2 = torch.sum(objectness_loss_refine * objectness_mask)/(torch.sum(objectness_mask)+1e-6)
@@ -245,7 +246,7 @@ def compute_proposal_loss(end_points, mode=''):
         
     else:
         objectness_scores = end_points['objectness_scores'+mode]
-        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS).cuda(), reduction='none')
+        criterion = nn.CrossEntropyLoss(torch.Tensor(OBJECTNESS_CLS_WEIGHTS).to(device), reduction='none')
         objectness_loss = criterion(objectness_scores.transpose(2,1), objectness_label)
         objectness_loss = torch.sum(objectness_loss * objectness_mask)/(torch.sum(objectness_mask)+1e-6)
 
@@ -304,7 +305,7 @@ def compute_box_and_sem_cls_loss(end_points, config, mode=''):
     heading_residual_normalized_label = heading_residual_label / (np.pi/num_heading_bin)
 
     # Ref: https://discuss.pytorch.org/t/convert-int-into-one-hot-format/507/3
-    heading_label_one_hot = torch.cuda.FloatTensor(batch_size, heading_class_label.shape[1], num_heading_bin).zero_()
+    heading_label_one_hot = torch.zeros(batch_size, heading_class_label.shape[1], num_heading_bin, device=heading_class_label.device)
     heading_label_one_hot.scatter_(2, heading_class_label.unsqueeze(-1), 1) # src==1 so it's *one-hot* (B,K,num_heading_bin)
     heading_residual_normalized_loss = huber_loss(torch.sum(end_points['heading_residuals_normalized'+mode]*heading_label_one_hot, -1) - heading_residual_normalized_label, delta=1.0) # (B,K)
     heading_residual_normalized_loss = torch.sum(heading_residual_normalized_loss*objectness_label)/(torch.sum(objectness_label)+1e-6)
@@ -316,12 +317,12 @@ def compute_box_and_sem_cls_loss(end_points, config, mode=''):
     size_class_loss = torch.sum(size_class_loss * objectness_label)/(torch.sum(objectness_label)+1e-6)
 
     size_residual_label = torch.gather(end_points['size_residual_label'], 1, object_assignment.unsqueeze(-1).repeat(1,1,3)) # select (B,K,3) from (B,K2,3)
-    size_label_one_hot = torch.cuda.FloatTensor(batch_size, size_class_label.shape[1], num_size_cluster).zero_()
+    size_label_one_hot = torch.zeros(batch_size, size_class_label.shape[1], num_size_cluster, device=size_class_label.device)
     size_label_one_hot.scatter_(2, size_class_label.unsqueeze(-1), 1) # src==1 so it's *one-hot* (B,K,num_size_cluster)
     size_label_one_hot_tiled = size_label_one_hot.unsqueeze(-1).repeat(1,1,1,3) # (B,K,num_size_cluster,3)
     predicted_size_residual_normalized = torch.sum(end_points['size_residuals_normalized'+mode]*size_label_one_hot_tiled, 2) # (B,K,3)
 
-    mean_size_arr_expanded = torch.from_numpy(mean_size_arr.astype(np.float32)).cuda().unsqueeze(0).unsqueeze(0) # (1,1,num_size_cluster,3) 
+    mean_size_arr_expanded = torch.from_numpy(mean_size_arr.astype(np.float32)).to(size_label_one_hot.device).unsqueeze(0).unsqueeze(0) # (1,1,num_size_cluster,3) 
     mean_size_label = torch.sum(size_label_one_hot_tiled * mean_size_arr_expanded, 2) # (B,K,3)
     size_residual_label_normalized = size_residual_label / mean_size_label # (B,K,3)
     size_residual_normalized_loss = torch.mean(huber_loss(predicted_size_residual_normalized - size_residual_label_normalized, delta=1.0), -1) # (B,K,3) -> (B,K)
@@ -372,7 +373,7 @@ def compute_matching_potential_loss(end_points, config, mode=''):
     size_residual_normalized = end_points['size_residuals_normalized'+mode]
     pred_size_class = torch.argmax(end_points['size_scores'+'center'].contiguous(), -1).detach()
     pred_size_residual = torch.gather(size_residual, 2, pred_size_class.unsqueeze(-1).unsqueeze(-1).repeat(1,1,1,3))
-    mean_size_class_batched = torch.ones_like(size_residual) * torch.from_numpy(config.mean_size_arr.astype(np.float32)).cuda().unsqueeze(0).unsqueeze(0)
+    mean_size_class_batched = torch.ones_like(size_residual) * torch.from_numpy(config.mean_size_arr.astype(np.float32)).to(size_residual.device).unsqueeze(0).unsqueeze(0)
     pred_size_avg = torch.gather(mean_size_class_batched, 2, pred_size_class.unsqueeze(-1).unsqueeze(-1).repeat(1,1,1,3)).detach()
     
     obj_size = pred_size_avg.squeeze(2) + pred_size_residual.squeeze(2)# + size_residual_opt
@@ -410,7 +411,7 @@ def compute_matching_potential_loss(end_points, config, mode=''):
     heading_residual_normalized_label = heading_residual_label / (np.pi/num_heading_bin)
 
     # Ref: https://discuss.pytorch.org/t/convert-int-into-one-hot-format/507/3
-    heading_label_one_hot = torch.cuda.FloatTensor(batch_size, heading_class_label.shape[1], num_heading_bin).zero_()
+    heading_label_one_hot = torch.zeros(batch_size, heading_class_label.shape[1], num_heading_bin, device=heading_class_label.device)
     heading_label_one_hot.scatter_(2, heading_class_label.unsqueeze(-1), 1) # src==1 so it's *one-hot* (B,K,num_heading_bin)
     if False:#mode == 'opt':
         heading_residual_normalized_loss = huber_loss(torch.sum(end_points['heading_residuals_normalized'+'center']*heading_label_one_hot, -1) - heading_residual_normalized_label, delta=1.0) # (B,K)
@@ -424,12 +425,12 @@ def compute_matching_potential_loss(end_points, config, mode=''):
     size_class_label = torch.gather(end_points['size_class_label'], 1, object_assignment) # select (B,K) from (B,K2)
     
     size_residual_label = torch.gather(end_points['size_residual_label'], 1, object_assignment.unsqueeze(-1).repeat(1,1,3)) # select (B,K,3) from (B,K2,3)
-    size_label_one_hot = torch.cuda.FloatTensor(batch_size, size_class_label.shape[1], num_size_cluster).zero_()
+    size_label_one_hot = torch.zeros(batch_size, size_class_label.shape[1], num_size_cluster, device=size_class_label.device)
     size_label_one_hot.scatter_(2, size_class_label.unsqueeze(-1), 1) # src==1 so it's *one-hot* (B,K,num_size_cluster)
     size_label_one_hot_tiled = size_label_one_hot.unsqueeze(-1).repeat(1,1,1,3) # (B,K,num_size_cluster,3)
     predicted_size_residual_normalized = torch.sum(size_residual_normalized*size_label_one_hot_tiled, 2) # (B,K,3)
 
-    mean_size_arr_expanded = torch.from_numpy(mean_size_arr.astype(np.float32)).cuda().unsqueeze(0).unsqueeze(0) # (1,1,num_size_cluster,3) 
+    mean_size_arr_expanded = torch.from_numpy(mean_size_arr.astype(np.float32)).to(size_label_one_hot.device).unsqueeze(0).unsqueeze(0) # (1,1,num_size_cluster,3) 
     mean_size_label = torch.sum(size_label_one_hot_tiled * mean_size_arr_expanded, 2) # (B,K,3)
     size_residual_label_normalized = size_residual_label / mean_size_label # (B,K,3)
 
@@ -561,7 +562,7 @@ def compute_flag_loss(end_points, mode):
 
     pred_flag = end_points['pred_flag'+mode]
     
-    criterion = nn.CrossEntropyLoss(torch.Tensor(SEM_CLS_WEIGHTS).cuda(), reduction='none')
+    criterion = nn.CrossEntropyLoss(torch.Tensor(SEM_CLS_WEIGHTS).to(pred_flag.device), reduction='none')
     sem_loss = criterion(pred_flag, sem_cls_label.long())
     sem_loss = torch.mean(sem_loss.float())
 
@@ -647,7 +648,7 @@ def get_loss(inputs, end_points, config):
     end_points['object_assignment'+'center'] = object_assignment
     total_num_proposal = objectness_label.shape[0]*objectness_label.shape[1]
     end_points['pos_ratio'] = \
-                              torch.sum(objectness_label.float().cuda())/float(total_num_proposal)
+                              torch.sum(objectness_label.float())/float(total_num_proposal)
     end_points['neg_ratio'] = \
                               torch.sum(objectness_mask.float())/float(total_num_proposal) - end_points['pos_ratio']
 
@@ -667,16 +668,16 @@ def get_loss(inputs, end_points, config):
     end_points['object_assignment'+'opt'] = object_assignment_opt
     total_num_proposal_opt = objectness_label_match.shape[0]*objectness_label_match.shape[1]
     end_points['cover_ratio_opt'] = \
-                                    torch.sum(objectness_mask_match.float().cuda())/float(total_num_proposal_opt)
+                                    torch.sum(objectness_mask_match.float())/float(total_num_proposal_opt)
     end_points['pos_ratio_opt'] = \
-                                      torch.sum(objectness_label_match.float().cuda())/float(total_num_proposal_opt)#torch.sum(objectness_mask_match.float().cuda())
+                                      torch.sum(objectness_label_match.float())/float(total_num_proposal_opt)#torch.sum(objectness_mask_match.float())
     end_points['pos_obj_ratio_opt'] = \
-                                      torch.sum(((torch.max(objectness_label_match.float().view(objectness_label.shape[0], 18, objectness_label.shape[1]), dim=1)[0])*objectness_label.float()).cuda())/torch.sum(objectness_label.float().cuda())
+                                      torch.sum(((torch.max(objectness_label_match.float().view(objectness_label.shape[0], 18, objectness_label.shape[1]), dim=1)[0])*objectness_label.float()))/torch.sum(objectness_label.float())
 
     end_points['neg_ratio_opt'] = \
                                   torch.sum(objectness_mask_match.float())/float(total_num_proposal_opt) - end_points['pos_ratio_opt']
     end_points['sem_ratio_opt'] = \
-                                  torch.sum(objectness_label_match_sem.float().cuda())/torch.sum(objectness_label_match.float().cuda())
+                                  torch.sum(objectness_label_match_sem.float())/torch.sum(objectness_label_match.float())
     assert(np.array_equal(objectness_label.detach().cpu().numpy(), objectness_label_opt.detach().cpu().numpy()))
     assert(np.array_equal(objectness_mask.detach().cpu().numpy(), objectness_mask_opt.detach().cpu().numpy()))
     assert(np.array_equal(object_assignment.detach().cpu().numpy(), object_assignment_opt.detach().cpu().numpy()))
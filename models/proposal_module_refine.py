@@ -70,13 +70,13 @@ def decode_scores(net, end_points, num_class, num_heading_bin, num_size_cluster,
         size_residuals_normalized = net_transposed[:,:,start+3+num_heading_bin*2+num_size_cluster:start+3+num_heading_bin*2+num_size_cluster*4].view([batch_size, num_proposal, num_size_cluster, 3]) # Bxnum_proposalxnum_size_clusterx3
         end_points['size_scores'+mode] = size_scores
         end_points['size_residuals_normalized'+mode] = size_residuals_normalized
-        end_points['size_residuals'+mode] = size_residuals_normalized * torch.from_numpy(mean_size_arr.astype(np.float32)).cuda().unsqueeze(0).unsqueeze(0)
+        end_points['size_residuals'+mode] = size_residuals_normalized * torch.from_numpy(mean_size_arr.astype(np.float32)).to(net.device).unsqueeze(0).unsqueeze(0)
     else:
         size_scores = net_transposed[:,:,start+3+num_heading_bin*2:start+3+num_heading_bin*2+num_size_cluster]
         size_residuals_normalized = net_transposed[:,:,start+3+num_heading_bin*2+num_size_cluster:start+3+num_heading_bin*2+num_size_cluster*4].view([batch_size, num_proposal, num_size_cluster, 3]) # Bxnum_proposalxnum_size_clusterx3
         end_points['size_scores'+mode] = size_scores
         end_points['size_residuals_normalized'+mode] = size_residuals_normalized
-        end_points['size_residuals'+mode] = size_residuals_normalized * torch.from_numpy(mean_size_arr.astype(np.float32)).cuda().unsqueeze(0).unsqueeze(0)
+        end_points['size_residuals'+mode] = size_residuals_normalized * torch.from_numpy(mean_size_arr.astype(np.float32)).to(net.device).unsqueeze(0).unsqueeze(0)
 
     if mode == 'opt':
         sem_cls_scores = net_transposed[:,:,start+3+num_heading_bin*2:start+3+num_heading_bin*2+num_size_cluster] # Bxnum_proposalx10
@@ -180,6 +180,11 @@ class ProposalModuleRefine(nn.Module):
         self.bn_refine3 = torch.nn.BatchNorm1d(128)
         
         self.softmax_normal = torch.nn.Softmax(dim=1)
+
+        # One-hot indicators of the 6 surfaces / 12 lines of every proposal,
+        # laid out like the object surface/line centers (surface-major)
+        self.register_buffer('obj_surface_indicator', torch.eye(6).repeat_interleave(self.num_proposal, dim=1), persistent=False)
+        self.register_buffer('obj_line_indicator', torch.eye(12).repeat_interleave(self.num_proposal, dim=1), persistent=False)
         
     def forward(self, xyz, features, center_z, z_feature, center_xy, xy_feature, center_line, line_feature, end_points):
         """
@@ -201,7 +206,7 @@ class ProposalModuleRefine(nn.Module):
         elif self.sampling == 'random':
             # Random sampling from the votes
             num_seed = end_points['seed_xyz'].shape[1]
-            sample_inds = torch.randint(0, num_seed, (batch_size, self.num_proposal), dtype=torch.int).cuda()
+            sample_inds = torch.randint(0, num_seed, (batch_size, self.num_proposal), dtype=torch.int, device=xyz.device)
             xyz, features, _ = self.vote_aggregation(xyz, features, sample_inds)
         else:
             log_string('Unknown sampling strategy: %s. Exiting!'%(self.sampling))
@@ -239,7 +244,7 @@ class ProposalModuleRefine(nn.Module):
         end_points['surface_center_pred'] = surface_center_pred
         end_points['surface_sem_pred'] = torch.cat((z_sem, xy_sem), dim=1)
         surface_center_feature_pred = torch.cat((z_feature, xy_feature), dim=2)
-        surface_center_feature_pred = torch.cat((torch.zeros((batch_size, 6, surface_center_feature_pred.shape[2])).cuda(), surface_center_feature_pred), dim=1)
+        surface_center_feature_pred = torch.cat((torch.zeros((batch_size, 6, surface_center_feature_pred.shape[2]), device=xyz.device), surface_center_feature_pred), dim=1)
 
         ### Extract line points and features here
         ind_normal_line = self.softmax_normal(end_points["pred_flag_line"])
@@ -257,7 +262,7 @@ class ProposalModuleRefine(nn.Module):
         size_residual = size_vote.contiguous()
         pred_size_class = torch.argmax(sizescore_vote.contiguous(), -1)
         pred_size_residual = torch.gather(size_vote.contiguous(), 2, pred_size_class.unsqueeze(-1).unsqueeze(-1).repeat(1,1,1,3))
-        mean_size_class_batched = torch.ones_like(size_residual) * torch.from_numpy(self.mean_size_arr.astype(np.float32)).cuda().unsqueeze(0).unsqueeze(0)
+        mean_size_class_batched = torch.ones_like(size_residual) * torch.from_numpy(self.mean_size_arr.astype(np.float32)).to(size_residual.device).unsqueeze(0).unsqueeze(0)
         pred_size_avg = torch.gather(mean_size_class_batched, 2, pred_size_class.unsqueeze(-1).unsqueeze(-1).repeat(1,1,1,3))
         obj_size = (pred_size_avg.squeeze(2) + pred_size_residual.squeeze(2)).detach()
 
@@ -277,56 +282,17 @@ class ProposalModuleRefine(nn.Module):
         obj_surface_feature = original_feature.repeat(1,1,6)
         end_points['surface_center_object'] = obj_surface_center
         # Add an indicator for different surfaces
-        obj_upper_indicator = torch.zeros((batch_size, object_proposal, 6)).cuda()
-        obj_upper_indicator[:,:,0] = 1
-        obj_lower_indicator = torch.zeros((batch_size, object_proposal, 6)).cuda()
-        obj_lower_indicator[:,:,1] = 1
-        obj_front_indicator = torch.zeros((batch_size, object_proposal, 6)).cuda()
-        obj_front_indicator[:,:,2] = 1
-        obj_back_indicator = torch.zeros((batch_size, object_proposal, 6)).cuda()
-        obj_back_indicator[:,:,3] = 1
-        obj_left_indicator = torch.zeros((batch_size, object_proposal, 6)).cuda()
-        obj_left_indicator[:,:,4] = 1
-        obj_right_indicator = torch.zeros((batch_size, object_proposal, 6)).cuda()
-        obj_right_indicator[:,:,5] = 1
-        obj_surface_indicator = torch.cat((obj_upper_indicator, obj_lower_indicator, obj_front_indicator, obj_back_indicator, obj_left_indicator, obj_right_indicator), dim=1).transpose(2,1).contiguous()
+        obj_surface_indicator = self.obj_surface_indicator.unsqueeze(0).expand(batch_size, -1, -1)
         obj_surface_feature = torch.cat((obj_surface_indicator, obj_surface_feature), dim=1)
         
         obj_line_feature = original_feature.repeat(1,1,12)
         end_points['line_center_object'] = obj_line_center
         # Add an indicator for different lines
-        obj_line_indicator0 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator0[:,0,:] = 1
-        obj_line_indicator1 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator1[:,1,:] = 1
-        obj_line_indicator2 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator2[:,2,:] = 1
-        obj_line_indicator3 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator3[:,3,:] = 1
-        
-        obj_line_indicator4 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator4[:,4,:] = 1
-        obj_line_indicator5 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator5[:,5,:] = 1
-        obj_line_indicator6 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator6[:,6,:] = 1
-        obj_line_indicator7 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator7[:,7,:] = 1
-
-        obj_line_indicator8 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator8[:,8,:] = 1
-        obj_line_indicator9 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator9[:,9,:] = 1
-        obj_line_indicator10 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator10[:,10,:] = 1
-        obj_line_indicator11 = torch.zeros((batch_size, 12, object_proposal)).cuda()
-        obj_line_indicator11[:,11,:] = 1
-
-        obj_line_indicator = torch.cat((obj_line_indicator0, obj_line_indicator1, obj_line_indicator2, obj_line_indicator3, obj_line_indicator4, obj_line_indicator5, obj_line_indicator6, obj_line_indicator7, obj_line_indicator8, obj_line_indicator9, obj_line_indicator10, obj_line_indicator11), dim=2)
+        obj_line_indicator = self.obj_line_indicator.unsqueeze(0).expand(batch_size, -1, -1)
         obj_line_feature = torch.cat((obj_line_indicator, obj_line_feature), dim=1)
         
         surface_xyz, surface_features, _ = self.match_surface_center(torch.cat((obj_surface_center, surface_center_pred), dim=1), torch.cat((obj_surface_feature, surface_center_feature_pred), dim=2))
-        line_feature = torch.cat((torch.zeros((batch_size, 12, line_feature.shape[2])).cuda(), line_feature), dim=1)
+        line_feature = torch.cat((torch.zeros((batch_size, 12, line_feature.shape[2]), device=xyz.device), line_feature), dim=1)
         line_xyz, line_features, _ = self.match_line_center(torch.cat((obj_line_center, line_center), dim=1), torch.cat((obj_line_feature, line_feature), dim=2))
 
         combine_features = torch.cat((surface_features.contiguous(), line_features.contiguous()), dim=2)
@@ -355,7 +321,7 @@ class ProposalModuleRefine(nn.Module):
         combine_feature = torch.cat((surface_pool_feature, line_pool_feature), dim=1)
 
         net = F.relu(self.bn_refine1(self.conv_refine1(combine_feature)))
-        net += original_feature
+        net = net + original_feature
         net = F.relu(self.bn_refine2(self.conv_refine2(net)))
         net = F.relu(self.bn_refine3(self.conv_refine3(net)))
         net = self.conv_refine4(net) # (batch_size, 2+3+num_heading_bin*2+num_size_cluster*4, num_proposal)
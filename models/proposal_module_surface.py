@@ -12,7 +12,7 @@ import sys
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'pointnet2'))
-from pointnet2_modules import PointnetSAModuleVotes
+from pointnet2_modules import PointnetSAModuleVotes, PointnetSAModuleVotesStacked
 import pointnet2_utils
 
 def decode_scores(net, end_points, num_class, mode=''):
@@ -92,7 +92,7 @@ class PrimitiveModule(nn.Module):
         elif self.sampling == 'random':
             # Random sampling from the votes
             num_seed = end_points['seed_xyz'].shape[1]
-            sample_inds = torch.randint(0, num_seed, (batch_size, self.num_proposal), dtype=torch.int).cuda()
+            sample_inds = torch.randint(0, num_seed, (batch_size, self.num_proposal), dtype=torch.int, device=xyz.device)
             xyz, features, _ = self.vote_aggregation(xyz, features, sample_inds)
         else:
             log_string('Unknown sampling strategy: %s. Exiting!'%(self.sampling))
@@ -109,4 +109,81 @@ class PrimitiveModule(nn.Module):
         newcenter, end_points = decode_scores(net, end_points, self.num_class, mode=mode)
         return newcenter.contiguous(), features.contiguous(), end_points
 
+class PrimitiveModuleStacked(nn.Module):
+    """ Several PrimitiveModule (one per numd) run as one: the vote sets are
+    folded into the batch for the ball query and grouping, and the shared MLP,
+    conv1 and conv2 are grouped convs with one group per primitive. Only conv3,
+    whose width depends on numd, stays a separate head per primitive.
+    """
+    def __init__(self, num_class, num_heading_bin, num_size_cluster, mean_size_arr, num_proposal, sampling, seed_feat_dim=256, numds=(2, 1, 0)):
+        super().__init__() 
+
+        self.num_class = num_class
+        self.num_heading_bin = num_heading_bin
+        self.num_size_cluster = num_size_cluster
+        self.mean_size_arr = mean_size_arr
+        self.num_proposal = num_proposal
+        self.sampling = sampling
+        self.seed_feat_dim = seed_feat_dim
+        self.num_primitives = len(numds)
+
+        # Vote clustering
+        self.vote_aggregation = PointnetSAModuleVotesStacked( 
+                npoint=self.num_proposal,
+                radius=0.3,
+                nsample=16,
+                mlp=[self.seed_feat_dim, 128, 128, 128],
+                num_towers=self.num_primitives,
+                normalize_xyz=True,
+                same_idx=True
+            )
+    
+        # Object proposal/detection
+        T = self.num_primitives
+        self.conv1 = torch.nn.Conv1d(128*T,128*T,1,groups=T)
+        self.conv2 = torch.nn.Conv1d(128*T,128*T,1,groups=T)
+        self.conv3 = nn.ModuleList([torch.nn.Conv1d(128,3+numd+self.num_class,1) for numd in numds])
+        self.bn1 = torch.nn.BatchNorm1d(128*T)
+        self.bn2 = torch.nn.BatchNorm1d(128*T)
+
+    def forward(self, xyz, features, end_points, modes):
+        """
+        Args:
+            xyz: (B,T,K,3) votes of the T primitives
+            features: (B,T*C,K) stacked vote features
+            modes: list of T end_points suffixes, e.g. ['_z', '_xy', '_line']
+        Returns:
+            centers: list of T (B,K,3)
+            features: list of T (B,128,K)
+        """
+        batch_size = xyz.shape[0]
+        if self.sampling == 'vote_fps':
+            sample_inds = None
+        elif self.sampling == 'seed_fps': 
+            sample_inds = pointnet2_utils.furthest_point_sample(end_points['seed_xyz'], self.num_proposal)
+        elif self.sampling == 'random':
+            num_seed = end_points['seed_xyz'].shape[1]
+            sample_inds = torch.randint(0, num_seed, (batch_size, self.num_proposal), dtype=torch.int, device=xyz.device)
+        else:
+            log_string('Unknown sampling strategy: %s. Exiting!'%(self.sampling))
+            exit()
+        # same_idx: every vote is a center, the inds are only recorded
+        xyz, features, _ = self.vote_aggregation(xyz, features)
+        
+        # --------- PROPOSAL GENERATION ---------
+        net = F.relu(self.bn1(self.conv1(features))) 
+        last_net = F.relu(self.bn2(self.conv2(net))) 
+        features = features.view(batch_size, self.num_primitives, 128, -1)
+        last_net = last_net.view(batch_size, self.num_primitives, 128, -1)
 
+        centers = []
+        primitive_features = []
+        for i, mode in enumerate(modes):
+            end_points['aggregated_vote_xyz'+mode] = xyz[:,i] # (batch_size, num_proposal, 3)
+            end_points['aggregated_vote_inds'+mode] = sample_inds
+            end_points['aggregated_feature'+mode] = features[:,i]
+            net = self.conv3[i](last_net[:,i])
+            newcenter, end_points = decode_scores(net, end_points, self.num_class, mode=mode)
+            centers.append(newcenter.contiguous())
+            primitive_features.append(features[:,i].contiguous())
+        return centers, primitive_features, end_points
@@ -64,6 +64,65 @@ class VotingModule(nn.Module):
         
         return vote_xyz, vote_features, offset.squeeze(2), residual_features
  
+class VotingModuleStacked(nn.Module):
+    def __init__(self, vote_factor, seed_feature_dim, num_heads):
+        """ Several VotingModule heads on the same seeds, computed in one pass:
+        conv1 is shared-input (heads stacked on the output channels), conv2 and
+        conv3 are grouped convs with one group per head. The weights are the
+        VotingModule weights stacked along the output channels
+        (see pytorch_utils.stack_state_dict).
+
+        Args:
+            vote_facotr: int
+                number of votes generated from each seed point
+            seed_feature_dim: int
+                number of channels of seed point features
+            num_heads: int
+                number of stacked VotingModule heads
+        """
+        super().__init__()
+        self.vote_factor = vote_factor
+        self.num_heads = num_heads
+        self.in_dim = seed_feature_dim
+        self.out_dim = self.in_dim # due to residual feature, in_dim has to be == out_dim
+        self.conv1 = torch.nn.Conv1d(self.in_dim, self.in_dim * num_heads, 1)
+        self.conv2 = torch.nn.Conv1d(self.in_dim * num_heads, self.in_dim * num_heads, 1, groups=num_heads)
+        self.conv3 = torch.nn.Conv1d(self.in_dim * num_heads, (3+self.out_dim) * self.vote_factor * num_heads, 1, groups=num_heads)
+        self.bn1 = torch.nn.BatchNorm1d(self.in_dim * num_heads)
+        self.bn2 = torch.nn.BatchNorm1d(self.in_dim * num_heads)
+
+    def forward(self, seed_xyz, seed_features):
+        """ Forward pass.
+
+        Arguments:
+            seed_xyz: (batch_size, num_seed, 3) Pytorch tensor
+            seed_features: (batch_size, feature_dim, num_seed) Pytorch tensor
+        Returns:
+            vote_xyz: (batch_size, num_heads, num_seed*vote_factor, 3)
+            vote_features: (batch_size, num_heads, vote_feature_dim, num_seed*vote_factor)
+            offset: (batch_size, num_heads, num_seed, vote_factor, 3)
+            residual_features: (batch_size, num_heads, num_seed, vote_factor, out_dim)
+        """
+        batch_size = seed_xyz.shape[0]
+        num_seed = seed_xyz.shape[1]
+        num_vote = num_seed*self.vote_factor
+        net = F.relu(self.bn1(self.conv1(seed_features)))
+        net = F.relu(self.bn2(self.conv2(net)))
+        net = self.conv3(net) # (batch_size, num_heads*(3+out_dim)*vote_factor, num_seed)
+
+        net = net.view(batch_size, self.num_heads, -1, num_seed).transpose(3,2)
+        net = net.contiguous().view(batch_size, self.num_heads, num_seed, self.vote_factor, 3+self.out_dim)
+        offset = net[:,:,:,:,:3]
+        vote_xyz = seed_xyz.unsqueeze(1).unsqueeze(3) + offset
+        vote_xyz = vote_xyz.contiguous().view(batch_size, self.num_heads, num_vote, 3)
+
+        residual_features = net[:,:,:,:,3:] # (batch_size, num_heads, num_seed, vote_factor, out_dim)
+        vote_features = seed_features.transpose(2,1).unsqueeze(1).unsqueeze(3) + residual_features
+        vote_features = vote_features.contiguous().view(batch_size, self.num_heads, num_vote, self.out_dim)
+        vote_features = vote_features.transpose(3,2).contiguous()
+
+        return vote_xyz, vote_features, offset, residual_features
+
 if __name__=='__main__':
     net = VotingModule(2, 256).cuda()
     xyz, features = net(torch.rand(8,1024,3).cuda(), torch.rand(8,256,1024).cuda())
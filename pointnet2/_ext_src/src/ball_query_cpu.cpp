@@ -0,0 +1,42 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// 
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+
+#include <ATen/Parallel.h>
+
+// input: new_xyz(b, m, 3) xyz(b, n, 3)
+// output: idx(b, m, nsample)
+void query_ball_point_kernel_cpu(int b, int n, int m, float radius,
+                                 int nsample, const float *new_xyz,
+                                 const float *xyz, int *idx) {
+  float radius2 = radius * radius;
+  at::parallel_for(0, b * m, 16, [&](int64_t start, int64_t end) {
+    for (int64_t bj = start; bj < end; ++bj) {
+      int batch_index = bj / m;
+      const float *xyz_b = xyz + batch_index * n * 3;
+      const float *q = new_xyz + bj * 3;
+      int *idx_j = idx + bj * nsample;
+
+      float new_x = q[0];
+      float new_y = q[1];
+      float new_z = q[2];
+      for (int k = 0, cnt = 0; k < n && cnt < nsample; ++k) {
+        float x = xyz_b[k * 3 + 0];
+        float y = xyz_b[k * 3 + 1];
+        float z = xyz_b[k * 3 + 2];
+        float d2 = (new_x - x) * (new_x - x) + (new_y - y) * (new_y - y) +
+                   (new_z - z) * (new_z - z);
+        if (d2 < radius2) {
+          if (cnt == 0) {
+            for (int l = 0; l < nsample; ++l) {
+              idx_j[l] = k;
+            }
+          }
+          idx_j[cnt] = k;
+          ++cnt;
+        }
+      }
+    }
+  });
+}
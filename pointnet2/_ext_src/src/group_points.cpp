@@ -14,6 +14,12 @@ void group_points_grad_kernel_wrapper(int b, int c, int n, int npoints,
                                       int nsample, const float *grad_out,
                                       const int *idx, float *grad_points);
 
+void group_points_kernel_cpu(int b, int c, int n, int npoints, int nsample,
+                             const float *points, const int *idx, float *out);
+void group_points_grad_kernel_cpu(int b, int c, int n, int npoints,
+                                  int nsample, const float *grad_out,
+                                  const int *idx, float *grad_points);
+
 at::Tensor group_points(at::Tensor points, at::Tensor idx) {
   CHECK_CONTIGUOUS(points);
   CHECK_CONTIGUOUS(idx);
@@ -33,7 +39,9 @@ at::Tensor group_points(at::Tensor points, at::Tensor idx) {
                                 idx.size(1), idx.size(2), points.data<float>(),
                                 idx.data<int>(), output.data<float>());
   } else {
-    AT_CHECK(false, "CPU not supported");
+    group_points_kernel_cpu(points.size(0), points.size(1), points.size(2),
+                            idx.size(1), idx.size(2), points.data<float>(),
+                            idx.data<int>(), output.data<float>());
   }
 
   return output;
@@ -58,7 +66,9 @@ at::Tensor group_points_grad(at::Tensor grad_out, at::Tensor idx, const int n) {
         grad_out.size(0), grad_out.size(1), n, idx.size(1), idx.size(2),
         grad_out.data<float>(), idx.data<int>(), output.data<float>());
   } else {
-    AT_CHECK(false, "CPU not supported");
+    group_points_grad_kernel_cpu(
+        grad_out.size(0), grad_out.size(1), n, idx.size(1), idx.size(2),
+        grad_out.data<float>(), idx.data<int>(), output.data<float>());
   }
 
   return output;
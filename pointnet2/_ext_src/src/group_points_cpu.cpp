@@ -0,0 +1,43 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// 
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+
+#include <ATen/Parallel.h>
+
+// input: points(b, c, n) idx(b, npoints, nsample)
+// output: out(b, c, npoints, nsample)
+void group_points_kernel_cpu(int b, int c, int n, int npoints, int nsample,
+                             const float *points, const int *idx, float *out) {
+  at::parallel_for(0, b * c, 1, [&](int64_t start, int64_t end) {
+    for (int64_t bc = start; bc < end; ++bc) {
+      int batch_index = bc / c;
+      const float *points_c = points + bc * n;
+      const int *idx_b = idx + batch_index * npoints * nsample;
+      float *out_c = out + bc * npoints * nsample;
+      for (int k = 0; k < npoints * nsample; ++k) {
+        out_c[k] = points_c[idx_b[k]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, npoints, nsample), idx(b, npoints, nsample)
+// output: grad_points(b, c, n)
+// Each (batch, channel) row is owned by one task, so the scatter-add below
+// needs no atomics.
+void group_points_grad_kernel_cpu(int b, int c, int n, int npoints,
+                                  int nsample, const float *grad_out,
+                                  const int *idx, float *grad_points) {
+  at::parallel_for(0, b * c, 1, [&](int64_t start, int64_t end) {
+    for (int64_t bc = start; bc < end; ++bc) {
+      int batch_index = bc / c;
+      const float *grad_out_c = grad_out + bc * npoints * nsample;
+      const int *idx_b = idx + batch_index * npoints * nsample;
+      float *grad_points_c = grad_points + bc * n;
+      for (int k = 0; k < npoints * nsample; ++k) {
+        grad_points_c[idx_b[k]] += grad_out_c[k];
+      }
+    }
+  });
+}
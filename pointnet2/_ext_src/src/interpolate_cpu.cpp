@@ -0,0 +1,100 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// 
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+
+#include <ATen/Parallel.h>
+
+// input: unknown(b, n, 3) known(b, m, 3)
+// output: dist2(b, n, 3), idx(b, n, 3)
+void three_nn_kernel_cpu(int b, int n, int m, const float *unknown,
+                         const float *known, float *dist2, int *idx) {
+  at::parallel_for(0, b * n, 16, [&](int64_t start, int64_t end) {
+    for (int64_t bj = start; bj < end; ++bj) {
+      int batch_index = bj / n;
+      const float *known_b = known + batch_index * m * 3;
+
+      float ux = unknown[bj * 3 + 0];
+      float uy = unknown[bj * 3 + 1];
+      float uz = unknown[bj * 3 + 2];
+
+      double best1 = 1e40, best2 = 1e40, best3 = 1e40;
+      int besti1 = 0, besti2 = 0, besti3 = 0;
+      for (int k = 0; k < m; ++k) {
+        float x = known_b[k * 3 + 0];
+        float y = known_b[k * 3 + 1];
+        float z = known_b[k * 3 + 2];
+        float d =
+            (ux - x) * (ux - x) + (uy - y) * (uy - y) + (uz - z) * (uz - z);
+        if (d < best1) {
+          best3 = best2;
+          besti3 = besti2;
+          best2 = best1;
+          besti2 = besti1;
+          best1 = d;
+          besti1 = k;
+        } else if (d < best2) {
+          best3 = best2;
+          besti3 = besti2;
+          best2 = d;
+          besti2 = k;
+        } else if (d < best3) {
+          best3 = d;
+          besti3 = k;
+        }
+      }
+      dist2[bj * 3 + 0] = best1;
+      dist2[bj * 3 + 1] = best2;
+      dist2[bj * 3 + 2] = best3;
+
+      idx[bj * 3 + 0] = besti1;
+      idx[bj * 3 + 1] = besti2;
+      idx[bj * 3 + 2] = besti3;
+    }
+  });
+}
+
+// input: points(b, c, m), idx(b, n, 3), weight(b, n, 3)
+// output: out(b, c, n)
+void three_interpolate_kernel_cpu(int b, int c, int m, int n,
+                                  const float *points, const int *idx,
+                                  const float *weight, float *out) {
+  at::parallel_for(0, b * c, 1, [&](int64_t start, int64_t end) {
+    for (int64_t bc = start; bc < end; ++bc) {
+      int batch_index = bc / c;
+      const float *points_c = points + bc * m;
+      const int *idx_b = idx + batch_index * n * 3;
+      const float *weight_b = weight + batch_index * n * 3;
+      float *out_c = out + bc * n;
+      for (int j = 0; j < n; ++j) {
+        out_c[j] = weight_b[j * 3 + 0] * points_c[idx_b[j * 3 + 0]] +
+                   weight_b[j * 3 + 1] * points_c[idx_b[j * 3 + 1]] +
+                   weight_b[j * 3 + 2] * points_c[idx_b[j * 3 + 2]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, n), idx(b, n, 3), weight(b, n, 3)
+// output: grad_points(b, c, m)
+// Each (batch, channel) row is owned by one task, so the scatter-add below
+// needs no atomics.
+void three_interpolate_grad_kernel_cpu(int b, int c, int n, int m,
+                                       const float *grad_out, const int *idx,
+                                       const float *weight,
+                                       float *grad_points) {
+  at::parallel_for(0, b * c, 1, [&](int64_t start, int64_t end) {
+    for (int64_t bc = start; bc < end; ++bc) {
+      int batch_index = bc / c;
+      const float *grad_out_c = grad_out + bc * n;
+      const int *idx_b = idx + batch_index * n * 3;
+      const float *weight_b = weight + batch_index * n * 3;
+      float *grad_points_c = grad_points + bc * m;
+      for (int j = 0; j < n; ++j) {
+        grad_points_c[idx_b[j * 3 + 0]] += grad_out_c[j] * weight_b[j * 3 + 0];
+        grad_points_c[idx_b[j * 3 + 1]] += grad_out_c[j] * weight_b[j * 3 + 1];
+        grad_points_c[idx_b[j * 3 + 2]] += grad_out_c[j] * weight_b[j * 3 + 2];
+      }
+    }
+  });
+}
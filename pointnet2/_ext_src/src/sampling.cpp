@@ -17,6 +17,16 @@ void furthest_point_sampling_kernel_wrapper(int b, int n, int m,
                                             const float *dataset, float *temp,
                                             int *idxs);
 
+void gather_points_kernel_cpu(int b, int c, int n, int npoints,
+                              const float *points, const int *idx,
+                              float *out);
+void gather_points_grad_kernel_cpu(int b, int c, int n, int npoints,
+                                   const float *grad_out, const int *idx,
+                                   float *grad_points);
+void furthest_point_sampling_kernel_cpu(int b, int n, int m,
+                                        const float *dataset, float *temp,
+                                        int *idxs);
+
 at::Tensor gather_points(at::Tensor points, at::Tensor idx) {
   CHECK_CONTIGUOUS(points);
   CHECK_CONTIGUOUS(idx);
@@ -36,7 +46,9 @@ at::Tensor gather_points(at::Tensor points, at::Tensor idx) {
                                  idx.size(1), points.data<float>(),
                                  idx.data<int>(), output.data<float>());
   } else {
-    AT_CHECK(false, "CPU not supported");
+    gather_points_kernel_cpu(points.size(0), points.size(1), points.size(2),
+                             idx.size(1), points.data<float>(),
+                             idx.data<int>(), output.data<float>());
   }
 
   return output;
@@ -62,7 +74,9 @@ at::Tensor gather_points_grad(at::Tensor grad_out, at::Tensor idx,
                                       idx.size(1), grad_out.data<float>(),
                                       idx.data<int>(), output.data<float>());
   } else {
-    AT_CHECK(false, "CPU not supported");
+    gather_points_grad_kernel_cpu(grad_out.size(0), grad_out.size(1), n,
+                                  idx.size(1), grad_out.data<float>(),
+                                  idx.data<int>(), output.data<float>());
   }
 
   return output;
@@ -84,7 +98,9 @@ at::Tensor furthest_point_sampling(at::Tensor points, const int nsamples) {
         points.size(0), points.size(1), nsamples, points.data<float>(),
         tmp.data<float>(), output.data<int>());
   } else {
-    AT_CHECK(false, "CPU not supported");
+    furthest_point_sampling_kernel_cpu(
+        points.size(0), points.size(1), nsamples, points.data<float>(),
+        tmp.data<float>(), output.data<int>());
   }
 
   return output;
@@ -0,0 +1,108 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// 
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <vector>
+
+// input: points(b, c, n) idx(b, m)
+// output: out(b, c, m)
+void gather_points_kernel_cpu(int b, int c, int n, int npoints,
+                              const float *points, const int *idx,
+                              float *out) {
+  at::parallel_for(0, b * c, 1, [&](int64_t start, int64_t end) {
+    for (int64_t bc = start; bc < end; ++bc) {
+      int batch_index = bc / c;
+      const float *points_c = points + bc * n;
+      const int *idx_b = idx + batch_index * npoints;
+      float *out_c = out + bc * npoints;
+      for (int j = 0; j < npoints; ++j) {
+        out_c[j] = points_c[idx_b[j]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, m) idx(b, m)
+// output: grad_points(b, c, n)
+// Each (batch, channel) row is owned by one task, so the scatter-add below
+// needs no atomics.
+void gather_points_grad_kernel_cpu(int b, int c, int n, int npoints,
+                                   const float *grad_out, const int *idx,
+                                   float *grad_points) {
+  at::parallel_for(0, b * c, 1, [&](int64_t start, int64_t end) {
+    for (int64_t bc = start; bc < end; ++bc) {
+      int batch_index = bc / c;
+      const float *grad_out_c = grad_out + bc * npoints;
+      const int *idx_b = idx + batch_index * npoints;
+      float *grad_points_c = grad_points + bc * n;
+      for (int j = 0; j < npoints; ++j) {
+        grad_points_c[idx_b[j]] += grad_out_c[j];
+      }
+    }
+  });
+}
+
+// Input dataset: (b, n, 3), tmp: (b, n)
+// Ouput idxs (b, m)
+// Sampling is sequential in m, so the work is split over point blocks
+// instead: every block reports its local argmax and the blocks are reduced
+// in order, which keeps the first (lowest index) maximum on ties.
+void furthest_point_sampling_kernel_cpu(int b, int n, int m,
+                                        const float *dataset, float *temp,
+                                        int *idxs) {
+  if (m <= 0) return;
+  const int block_size = 2048;
+  const int n_blocks = (n + block_size - 1) / block_size;
+  std::vector<float> block_best(n_blocks);
+  std::vector<int> block_besti(n_blocks);
+
+  for (int batch_index = 0; batch_index < b; ++batch_index) {
+    const float *dataset_b = dataset + batch_index * n * 3;
+    float *temp_b = temp + batch_index * n;
+    int *idxs_b = idxs + batch_index * m;
+
+    int old = 0;
+    idxs_b[0] = old;
+    for (int j = 1; j < m; j++) {
+      float x1 = dataset_b[old * 3 + 0];
+      float y1 = dataset_b[old * 3 + 1];
+      float z1 = dataset_b[old * 3 + 2];
+      at::parallel_for(0, n_blocks, 1, [&](int64_t start, int64_t end) {
+        for (int64_t blk = start; blk < end; ++blk) {
+          int besti = 0;
+          float best = -1;
+          int k_end = std::min<int>(n, (blk + 1) * block_size);
+          for (int k = blk * block_size; k < k_end; ++k) {
+            float x2 = dataset_b[k * 3 + 0];
+            float y2 = dataset_b[k * 3 + 1];
+            float z2 = dataset_b[k * 3 + 2];
+            float mag = (x2 * x2) + (y2 * y2) + (z2 * z2);
+            if (mag <= 1e-3) continue;
+
+            float d = (x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1) +
+                      (z2 - z1) * (z2 - z1);
+
+            float d2 = std::min(d, temp_b[k]);
+            temp_b[k] = d2;
+            besti = d2 > best ? k : besti;
+            best = d2 > best ? d2 : best;
+          }
+          block_best[blk] = best;
+          block_besti[blk] = besti;
+        }
+      });
+
+      int besti = 0;
+      float best = -1;
+      for (int blk = 0; blk < n_blocks; ++blk) {
+        besti = block_best[blk] > best ? block_besti[blk] : besti;
+        best = block_best[blk] > best ? block_best[blk] : best;
+      }
+      old = besti;
+      idxs_b[j] = old;
+    }
+  }
+}
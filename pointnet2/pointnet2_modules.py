@@ -180,6 +180,7 @@ class PointnetSAModuleVotes(nn.Module):
             sample_uniformly: bool = False,
             ret_unique_cnt: bool = False,
             same_idx: bool = False,
+            use_grid: bool = False, # voxel-grid ball query for large scenes
     ):
         super().__init__()
 
@@ -199,7 +200,8 @@ class PointnetSAModuleVotes(nn.Module):
         if npoint is not None:
             self.grouper = pointnet2_utils.QueryAndGroup(radius, nsample,
                 use_xyz=use_xyz, ret_grouped_xyz=True, normalize_xyz=normalize_xyz,
-                sample_uniformly=sample_uniformly, ret_unique_cnt=ret_unique_cnt)
+                sample_uniformly=sample_uniformly, ret_unique_cnt=ret_unique_cnt,
+                use_grid=use_grid, ret_idx=True)
         else:
             self.grouper = pointnet2_utils.GroupAll(use_xyz, ret_grouped_xyz=True)
 
@@ -211,7 +213,9 @@ class PointnetSAModuleVotes(nn.Module):
 
     def forward(self, xyz: torch.Tensor,
                 features: torch.Tensor = None,
-                inds: torch.Tensor = None) -> (torch.Tensor, torch.Tensor):
+                inds: torch.Tensor = None,
+                group: tuple = None,
+                ret_group: bool = False) -> (torch.Tensor, torch.Tensor):
         r"""
         Parameters
         ----------
@@ -221,6 +225,12 @@ class PointnetSAModuleVotes(nn.Module):
             (B, C, N) tensor of the descriptors of the the features
         inds : torch.Tensor
             (B, npoint) tensor that stores index to the xyz points (values in 0-N-1)
+        group : tuple
+            (idx, grouped_xyz) returned by a previous call with ret_group=True
+            on the same xyz and inds; reused instead of redoing the ball query
+            and xyz grouping (e.g. across towers sharing the same sampling)
+        ret_group : bool
+            also return (idx, grouped_xyz) as the last output
 
         Returns
         -------
@@ -244,13 +254,18 @@ class PointnetSAModuleVotes(nn.Module):
         else:
             new_xyz = xyz
 
-        if not self.ret_unique_cnt:
+        group_idx, grouped_xyz = group if group is not None else (None, None)
+        if self.npoint is None:
             grouped_features, grouped_xyz = self.grouper(
                 xyz, new_xyz, features
+            )  # (B, C, 1, N)
+        elif not self.ret_unique_cnt:
+            grouped_features, grouped_xyz, group_idx = self.grouper(
+                xyz, new_xyz, features, idx=group_idx, grouped_xyz=grouped_xyz
             )  # (B, C, npoint, nsample)
         else:
-            grouped_features, grouped_xyz, unique_cnt = self.grouper(
-                xyz, new_xyz, features
+            grouped_features, grouped_xyz, unique_cnt, group_idx = self.grouper(
+                xyz, new_xyz, features, idx=group_idx, grouped_xyz=grouped_xyz
             )  # (B, C, npoint, nsample), (B,3,npoint,nsample), (B,npoint)
 
         new_features = self.mlp_module(
@@ -271,10 +286,121 @@ class PointnetSAModuleVotes(nn.Module):
             new_features = torch.sum(new_features * rbf.unsqueeze(1), -1, keepdim=True) / float(self.nsample) # (B, mlp[-1], npoint, 1)
         new_features = new_features.squeeze(-1)  # (B, mlp[-1], npoint)
 
-        if not self.ret_unique_cnt:
-            return new_xyz, new_features, inds
+        ret = [new_xyz, new_features, inds]
+        if self.ret_unique_cnt:
+            ret.append(unique_cnt)
+        if ret_group:
+            ret.append((group_idx, grouped_xyz))
+        return tuple(ret)
+
+class PointnetSAModuleVotesStacked(nn.Module):
+    ''' PointnetSAModuleVotes for several towers that share sampling and
+    grouping but have their own MLP weights. The tower features are stacked
+    along the channel dim and the MLPs run as one grouped 1x1 conv per layer
+    (max pooling only). With same_idx every tower groups around all of its
+    own points instead, and the towers are folded into the batch for the
+    ball query and grouping '''
+
+    def __init__(
+            self,
+            *,
+            mlp: List[int],
+            npoint: int,
+            radius: float,
+            nsample: int,
+            num_towers: int,
+            bn: bool = True,
+            normalize_xyz: bool = False, # noramlize local XYZ with radius
+            use_grid: bool = False, # voxel-grid ball query for large scenes
+            same_idx: bool = False,
+    ):
+        super().__init__()
+
+        self.npoint = npoint
+        self.radius = radius
+        self.nsample = nsample
+        self.num_towers = num_towers
+        self.normalize_xyz = normalize_xyz
+        self.use_grid = use_grid
+        self.same_idx = same_idx
+
+        mlp_spec = [c * num_towers for c in mlp]
+        mlp_spec[0] += 3 * num_towers
+        self.mlp_module = pt_utils.SharedMLP(mlp_spec, bn=bn, groups=num_towers)
+
+    def forward(self, xyz: torch.Tensor,
+                features: torch.Tensor = None,
+                inds: torch.Tensor = None) -> (torch.Tensor, torch.Tensor):
+        r"""
+        Parameters
+        ----------
+        xyz : torch.Tensor
+            (B, N, 3) tensor of the xyz coordinates of the features,
+            (B, T, N, 3) with one point set per tower if same_idx
+        features : torch.Tensor
+            (B, T*C, N) tensor of the stacked descriptors of the T towers
+        inds : torch.Tensor
+            (B, npoint) tensor that stores index to the xyz points (values in 0-N-1)
+
+        Returns
+        -------
+        new_xyz : torch.Tensor
+            (B, npoint, 3) tensor of the new features' xyz (xyz if same_idx)
+        new_features : torch.Tensor
+            (B, T*mlp[-1], npoint) tensor of the stacked new_features descriptors
+            (npoint = N if same_idx)
+        inds: torch.Tensor
+            (B, npoint) tensor of the inds
+        """
+        B = xyz.size(0)
+        C = features.size(1) // self.num_towers if features is not None else 0
+        if not self.same_idx:
+            xyz_flipped = xyz.transpose(1, 2).contiguous()
+            if inds is None:
+                inds = pointnet2_utils.furthest_point_sample(xyz, self.npoint)
+            else:
+                assert(inds.shape[1] == self.npoint)
+            new_xyz = pointnet2_utils.gather_operation(
+                xyz_flipped, inds
+            ).transpose(1, 2).contiguous()
+            center_xyz = new_xyz
         else:
-            return new_xyz, new_features, inds, unique_cnt
+            # Fold the towers into the batch: (B*T, N, 3) and (B*T, C, N)
+            new_xyz = xyz
+            xyz = xyz.reshape(B * self.num_towers, -1, 3)
+            xyz_flipped = xyz.transpose(1, 2).contiguous()
+            center_xyz = xyz
+            if features is not None:
+                features = features.reshape(B * self.num_towers, C, -1)
+
+        # One ball query / grouping for all towers
+        if self.use_grid:
+            idx = pointnet2_utils.grid_ball_query(self.radius, self.nsample, xyz, center_xyz)
+        else:
+            idx = pointnet2_utils.ball_query(self.radius, self.nsample, xyz, center_xyz)
+        grouped_xyz = pointnet2_utils.grouping_operation(xyz_flipped, idx)  # (B or B*T, 3, npoint, nsample)
+        grouped_xyz -= center_xyz.transpose(1, 2).unsqueeze(-1)
+        if self.normalize_xyz:
+            grouped_xyz /= self.radius
+
+        # Put the local xyz in front of every tower's features, written once
+        # into (B, T, 3+C, npoint, nsample)
+        npoint, nsample = grouped_xyz.shape[2:]
+        grouped_features = grouped_xyz.new_empty(B, self.num_towers, 3 + C, npoint, nsample)
+        grouped_features[:, :, :3] = grouped_xyz.view(B, -1, 3, npoint, nsample)
+        if features is not None:
+            grouped_features[:, :, 3:] = pointnet2_utils.grouping_operation(
+                features, idx).view(B, self.num_towers, C, npoint, nsample)
+        grouped_features = grouped_features.view(B, -1, npoint, nsample)
+
+        new_features = self.mlp_module(
+            grouped_features
+        )  # (B, T*mlp[-1], npoint, nsample)
+        new_features = F.max_pool2d(
+            new_features, kernel_size=[1, new_features.size(3)]
+        ).squeeze(-1)  # (B, T*mlp[-1], npoint)
+
+        return new_xyz, new_features, inds
 
 class PointnetSAModuleVotesWith(nn.Module):
     ''' Modified based on _PointnetSAModuleBase and PointnetSAModuleMSG
@@ -1080,6 +1206,65 @@ class PointnetFPModule(nn.Module):
 
         return new_features.squeeze(-1)
 
+class PointnetFPModuleStacked(nn.Module):
+    r"""PointnetFPModule for several towers whose features are stacked along
+    the channel dim; the interpolation is shared and the MLPs run as grouped
+    1x1 convs
+
+    Parameters
+    ----------
+    mlp : list
+        Pointnet module parameters of a single tower
+    num_towers : int
+        Number of stacked towers
+    bn : bool
+        Use batchnorm
+    """
+
+    def __init__(self, *, mlp: List[int], num_towers: int, bn: bool = True):
+        super().__init__()
+        self.num_towers = num_towers
+        self.mlp = pt_utils.SharedMLP([c * num_towers for c in mlp], bn=bn, groups=num_towers)
+
+    def forward(
+            self, unknown: torch.Tensor, known: torch.Tensor,
+            unknow_feats: torch.Tensor, known_feats: torch.Tensor
+    ) -> torch.Tensor:
+        r"""
+        Parameters
+        ----------
+        unknown : torch.Tensor
+            (B, n, 3) tensor of the xyz positions of the unknown features
+        known : torch.Tensor
+            (B, m, 3) tensor of the xyz positions of the known features
+        unknow_feats : torch.Tensor
+            (B, T*C1, n) tensor of the features to be propigated to
+        known_feats : torch.Tensor
+            (B, T*C2, m) tensor of features to be propigated
+
+        Returns
+        -------
+        new_features : torch.Tensor
+            (B, T*mlp[-1], n) tensor of the features of the unknown features
+        """
+        dist, idx = pointnet2_utils.three_nn(unknown, known)
+        dist_recip = 1.0 / (dist + 1e-8)
+        norm = torch.sum(dist_recip, dim=2, keepdim=True)
+        weight = dist_recip / norm
+
+        interpolated_feats = pointnet2_utils.three_interpolate(
+            known_feats, idx, weight
+        )
+
+        B, _, n = interpolated_feats.size()
+        new_features = torch.cat([
+            interpolated_feats.view(B, self.num_towers, -1, n),
+            unknow_feats.view(B, self.num_towers, -1, n)
+        ], dim=2).view(B, -1, n, 1)  #(B, T*(C2 + C1), n, 1)
+        new_features = self.mlp(new_features)
+
+        return new_features.squeeze(-1)
+
 class PointnetLFPModuleMSG(nn.Module):
     ''' Modified based on _PointnetSAModuleBase and PointnetSAModuleMSG
     learnable feature propagation layer.'''
@@ -0,0 +1,322 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+''' Pure PyTorch implementation of the pointnet2._ext operators.
+
+Mirrors the signatures and semantics of the compiled extension so that
+pointnet2_utils can fall back to it when _ext is not built. All ops are
+vectorized over the batch and run on whatever device their inputs live on.
+'''
+from __future__ import (
+    division,
+    absolute_import,
+    with_statement,
+    print_function,
+    unicode_literals,
+)
+import torch
+
+if False:
+    # Workaround for type hints without depending on the `typing` module
+    from typing import *
+
+# Upper bound on the number of elements in a (B, chunk, N) distance block
+_MAX_BLOCK_ELEMS = 1 << 24
+
+
+def _chunk_size(b, n):
+    # type: (int, int) -> int
+    return max(1, _MAX_BLOCK_ELEMS // max(1, b * n))
+
+
+def gather_points(points, idx):
+    # type: (torch.Tensor, torch.Tensor) -> torch.Tensor
+    r"""
+    Parameters
+    ----------
+    points : torch.Tensor
+        (B, C, N) tensor
+    idx : torch.Tensor
+        (B, npoint) int tensor
+
+    Returns
+    -------
+    torch.Tensor
+        (B, C, npoint) tensor
+    """
+    C = points.size(1)
+    idx = idx.long().unsqueeze(1).expand(-1, C, -1)
+    return torch.gather(points, 2, idx)
+
+
+def gather_points_grad(grad_out, idx, n):
+    # type: (torch.Tensor, torch.Tensor, int) -> torch.Tensor
+    B, C, _ = grad_out.size()
+    grad_points = grad_out.new_zeros(B, C, n)
+    idx = idx.long().unsqueeze(1).expand(-1, C, -1)
+    return grad_points.scatter_add_(2, idx, grad_out)
+
+
+def furthest_point_sampling(points, nsamples):
+    # type: (torch.Tensor, int) -> torch.Tensor
+    r"""
+    Parameters
+    ----------
+    points : torch.Tensor
+        (B, N, 3) tensor
+    nsamples : int
+        number of points to sample
+
+    Returns
+    -------
+    torch.Tensor
+        (B, nsamples) int tensor, same selection rule as the CUDA kernel:
+        starts at index 0, ignores points with |p|^2 <= 1e-3 and keeps the
+        first index on ties
+    """
+    B, N, _ = points.size()
+    idxs = torch.zeros(B, nsamples, dtype=torch.int, device=points.device)
+    if nsamples <= 0:
+        return idxs
+    valid = (points * points).sum(-1) > 1e-3
+    temp = points.new_full((B, N), 1e10)
+    invalid_fill = points.new_full((B, N), -1)
+    batch_inds = torch.arange(B, device=points.device)
+    old = torch.zeros(B, dtype=torch.long, device=points.device)
+    for j in range(1, nsamples):
+        d = ((points - points[batch_inds, old].unsqueeze(1)) ** 2).sum(-1)
+        temp = torch.where(valid, torch.min(d, temp), temp)
+        old = torch.where(valid, temp, invalid_fill).argmax(1)
+        idxs[:, j] = old.int()
+    return idxs
+
+
+def three_nn(unknowns, knows):
+    # type: (torch.Tensor, torch.Tensor) -> List[torch.Tensor]
+    r"""
+    Parameters
+    ----------
+    unknowns : torch.Tensor
+        (B, n, 3) tensor
+    knows : torch.Tensor
+        (B, m, 3) tensor
+
+    Returns
+    -------
+    dist2 : torch.Tensor
+        (B, n, 3) squared distance to the three nearest neighbors
+    idx : torch.Tensor
+        (B, n, 3) int index of the three nearest neighbors
+    """
+    B, n, _ = unknowns.size()
+    m = knows.size(1)
+    dist2, idx = [], []
+    k = min(3, m)
+    step = _chunk_size(B, m)
+    for start in range(0, n, step):
+        d = ((unknowns[:, start:start + step].unsqueeze(2) - knows.unsqueeze(1)) ** 2).sum(-1)
+        dc, ic = torch.topk(d, k, dim=2, largest=False, sorted=True)
+        if k < 3:
+            # Pad like the kernels when m < 3: index 0 at distance 1e40, which is inf in float
+            dc = torch.cat([dc, dc.new_full((B, dc.size(1), 3 - k), float('inf'))], 2)
+            ic = torch.cat([ic, ic.new_zeros((B, ic.size(1), 3 - k))], 2)
+        dist2.append(dc)
+        idx.append(ic)
+    return [torch.cat(dist2, 1), torch.cat(idx, 1).int()]
+
+
+def three_interpolate(points, idx, weight):
+    # type: (torch.Tensor, torch.Tensor, torch.Tensor) -> torch.Tensor
+    r"""
+    Parameters
+    ----------
+    points : torch.Tensor
+        (B, c, m) tensor
+    idx : torch.Tensor
+        (B, n, 3) int tensor
+    weight : torch.Tensor
+        (B, n, 3) tensor
+
+    Returns
+    -------
+    torch.Tensor
+        (B, c, n) tensor
+    """
+    B, c, _ = points.size()
+    n = idx.size(1)
+    flat_idx = idx.long().view(B, 1, n * 3).expand(-1, c, -1)
+    grouped = torch.gather(points, 2, flat_idx).view(B, c, n, 3)
+    return (grouped * weight.unsqueeze(1)).sum(-1)
+
+
+def three_interpolate_grad(grad_out, idx, weight, m):
+    # type: (torch.Tensor, torch.Tensor, torch.Tensor, int) -> torch.Tensor
+    B, c, n = grad_out.size()
+    grad_points = grad_out.new_zeros(B, c, m)
+    flat_idx = idx.long().view(B, 1, n * 3).expand(-1, c, -1)
+    src = (grad_out.unsqueeze(-1) * weight.unsqueeze(1)).view(B, c, n * 3)
+    return grad_points.scatter_add_(2, flat_idx, src)
+
+
+def ball_query(new_xyz, xyz, radius, nsample):
+    # type: (torch.Tensor, torch.Tensor, float, int) -> torch.Tensor
+    r"""
+    Parameters
+    ----------
+    new_xyz : torch.Tensor
+        (B, npoint, 3) centers of the ball query
+    xyz : torch.Tensor
+        (B, N, 3) xyz coordinates of the features
+    radius : float
+        radius of the balls
+    nsample : int
+        maximum number of features in the balls
+
+    Returns
+    -------
+    torch.Tensor
+        (B, npoint, nsample) int tensor holding the first nsample neighbors
+        in index order; empty slots repeat the first neighbor, and balls
+        without any neighbor are filled with 0 (as the CUDA kernel does)
+    """
+    B, npoint, _ = new_xyz.size()
+    N = xyz.size(1)
+    radius2 = radius * radius
+    k = min(nsample, N)
+    arange = torch.arange(N, device=xyz.device)
+    idx = []
+    step = _chunk_size(B, N)
+    for start in range(0, npoint, step):
+        d2 = ((new_xyz[:, start:start + step].unsqueeze(2) - xyz.unsqueeze(1)) ** 2).sum(-1)
+        # Out-of-ball points get index N so the k smallest keys are the
+        # first k in-ball indices in order
+        keys = torch.where(d2 < radius2, arange, torch.full_like(arange, N))
+        idx.append(_first_in_ball(keys, N, k, nsample))
+    return torch.cat(idx, 1).int()
+
+
+def _first_in_ball(keys, N, k, nsample):
+    # keys: (..., L) point indices with N marking candidates outside the ball.
+    # Returns the nsample smallest keys padded like the CUDA kernel: empty
+    # slots repeat the first neighbor, empty balls are all 0.
+    first = torch.topk(keys, k, dim=-1, largest=False, sorted=True)[0]
+    if k < nsample:
+        first = torch.cat([first, first.new_full(first.shape[:-1] + (nsample - k,), N)], -1)
+    head = first[..., :1]
+    first = torch.where(first == N, head, first)
+    first[first == N] = 0
+    return first
+
+
+def grid_ball_query(new_xyz, xyz, radius, nsample):
+    # type: (torch.Tensor, torch.Tensor, float, int) -> torch.Tensor
+    r"""
+    Ball query that buckets xyz into a uniform grid with cell size radius and
+    only tests the 27 cells around each center. Returns exactly what
+    ball_query returns, in O(npoint * points per neighborhood) instead of
+    O(npoint * N).
+
+    Parameters
+    ----------
+    new_xyz : torch.Tensor
+        (B, npoint, 3) centers of the ball query
+    xyz : torch.Tensor
+        (B, N, 3) xyz coordinates of the features
+    radius : float
+        radius of the balls
+    nsample : int
+        maximum number of features in the balls
+
+    Returns
+    -------
+    torch.Tensor
+        (B, npoint, nsample) int tensor
+    """
+    B, npoint, _ = new_xyz.size()
+    N = xyz.size(1)
+    device = xyz.device
+    radius2 = radius * radius
+    # Slightly enlarged cells so rounding in floor() never pushes an in-ball
+    # point two cells away from its center
+    cell = radius * (1 + 1e-4)
+
+    origin = torch.min(xyz.min(1)[0], new_xyz.min(1)[0]).unsqueeze(1)
+    extent = torch.max(xyz.max(1)[0], new_xyz.max(1)[0]).unsqueeze(1) - origin
+    dims = (extent / cell).floor().long().max(0)[0].view(3) + 1
+    batch_offset = torch.arange(B, device=device).view(B, 1)
+
+    def cell_key(c, b):
+        return ((b * dims[0] + c[..., 0]) * dims[1] + c[..., 1]) * dims[2] + c[..., 2]
+
+    # Sort points by cell; the stable sort keeps index order inside a cell
+    pc = torch.min(((xyz - origin) / cell).floor().long().clamp(min=0), dims - 1)
+    sorted_key, order = torch.sort(cell_key(pc, batch_offset).view(-1), stable=True)
+
+    # Point ranges of the 27 neighbor cells of every center
+    r = torch.arange(-1, 2, device=device)
+    offsets = torch.stack(torch.meshgrid(r, r, r, indexing='ij'), -1).view(27, 3)
+    qc = torch.min(((new_xyz - origin) / cell).floor().long().clamp(min=0), dims - 1)
+    nc = qc.unsqueeze(2) + offsets
+    inside = ((nc >= 0) & (nc < dims)).all(-1)
+    nkey = cell_key(nc, batch_offset.unsqueeze(-1))
+    start = torch.searchsorted(sorted_key, nkey)
+    count = (torch.searchsorted(sorted_key, nkey, right=True) - start) * inside
+    start, count = start.view(-1, 27), count.view(-1, 27)
+    cum = count.cumsum(1)
+    begin = cum - count
+
+    centers = new_xyz.reshape(-1, 3)
+    points = xyz.reshape(-1, 3)
+    rows = B * npoint
+    idx = torch.zeros(rows, nsample, dtype=torch.long, device=device)
+    total = cum[:, -1]
+    L = int(total.max()) if rows > 0 else 0
+    if L == 0:
+        return idx.view(B, npoint, nsample).int()
+    step = max(1, _MAX_BLOCK_ELEMS // L)
+    pos = torch.arange(L, device=device)
+    for row in range(0, rows, step):
+        sl = slice(row, min(rows, row + step))
+        # Map each candidate slot to its neighbor cell and point position
+        slot = pos.expand(sl.stop - sl.start, L).contiguous()
+        c = torch.searchsorted(cum[sl], slot, right=True).clamp(max=26)
+        valid = slot < total[sl].unsqueeze(1)
+        src = torch.gather(start[sl], 1, c) + slot - torch.gather(begin[sl], 1, c)
+        cand = order[torch.where(valid, src, torch.zeros_like(src))]
+        d2 = ((centers[sl].unsqueeze(1) - points[cand]) ** 2).sum(-1)
+        keys = torch.where(valid & (d2 < radius2), cand % N, torch.full_like(cand, N))
+        idx[sl] = _first_in_ball(keys, N, min(nsample, L), nsample)
+    return idx.view(B, npoint, nsample).int()
+
+
+def group_points(points, idx):
+    # type: (torch.Tensor, torch.Tensor) -> torch.Tensor
+    r"""
+    Parameters
+    ----------
+    points : torch.Tensor
+        (B, C, N) tensor
+    idx : torch.Tensor
+        (B, npoint, nsample) int tensor
+
+    Returns
+    -------
+    torch.Tensor
+        (B, C, npoint, nsample) tensor
+    """
+    B, C, N = points.size()
+    _, npoint, nsample = idx.size()
+    # Gather straight into (B, C, npoint, nsample): callers modify the result
+    # in place, which autograd forbids on a view returned by a Function
+    idx = idx.long().unsqueeze(1).expand(-1, C, -1, -1)
+    return torch.gather(points.unsqueeze(2).expand(-1, -1, npoint, -1), 3, idx)
+
+
+def group_points_grad(grad_out, idx, n):
+    # type: (torch.Tensor, torch.Tensor, int) -> torch.Tensor
+    B, C, npoint, nsample = grad_out.size()
+    grad_points = grad_out.new_zeros(B, C, n)
+    flat_idx = idx.long().view(B, 1, npoint * nsample).expand(-1, C, -1)
+    return grad_points.scatter_add_(2, flat_idx, grad_out.reshape(B, C, npoint * nsample))
@@ -15,22 +15,41 @@ import torch
 from torch.autograd import Function
 import torch.nn as nn
 import pytorch_utils as pt_utils
+import pointnet2_torch_ext
+import os
 import sys
+import warnings
 
 try:
     import builtins
 except:
     import __builtin__ as builtins
 
-try:
-    import pointnet2._ext as _ext
-except ImportError:
-    if not getattr(builtins, "__POINTNET2_SETUP__", False):
-        raise ImportError(
-            "Could not import _ext module.\n"
-            "Please see the setup instructions in the README: "
-            "https://github.com/erikwijmans/Pointnet2_PyTorch/blob/master/README.rst"
-        )
+# POINTNET2_BACKEND selects the operator implementation:
+#   auto  - compiled _ext if it can be imported, else pure PyTorch (default)
+#   ext   - compiled _ext only
+#   torch - pure PyTorch (pointnet2_torch_ext), no compilation needed
+BACKEND = os.environ.get("POINTNET2_BACKEND", "auto").lower()
+if BACKEND not in ("auto", "ext", "torch"):
+    raise ValueError("POINTNET2_BACKEND must be one of auto / ext / torch, got %s" % BACKEND)
+
+if BACKEND == "torch":
+    _ext = pointnet2_torch_ext
+else:
+    try:
+        import pointnet2._ext as _ext
+        BACKEND = "ext"
+    except ImportError:
+        if BACKEND == "auto":
+            warnings.warn("Could not import _ext module, falling back to the pure PyTorch operators.")
+            _ext = pointnet2_torch_ext
+            BACKEND = "torch"
+        elif not getattr(builtins, "__POINTNET2_SETUP__", False):
+            raise ImportError(
+                "Could not import _ext module.\n"
+                "Please see the setup instructions in the README: "
+                "https://github.com/erikwijmans/Pointnet2_PyTorch/blob/master/README.rst"
+            )
 
 if False:
     # Workaround for type hints without depending on the `typing` module
@@ -287,6 +306,41 @@ class BallQuery(Function):
 ball_query = BallQuery.apply
 
 
+class GridBallQuery(Function):
+    @staticmethod
+    def forward(ctx, radius, nsample, xyz, new_xyz):
+        # type: (Any, float, int, torch.Tensor, torch.Tensor) -> torch.Tensor
+        r"""
+        Same contract as BallQuery, but buckets xyz into a voxel grid of cell
+        size radius and only scans the cells around each center. Faster than
+        the brute-force scan on large scenes (tens of thousands of points).
+
+        Parameters
+        ----------
+        radius : float
+            radius of the balls
+        nsample : int
+            maximum number of features in the balls
+        xyz : torch.Tensor
+            (B, N, 3) xyz coordinates of the features
+        new_xyz : torch.Tensor
+            (B, npoint, 3) centers of the ball query
+
+        Returns
+        -------
+        torch.Tensor
+            (B, npoint, nsample) tensor with the indicies of the features that form the query balls
+        """
+        return pointnet2_torch_ext.grid_ball_query(new_xyz, xyz, radius, nsample)
+
+    @staticmethod
+    def backward(ctx, a=None):
+        return None, None, None, None
+
+
+grid_ball_query = GridBallQuery.apply
+
+
 class QueryAndGroup(nn.Module):
     r"""
     Groups with a ball query of radius
@@ -297,11 +351,14 @@ class QueryAndGroup(nn.Module):
         Radius of ball
     nsample : int32
         Maximum number of features to gather in the ball
+    use_grid : bool
+        Use the voxel-grid ball query instead of the brute-force one
     """
 
-    def __init__(self, radius, nsample, use_xyz=True, ret_grouped_xyz=False, normalize_xyz=False, sample_uniformly=False, ret_unique_cnt=False, use_feature=False, ret_idx=False):
+    def __init__(self, radius, nsample, use_xyz=True, ret_grouped_xyz=False, normalize_xyz=False, sample_uniformly=False, ret_unique_cnt=False, use_feature=False, ret_idx=False, use_grid=False):
         # type: (QueryAndGroup, float, int, bool) -> None
         super(QueryAndGroup, self).__init__()
+        self.use_grid = use_grid
         self.radius, self.nsample, self.use_xyz = radius, nsample, use_xyz
         self.ret_grouped_xyz = ret_grouped_xyz
         self.normalize_xyz = normalize_xyz
@@ -312,7 +369,7 @@ class QueryAndGroup(nn.Module):
         if self.ret_unique_cnt:
             assert(self.sample_uniformly)
 
-    def forward(self, xyz, new_xyz, features=None):
+    def forward(self, xyz, new_xyz, features=None, idx=None, grouped_xyz=None):
         # type: (QueryAndGroup, torch.Tensor. torch.Tensor, torch.Tensor) -> Tuple[Torch.Tensor]
         r"""
         Parameters
@@ -323,31 +380,43 @@ class QueryAndGroup(nn.Module):
             centriods (B, npoint, 3)
         features : torch.Tensor
             Descriptors of the features (B, C, N)
+        idx : torch.Tensor
+            (optional) (B, npoint, nsample) ball query indices from a previous
+            call on the same xyz / new_xyz, skips the ball query
+        grouped_xyz : torch.Tensor
+            (optional) (B, 3, npoint, nsample) grouped local xyz matching idx,
+            skips the xyz grouping
 
         Returns
         -------
         new_features : torch.Tensor
             (B, 3 + C, npoint, nsample) tensor
         """
-        idx = ball_query(self.radius, self.nsample, xyz, new_xyz)
-
-        if self.sample_uniformly:
-            unique_cnt = torch.zeros((idx.shape[0], idx.shape[1]))
-            for i_batch in range(idx.shape[0]):
-                for i_region in range(idx.shape[1]):
-                    unique_ind = torch.unique(idx[i_batch, i_region, :])
-                    num_unique = unique_ind.shape[0]
-                    unique_cnt[i_batch, i_region] = num_unique
-                    sample_ind = torch.randint(0, num_unique, (self.nsample - num_unique,), dtype=torch.long)
-                    all_ind = torch.cat((unique_ind, unique_ind[sample_ind]))
-                    idx[i_batch, i_region, :] = all_ind
-
-
-        xyz_trans = xyz.transpose(1, 2).contiguous()
-        grouped_xyz = grouping_operation(xyz_trans, idx)  # (B, 3, npoint, nsample)
-        grouped_xyz -= new_xyz.transpose(1, 2).unsqueeze(-1)
-        if self.normalize_xyz:
-            grouped_xyz /= self.radius
+        if idx is None:
+            if self.use_grid:
+                idx = grid_ball_query(self.radius, self.nsample, xyz, new_xyz)
+            else:
+                idx = ball_query(self.radius, self.nsample, xyz, new_xyz)
+
+            if self.sample_uniformly:
+                unique_cnt = torch.zeros((idx.shape[0], idx.shape[1]))
+                for i_batch in range(idx.shape[0]):
+                    for i_region in range(idx.shape[1]):
+                        unique_ind = torch.unique(idx[i_batch, i_region, :])
+                        num_unique = unique_ind.shape[0]
+                        unique_cnt[i_batch, i_region] = num_unique
+                        sample_ind = torch.randint(0, num_unique, (self.nsample - num_unique,), dtype=torch.long)
+                        all_ind = torch.cat((unique_ind, unique_ind[sample_ind]))
+                        idx[i_batch, i_region, :] = all_ind
+        else:
+            assert not self.ret_unique_cnt, "unique_cnt is not available for a reused idx"
+
+        if grouped_xyz is None:
+            xyz_trans = xyz.transpose(1, 2).contiguous()
+            grouped_xyz = grouping_operation(xyz_trans, idx)  # (B, 3, npoint, nsample)
+            grouped_xyz -= new_xyz.transpose(1, 2).unsqueeze(-1)
+            if self.normalize_xyz:
+                grouped_xyz /= self.radius
 
         if features is not None:
             grouped_features = grouping_operation(features, idx)
@@ -18,7 +18,8 @@ class SharedMLP(nn.Sequential):
             activation=nn.ReLU(inplace=True),
             preact: bool = False,
             first: bool = False,
-            name: str = ""
+            name: str = "",
+            groups: int = 1
     ):
         super().__init__()
 
@@ -31,7 +32,8 @@ class SharedMLP(nn.Sequential):
                     bn=(not first or not preact or (i != 0)) and bn,
                     activation=activation
                     if (not first or not preact or (i != 0)) else None,
-                    preact=preact
+                    preact=preact,
+                    groups=groups
                 )
             )
 
@@ -107,7 +109,8 @@ class _ConvBase(nn.Sequential):
             batch_norm=None,
             bias=True,
             preact=False,
-            name=""
+            name="",
+            groups=1
     ):
         super().__init__()
 
@@ -118,7 +121,8 @@ class _ConvBase(nn.Sequential):
             kernel_size=kernel_size,
             stride=stride,
             padding=padding,
-            bias=bias
+            bias=bias,
+            groups=groups
         )
         init(conv_unit.weight)
         if bias:
@@ -162,7 +166,8 @@ class Conv1d(_ConvBase):
             init=nn.init.kaiming_normal_,
             bias: bool = True,
             preact: bool = False,
-            name: str = ""
+            name: str = "",
+            groups: int = 1
     ):
         super().__init__(
             in_size,
@@ -177,7 +182,8 @@ class Conv1d(_ConvBase):
             batch_norm=BatchNorm1d,
             bias=bias,
             preact=preact,
-            name=name
+            name=name,
+            groups=groups
         )
 
 
@@ -196,7 +202,8 @@ class Conv2d(_ConvBase):
             init=nn.init.kaiming_normal_,
             bias: bool = True,
             preact: bool = False,
-            name: str = ""
+            name: str = "",
+            groups: int = 1
     ):
         super().__init__(
             in_size,
@@ -211,7 +218,8 @@ class Conv2d(_ConvBase):
             batch_norm=BatchNorm2d,
             bias=bias,
             preact=preact,
-            name=name
+            name=name,
+            groups=groups
         )
 
 
@@ -323,3 +331,40 @@ class BNMomentumScheduler(object):
         self.model.apply(self.setter(self.lmbd(epoch)))
 
 
+
+
+def stack_state_dict(state_dict, prefixes, stacked_prefix):
+    r"""
+    Merge the weights of identical sub-networks (e.g. the four HDNet backbone
+    towers) into one network whose layers are the same layers with all
+    sub-networks stacked along the output channels (grouped convs, or a plain
+    conv for a shared input).
+
+    Parameters
+    ----------
+    state_dict : dict
+        state dict containing the sub-networks
+    prefixes : list of str
+        key prefix of every sub-network, e.g. ['backbone_net1.', ..., 'backbone_net4.'],
+        in stacking order
+    stacked_prefix : str
+        key prefix of the stacked network, e.g. 'backbone_net.'
+
+    Returns
+    -------
+    dict
+        state dict with the sub-network keys replaced by the stacked keys
+    """
+    new_state_dict = {k: v for k, v in state_dict.items()
+                      if not any(k.startswith(p) for p in prefixes)}
+    for key in state_dict:
+        if not key.startswith(prefixes[0]):
+            continue
+        name = key[len(prefixes[0]):]
+        values = [state_dict[p + name] for p in prefixes]
+        if values[0].dim() == 0:
+            # num_batches_tracked
+            new_state_dict[stacked_prefix + name] = max(values)
+        else:
+            new_state_dict[stacked_prefix + name] = torch.cat(values, dim=0)
+    return new_state_dict
@@ -0,0 +1,25 @@
+# coding: utf-8
+""" Precompute the per point vote, surface and line targets of ScanNet scans.
+
+Usage: python build_label_cache.py --data_path <scannet_train_detection_data> --cache_path <dir>
+Then pass --label_cache_path <dir> to train.py. Surface and line points are
+selected on the full, unaugmented scans, so the cached targets approximate the
+ones computed on the sampled, augmented points.
+"""
+import os
+import sys
+import argparse
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from scannet_detection_dataset_hd import ScannetDetectionDataset
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', required=True, help='path to the ScanNet detection data')
+    parser.add_argument('--cache_path', required=True, help='output dir of the label cache')
+    parser.add_argument('--split', default='all', help='train, val or all [default: all]')
+    FLAGS = parser.parse_args()
+
+    dset = ScannetDetectionDataset(FLAGS.data_path, FLAGS.split, label_cache_path=FLAGS.cache_path)
+    dset.build_label_cache()
+    print('cached labels of {} scans in {}'.format(len(dset.scan_names), FLAGS.cache_path))
@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import numpy as np
+import torch
 import sys
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -84,6 +85,15 @@ class ScannetDatasetConfig(object):
         ''' Inverse function to size2class '''        
         return self.mean_size_arr[pred_cls, :] + residual
 
+    def class2size_batch(self, pred_cls, residual):
+        ''' class2size for torch tensors (...) and (...,3) '''
+        mean_size_arr = torch.from_numpy(self.mean_size_arr).to(residual)
+        return mean_size_arr[pred_cls] + residual
+
+    def class2angle_batch(self, pred_cls, residual, to_label_format=True):
+        ''' class2angle for torch tensors (...) and (...) '''
+        return torch.zeros_like(residual)
+
     def param2obb(self, center, heading_class, heading_residual, size_class, size_residual):
         heading_angle = self.class2angle(heading_class, heading_residual)
         box_size = self.class2size(int(size_class), size_residual)
@@ -10,13 +10,16 @@ where (cx,cy,cz) is the center point of the box, dx is the x-axis length of the
 """
 import os
 import sys
+import hashlib
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(ROOT_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 import pc_util
+from box_util import rotz_batch_pytorch
 from model_util_scannet import rotate_aligned_boxes
 from model_util_scannet import ScannetDatasetConfig
 
@@ -32,12 +35,6 @@ NUM_POINT_LINE = 10
 LINE_THRESH = 0.2
 MIND_THRESH = 0.1
 
-def check_upright(para_points):
-    return (para_points[0][-1] == para_points[1][-1]) and (para_points[1][-1] == para_points[2][-1]) and (para_points[2][-1] == para_points[3][-1])
-
-def check_z(plane_equ, para_points):
-    return np.sum(para_points[:,2] + plane_equ[-1]) / 4.0 < LOWER_THRESH
-
 def params2bbox(center, xsize, ysize, zsize, angle):
     ''' from bbox_center, angle and size to bbox
     @Args:
@@ -61,22 +58,248 @@ def params2bbox(center, xsize, ysize, zsize, angle):
         center + vx + vy - vz, center + vx + vy + vz])
     return bbox, (center - vx - vy - vz)[0], (center - vx - vy - vz)[1], (center - vx - vy - vz)[2], (center + vx + vy + vz)[0], (center + vx + vy + vz)[1], (center + vx + vy + vz)[2],
 
-def get_linesel(points, xmin, xmax, ymin, ymax):
-    sel1 = np.abs(points[:,0] - xmin) < LINE_THRESH
-    sel2 = np.abs(points[:,0] - xmax) < LINE_THRESH
-    sel3 = np.abs(points[:,1] - ymin) < LINE_THRESH
-    sel4 = np.abs(points[:,1] - ymax) < LINE_THRESH
-    return sel1, sel2, sel3, sel4
-    
-def get_linesel2(points, ymin, ymax, zmin, zmax, axis=0):
-    sel3 = np.abs(points[:,axis] - ymin) < LINE_THRESH
-    sel4 = np.abs(points[:,axis] - ymax) < LINE_THRESH
-    return sel3, sel4
+def params2bbox_batch(center, size, angle):
+    ''' Vectorized params2bbox
+    @Args:
+        center: (M,3), size: (M,3), angle: (M,)
+    @Returns:
+        bbox: M x 8 x 3, corners in the order of params2bbox
+    '''
+    zeros = np.zeros_like(angle)
+    vx = np.stack([np.cos(angle), np.sin(angle), zeros], 1) * np.abs(size[:,0:1]) / 2
+    vy = np.stack([-np.sin(angle), np.cos(angle), zeros], 1) * np.abs(size[:,1:2]) / 2
+    vz = np.stack([zeros, zeros, np.abs(size[:,2]) / 2], 1)
+    return np.stack([center + sx*vx + sy*vy + sz*vz
+                     for sx in [-1, 1] for sy in [-1, 1] for sz in [-1, 1]], 1)
+
+def box_planes_batch(corners):
+    ''' Normalized face planes (a,b,c,d) of the boxes, ax+by+cz+d=0
+    @Args:
+        corners: M x 8 x 3 from params2bbox_batch
+    @Returns:
+        planes: M x 6 x 4, in the order lower, upper, left, right, front, back
+    '''
+    M = corners.shape[0]
+    planes = np.zeros((M, 6, 4))
+    planes[:,0:2,2] = 1
+    planes[:,0,3] = -corners[:,6,2]
+    planes[:,1,3] = -np.mean(corners[:,[1,3,5,7],2], 1)
+    # Side planes through corner o with normal (a-b)x(b-c), and their opposite faces
+    for k, (a, b, c, o, para) in enumerate([(3, 2, 0, 0, [4,5,6,7]), (0, 4, 5, 5, [2,3,6,7])]):
+        cp = np.cross(corners[:,a] - corners[:,b], corners[:,b] - corners[:,c])
+        norm = np.linalg.norm(cp, axis=1, keepdims=True)
+        planes[:,2+2*k,0:3] = cp / norm
+        planes[:,2+2*k,3] = -np.sum(cp*corners[:,o], 1) / norm[:,0]
+        planes[:,3+2*k,0:3] = planes[:,2+2*k,0:3]
+        planes[:,3+2*k,3] = -np.mean(np.sum(corners[:,para] * planes[:,2+2*k,None,0:3], 2), 1)
+    return planes
+
+def compute_point_targets(point_cloud, instance_labels, semantic_labels, meta_vertices):
+    ''' Per point vote, surface and line targets of a scan
+    @Args:
+        point_cloud: (N,3+C) points
+        instance_labels, semantic_labels: (N,)
+        meta_vertices: (N,9) box (center, size, angle, instance, nyu40 id) of every point
+    @Returns:
+        targets: dict {name: (N,...) array} for the names in TARGET_FIELDS
+        obj_meta: list of the meta rows of the kept instances
+    '''
+    N = point_cloud.shape[0]
+    point_votes = np.zeros([N, 3])
+    point_votes_mask = np.zeros(N)
+
+    point_boundary_mask_z = np.zeros(N)
+    point_boundary_mask_xy = np.zeros(N)
+    point_boundary_offset_z = np.zeros([N, 3])
+    point_boundary_offset_xy = np.zeros([N, 3])
+    point_boundary_sem_z = np.zeros([N, 3+2+1])
+    point_boundary_sem_xy = np.zeros([N, 3+1+1])
+
+    point_line_mask = np.zeros(N)
+    point_line_offset = np.zeros([N, 3])
+    point_line_sem = np.zeros([N, 3+1])
+
+    point_sem_label = np.zeros(N)
+
+    targets = {'point_votes': point_votes, 'point_votes_mask': point_votes_mask,
+        'point_sem_label': point_sem_label,
+        'point_boundary_mask_z': point_boundary_mask_z, 'point_boundary_mask_xy': point_boundary_mask_xy,
+        'point_boundary_offset_z': point_boundary_offset_z, 'point_boundary_offset_xy': point_boundary_offset_xy,
+        'point_boundary_sem_z': point_boundary_sem_z, 'point_boundary_sem_xy': point_boundary_sem_xy,
+        'point_line_mask': point_line_mask, 'point_line_offset': point_line_offset, 'point_line_sem': point_line_sem}
+
+    # Group the points by instance; an instance is kept if its first point has a known class
+    order = np.argsort(instance_labels, kind='stable')
+    _, starts, counts = np.unique(instance_labels[order], return_index=True, return_counts=True)
+    keep = np.isin(semantic_labels[order[starts]], DC.nyu40ids)
+    if not np.any(keep):
+        return targets, []
+    point_keep = np.repeat(keep, counts)
+    ind = order[point_keep] # points of the kept instances, instance by instance
+    seg = np.repeat(np.arange(np.sum(keep)), counts[keep]) # instance of every point in ind
+    seg_starts = np.cumsum(counts[keep]) - counts[keep]
+    x = point_cloud[ind,:3]
+
+    ### Meta information here
+    meta = meta_vertices[order[starts[keep]]]
+    obj_meta = list(meta)
+    M = len(obj_meta)
+    cls = np.argmax(meta[:,-1:] == DC.nyu40ids, 1)
+    sem = np.array([DC.nyu40id2class_sem[m] for m in meta[:,-1]])
+
+    point_votes[ind, :] = meta[seg,:3] - x
+    point_votes_mask[ind] = 1.0
+    point_sem_label[ind] = sem[seg]
+
+    ### Corners and faces
+    corners = params2bbox_batch(meta[:,0:3], meta[:,3:6], meta[:,6])
+    xmin, ymin, zmin = corners[:,0,0], corners[:,0,1], corners[:,0,2]
+    xmax, ymax, zmax = corners[:,7,0], corners[:,7,1], corners[:,7,2]
+    planes = box_planes_batch(corners)
+
+    def seg_mean(sel, v):
+        # Per instance count and mean of the rows v (len(sel),D) of the points sel
+        num = np.bincount(seg[sel], minlength=M)
+        total = np.stack([np.bincount(seg[sel], weights=v[:,k], minlength=M) for k in range(v.shape[1])], 1)
+        return num, total / np.maximum(num, 1)[:,None]
+
+    def plane_sel(plane):
+        # Points within DIST_THRESH of the points nearest to the plane
+        alldist = np.abs(np.sum(x*plane[seg,:3], 1) + plane[seg,3])
+        mind = np.minimum.reduceat(alldist, seg_starts)
+        sel = np.flatnonzero(np.abs(alldist - mind[seg]) < DIST_THRESH)
+        return alldist[sel], sel
+
+    def set_line(sel, axis, bound, fixed_axis, fixed_value):
+        sel = sel[np.abs(x[sel,axis] - bound[seg[sel]]) < LINE_THRESH]
+        num, linecenter = seg_mean(sel, x[sel])
+        linecenter = linecenter.astype(x.dtype)
+        linecenter[:,fixed_axis] = fixed_value
+        sel = sel[num[seg[sel]] > NUM_POINT_LINE]
+        s = seg[sel]
+        point_line_mask[ind[sel]] = 1.0
+        point_line_offset[ind[sel]] = linecenter[s] - x[sel]
+        point_line_sem[ind[sel]] = np.concatenate([linecenter, cls[:,None]], 1)[s]
+
+    def surface_sel(alldist, sel):
+        # Points of the instances whose selection is large and flat enough, and its mean point
+        num, mean = seg_mean(sel, np.concatenate([x[sel], alldist[:,None]], 1))
+        _, var = seg_mean(sel, np.abs(alldist - mean[seg[sel],3])[:,None]**2)
+        return sel[((num > NUM_POINT) & (var[:,0] < VAR_THRESH))[seg[sel]]], mean[:,0:3].astype(x.dtype)
+
+    for plane in [planes[:,0], planes[:,1]]:
+        ## Get lower (upper) four lines
+        alldist, sel = plane_sel(plane)
+        set_line(sel, 0, xmin, 1, (ymin+ymax)/2.0)
+        set_line(sel, 0, xmax, 1, (ymin+ymax)/2.0)
+        set_line(sel, 1, ymin, 0, (xmin+xmax)/2.0)
+        set_line(sel, 1, ymax, 0, (xmin+xmax)/2.0)
+        ### Set the surface labels here
+        sel, mean = surface_sel(alldist, sel)
+        center = np.stack([(xmin+xmax)/2.0, (ymin+ymax)/2.0, mean[:,2]], 1)
+        s = seg[sel]
+        point_boundary_mask_z[ind[sel]] = 1.0
+        point_boundary_sem_z[ind[sel]] = np.concatenate([center, np.stack([xmax - xmin, ymax - ymin, cls], 1)], 1)[s]
+        point_boundary_offset_z[ind[sel]] = center[s] - x[sel]
+
+    for k, plane in enumerate([planes[:,2], planes[:,3], planes[:,4], planes[:,5]]):
+        alldist, sel = plane_sel(plane)
+        if k < 2:
+            ## Get left (right) two lines
+            set_line(sel, 1, ymin, 2, (zmin+zmax)/2.0)
+            set_line(sel, 1, ymax, 2, (zmin+zmax)/2.0)
+        sel, mean = surface_sel(alldist, sel)
+        center = np.stack([mean[:,0], mean[:,1], (zmin+zmax)/2.0], 1)
+        s = seg[sel]
+        point_boundary_mask_xy[ind[sel]] = 1.0
+        point_boundary_sem_xy[ind[sel]] = np.concatenate([center, np.stack([zmax - zmin, cls], 1)], 1)[s]
+        point_boundary_offset_xy[ind[sel]] = center[s] - x[sel]
+
+    return targets, obj_meta
+
+# Per point targets as (name, trailing shape); packed in this column order
+TARGET_FIELDS = [('point_votes', (3,)), ('point_votes_mask', ()), ('point_sem_label', ()),
+                 ('point_boundary_mask_z', ()), ('point_boundary_mask_xy', ()),
+                 ('point_boundary_offset_z', (3,)), ('point_boundary_offset_xy', (3,)),
+                 ('point_boundary_sem_z', (6,)), ('point_boundary_sem_xy', (5,)),
+                 ('point_line_mask', ()), ('point_line_offset', (3,)), ('point_line_sem', (4,))]
+# Targets whose first three columns are an offset or a center, i.e. move with the points
+GEOMETRIC_FIELDS = ['point_votes', 'point_boundary_offset_z', 'point_boundary_offset_xy',
+                    'point_boundary_sem_z', 'point_boundary_sem_xy', 'point_line_offset', 'point_line_sem']
+
+# Bump when compute_point_targets changes; with the thresholds it names the cache files
+LABEL_CACHE_VERSION = 1
+LABEL_CACHE_KEY = 'v%d_%s' % (LABEL_CACHE_VERSION, hashlib.md5(repr((TARGET_FIELDS, DIST_THRESH,
+    VAR_THRESH, LOWER_THRESH, NUM_POINT, NUM_POINT_LINE, LINE_THRESH)).encode()).hexdigest()[:8])
+
+def pack_point_targets(targets):
+    ''' Stack the target dict into one (N,32) float32 array '''
+    N = targets['point_votes'].shape[0]
+    return np.concatenate([targets[name].reshape(N, -1) for name, _ in TARGET_FIELDS], 1).astype(np.float32)
+
+def unpack_point_targets(packed):
+    ''' Inverse of pack_point_targets, returns float64 copies '''
+    targets = {}
+    col = 0
+    for name, shape in TARGET_FIELDS:
+        width = int(np.prod(shape))
+        targets[name] = np.array(packed[:, col:col+width], dtype=np.float64).reshape((-1,) + shape)
+        col += width
+    return targets
+
+def transform_point_targets(targets, mat):
+    ''' Apply the linear point transform mat (3,3), p -> mat p, to the targets in place '''
+    for name in GEOMETRIC_FIELDS:
+        targets[name][:, 0:3] = np.dot(targets[name][:, 0:3], np.transpose(mat))
+    # Box extents in x and y, as in augment_batch_pytorch
+    sem_z = targets['point_boundary_sem_z']
+    sem_z[:, 3:5] = np.dot(sem_z[:, 3:5], np.abs(np.transpose(mat[0:2, 0:2])))
+    return targets
+
+def save_point_targets(path, targets):
+    ''' Write packed targets atomically so concurrent workers never read a partial file '''
+    tmp_path = '%s.%d.tmp.npy' % (path[:-4], os.getpid())
+    np.save(tmp_path, pack_point_targets(targets))
+    os.replace(tmp_path, path)
+
+def augment_batch_pytorch(batch_data_label):
+    ''' The flips and z rotation of __getitem__ as batched ops on a collated batch,
+    on the batch's device. Meant for a dataset built with augment=False; the targets
+    are moved with the points instead of recomputed from the augmented boxes.
+    '''
+    pc = batch_data_label['point_clouds']
+    B = pc.shape[0]
+    device = pc.device
+    flip = torch.ones(B, 3, device=device)
+    flip[:,0] = torch.where(torch.rand(B, device=device) > 0.5, -1.0, 1.0)
+    flip[:,1] = torch.where(torch.rand(B, device=device) > 0.5, -1.0, 1.0)
+    rot_angle = (torch.rand(B, device=device)*np.pi/18) - np.pi/36 # -5 ~ +5 degree
+    mat = torch.matmul(rotz_batch_pytorch(rot_angle), torch.diag_embed(flip)) # (B,3,3), p -> mat p
+    mat_t = mat.transpose(1, 2)
+
+    pc[:,:,0:3] = torch.matmul(pc[:,:,0:3], mat_t)
+    batch_data_label['center_label'] = torch.matmul(batch_data_label['center_label'], mat_t)
+    # Axis aligned boxes stay axis aligned: their extent is |mat| applied to the sizes
+    size = batch_data_label['size_label']
+    new_size = torch.matmul(size, mat_t.abs())
+    batch_data_label['size_label'] = new_size
+    batch_data_label['size_residual_label'] = batch_data_label['size_residual_label'] + new_size - size
+    votes = batch_data_label['vote_label']
+    batch_data_label['vote_label'] = torch.matmul(votes.view(B, -1, 3), mat_t).view(votes.shape)
+    for key in ['point_boundary_offset_z', 'point_boundary_offset_xy', 'point_line_offset',
+                'point_boundary_sem_z', 'point_boundary_sem_xy', 'point_line_sem']:
+        target = batch_data_label[key].clone()
+        target[:,:,0:3] = torch.matmul(target[:,:,0:3], mat_t)
+        batch_data_label[key] = target
+    sem_z = batch_data_label['point_boundary_sem_z']
+    sem_z[:,:,3:5] = torch.matmul(sem_z[:,:,3:5], mat_t[:,0:2,0:2].abs())
+    return batch_data_label
 
 class ScannetDetectionDataset(Dataset):
        
     def __init__(self, data_path=None, split_set='train', num_points=20000, center_dev=2.0, corner_dev=1.0,
-                 use_color=False, use_height=False, augment=False, use_angle=False, vsize=0.06, use_tsdf=0, use_18cls=1):
+                 use_color=False, use_height=False, augment=False, use_angle=False, vsize=0.06, use_tsdf=0, use_18cls=1,
+                 label_cache_path=None):
 
         # self.data_path = os.path.join('/scratch/cluster/yanght/Dataset/', 'scannet_train_detection_data')
         self.data_path = data_path
@@ -111,10 +334,35 @@ class ScannetDetectionDataset(Dataset):
         self.corner_dev = corner_dev
         self.use_tsdf = use_tsdf
         self.use_18cls = use_18cls
+
+        ### Packed per point targets of the full scans, see build_label_cache. The
+        ### surface and line selections (and their NUM_POINT / NUM_POINT_LINE counts)
+        ### are made on the full, unaugmented scan, not on the sampled and augmented
+        ### points, so cached targets approximate the ones computed without the cache
+        self.label_cache_path = label_cache_path
+        if label_cache_path is not None and not os.path.exists(label_cache_path):
+            os.makedirs(label_cache_path)
         
     def __len__(self):
         return len(self.scan_names)
 
+    def load_label_cache(self, scan_name, point_cloud=None, meta_vertices=None):
+        ''' Memmap the packed targets of the full, unaugmented scan; build them on a miss.
+        Files are named by LABEL_CACHE_KEY, so caches of other code or thresholds are rebuilt '''
+        path = os.path.join(self.label_cache_path, scan_name+'_targets_'+LABEL_CACHE_KEY+'.npy')
+        if not os.path.exists(path):
+            if meta_vertices is None:
+                point_cloud = np.load(os.path.join(self.data_path, scan_name)+'_vert.npy')
+                meta_vertices = np.load(os.path.join(self.data_path, scan_name)+'_all_noangle_40cls.npy')
+            targets, _ = compute_point_targets(point_cloud, meta_vertices[:,-2], meta_vertices[:,-1], meta_vertices)
+            save_point_targets(path, targets)
+        return np.load(path, mmap_mode='r')
+
+    def build_label_cache(self):
+        ''' Precompute the label cache of every scan in the split '''
+        for scan_name in self.scan_names:
+            self.load_label_cache(scan_name)
+
     def __getitem__(self, idx):
         """
         Returns a dict with following keys:
@@ -150,6 +398,8 @@ class ScannetDetectionDataset(Dataset):
             floor_height = np.percentile(point_cloud[:,2],0.99)
             height = point_cloud[:,2] - floor_height
             point_cloud = np.concatenate([point_cloud, np.expand_dims(height, 1)],1) 
+        if self.label_cache_path is not None:
+            cached_targets = self.load_label_cache(scan_name, point_cloud, meta_vertices)
         # ------------------------------- LABELS ------------------------------        
         target_bboxes = np.zeros((MAX_NUM_OBJ, 6))
         target_bboxes_mask = np.zeros((MAX_NUM_OBJ))    
@@ -163,15 +413,9 @@ class ScannetDetectionDataset(Dataset):
         surface_cue = np.zeros((MAX_NUM_OBJ))
         line_cue = np.zeros((MAX_NUM_OBJ,))
         
-        before_sample = np.unique(instance_labels)
-        while True:
-            orig_point_cloud = np.copy(point_cloud)
-            temp_point_cloud, choices = pc_util.random_sampling(orig_point_cloud,
-                                                           self.num_points, return_choices=True)
-            after_sample = np.unique(instance_labels[choices])
-            if np.array_equal(before_sample, after_sample):
-                point_cloud = temp_point_cloud
-                break
+        # Every instance keeps at least one point
+        point_cloud, choices = pc_util.instance_covering_sampling(point_cloud, instance_labels,
+                                                                  self.num_points, return_choices=True)
         instance_labels = instance_labels[choices]
         semantic_labels = semantic_labels[choices]
         meta_vertices = meta_vertices[choices]
@@ -179,6 +423,7 @@ class ScannetDetectionDataset(Dataset):
         pcl_color = pcl_color[choices]
         
         # ------------------------------- DATA AUGMENTATION ------------------------------        
+        aug_mat = np.eye(3)
         if self.augment:
             if np.random.random() > 0.5:
                 # Flipping along the YZ plane
@@ -186,6 +431,7 @@ class ScannetDetectionDataset(Dataset):
                 # target_bboxes[:,0] = -1 * target_bboxes[:,0]                
                 meta_vertices[:, 0] = -1 * meta_vertices[:, 0]                
                 meta_vertices[:, 6] = -1 * meta_vertices[:, 6]
+                aug_mat[0] *= -1
                 
             if np.random.random() > 0.5:
                 # Flipping along the XZ plane
@@ -193,6 +439,7 @@ class ScannetDetectionDataset(Dataset):
                 # target_bboxes[:,1] = -1 * target_bboxes[:,1]
                 meta_vertices[:, 1] = -1 * meta_vertices[:, 1]
                 meta_vertices[:, 6] = -1 * meta_vertices[:, 6]
+                aug_mat[1] *= -1
             
             # Rotation along up-axis/Z-axis
             rot_angle = (np.random.random()*np.pi/18) - np.pi/36 # -5 ~ +5 degree
@@ -200,6 +447,7 @@ class ScannetDetectionDataset(Dataset):
             point_cloud[:,0:3] = np.dot(point_cloud[:,0:3], np.transpose(rot_mat))
             meta_vertices[:, :6] = rotate_aligned_boxes(meta_vertices[:, :6], rot_mat)
             meta_vertices[:, 6] += rot_angle
+            aug_mat = np.dot(rot_mat, aug_mat)
         
         # ------------------------------- Plane and point ------------------------------
         # compute votes *AFTER* augmentation
@@ -208,244 +456,22 @@ class ScannetDetectionDataset(Dataset):
         # pc instance_labels (it had been filtered 
         # in the data preparation step) we'll compute the instance bbox
         # from the points sharing the same instance label. 
-        point_votes = np.zeros([self.num_points, 3])
-        point_votes_mask = np.zeros(self.num_points)
-
-        point_boundary_mask_z = np.zeros(self.num_points)
-        point_boundary_mask_xy = np.zeros(self.num_points)
-        point_boundary_offset_z = np.zeros([self.num_points, 3])
-        point_boundary_offset_xy = np.zeros([self.num_points, 3])
-        point_boundary_sem_z = np.zeros([self.num_points, 3+2+1])
-        point_boundary_sem_xy = np.zeros([self.num_points, 3+1+1])
-
-        point_line_mask = np.zeros(self.num_points)
-        point_line_offset = np.zeros([self.num_points, 3])
-        point_line_sem = np.zeros([self.num_points, 3+1])
+        if self.label_cache_path is None:
+            targets, obj_meta = compute_point_targets(point_cloud, instance_labels, semantic_labels, meta_vertices)
+        else:
+            # Cached targets of the full scan, moved along with the points
+            targets = transform_point_targets(unpack_point_targets(cached_targets[choices]), aug_mat)
+            # The rotation also enters the z surface extents through the box angle;
+            # take them from the augmented boxes as compute_point_targets does
+            sel = np.flatnonzero(targets['point_boundary_mask_z'])
+            corners = params2bbox_batch(meta_vertices[sel,0:3], meta_vertices[sel,3:6], meta_vertices[sel,6])
+            targets['point_boundary_sem_z'][sel,3:5] = corners[:,7,0:2] - corners[:,0,0:2]
+            _, first = np.unique(instance_labels, return_index=True)
+            obj_meta = [meta_vertices[i] for i in first if semantic_labels[i] in DC.nyu40ids]
+        point_votes = targets['point_votes']
+        point_votes_mask = targets['point_votes_mask']
+        point_sem_label = targets['point_sem_label']
 
-        point_sem_label = np.zeros(self.num_points)
-        
-        selected_instances = []
-        selected_centers = []
-        selected_centers_support = []
-        selected_centers_bsupport = []
-        obj_meta = []
-
-        counter = -1
-        for i_instance in np.unique(instance_labels):            
-            # find all points belong to that instance
-            ind = np.where(instance_labels == i_instance)[0]
-
-            if semantic_labels[ind[0]] in DC.nyu40ids:
-                counter += 1
-                idx_instance = counter
-                x = point_cloud[ind,:3]
-                ### Meta information here
-                meta = meta_vertices[ind[0]]
-                obj_meta.append(meta)
-                
-                ### Get the centroid here
-                center = meta[:3]
-
-                point_votes[ind, :] = center - x
-                point_votes_mask[ind] = 1.0
-                point_sem_label[ind] = DC.nyu40id2class_sem[meta[-1]]
-                                
-                ### Corners
-                corners, xmin, ymin, zmin, xmax, ymax, zmax = params2bbox(center, meta[3], meta[4], meta[5], meta[6])
-                
-                ## Get lower four lines
-                plane_lower_temp = np.array([0,0,1,-corners[6,-1]])
-                para_points = np.array([corners[1], corners[3], corners[5], corners[7]])
-                newd = np.sum(para_points * plane_lower_temp[:3], 1)
-                if check_upright(para_points) and plane_lower_temp[0]+plane_lower_temp[1] < LOWER_THRESH:
-                    plane_lower = np.array([0,0,1,plane_lower_temp[-1]]) 
-                    plane_upper = np.array([0,0,1,-np.mean(newd)])
-                else:
-                    import pdb;pdb.set_trace()
-                    print ("error with upright")
-                if check_z(plane_upper, para_points) == False:
-                    import pdb;pdb.set_trace()
-                ### Get the boundary points here
-                alldist = np.abs(np.sum(x*plane_lower[:3], 1) + plane_lower[-1])
-                mind = np.min(alldist)
-                sel = np.abs(alldist - mind) < DIST_THRESH
-                
-                ## Get lower four lines
-                line_sel1, line_sel2, line_sel3, line_sel4 = get_linesel(x[sel], xmin, xmax, ymin, ymax)
-                if np.sum(line_sel1) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel1]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel1], axis=0)
-                    linecenter[1] = (ymin+ymax)/2.0
-                    point_line_offset[ind[sel][line_sel1]] = linecenter - x[sel][line_sel1]
-                    point_line_sem[ind[sel][line_sel1]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel2) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel2]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel2], axis=0)
-                    linecenter[1] = (ymin+ymax)/2.0
-                    point_line_offset[ind[sel][line_sel2]] = linecenter - x[sel][line_sel2]
-                    point_line_sem[ind[sel][line_sel2]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel3) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel3]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel3], axis=0)
-                    linecenter[0] = (xmin+xmax)/2.0
-                    point_line_offset[ind[sel][line_sel3]] = linecenter - x[sel][line_sel3]
-                    point_line_sem[ind[sel][line_sel3]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel4) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel4]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel4], axis=0)
-                    linecenter[0] = (xmin+xmax)/2.0
-                    point_line_offset[ind[sel][line_sel4]] = linecenter - x[sel][line_sel4]
-                    point_line_sem[ind[sel][line_sel4]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                ### Set the surface labels here
-                if np.sum(sel) > NUM_POINT and np.var(alldist[sel]) < VAR_THRESH:
-                    center = np.array([(xmin+xmax)/2.0, (ymin+ymax)/2.0, np.mean(x[sel][:,2])])
-                    sel_global = ind[sel]
-                    point_boundary_mask_z[sel_global] = 1.0
-                    point_boundary_sem_z[sel_global] = np.array([center[0], center[1], center[2], xmax - xmin, ymax - ymin, np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                    point_boundary_offset_z[sel_global] = center - x[sel]
-                                    
-                ### Get the boundary points here
-                alldist = np.abs(np.sum(x*plane_upper[:3], 1) + plane_upper[-1])
-                mind = np.min(alldist)
-                sel = np.abs(alldist - mind) < DIST_THRESH
-                ## Get upper four lines
-                line_sel1, line_sel2, line_sel3, line_sel4 = get_linesel(x[sel], xmin, xmax, ymin, ymax)
-                if np.sum(line_sel1) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel1]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel1], axis=0)
-                    linecenter[1] = (ymin+ymax)/2.0
-                    point_line_offset[ind[sel][line_sel1]] = linecenter - x[sel][line_sel1]
-                    point_line_sem[ind[sel][line_sel1]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel2) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel2]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel2], axis=0)
-                    linecenter[1] = (ymin+ymax)/2.0
-                    point_line_offset[ind[sel][line_sel2]] = linecenter - x[sel][line_sel2]
-                    point_line_sem[ind[sel][line_sel2]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel3) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel3]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel3], axis=0)
-                    linecenter[0] = (xmin+xmax)/2.0
-                    point_line_offset[ind[sel][line_sel3]] = linecenter - x[sel][line_sel3]
-                    point_line_sem[ind[sel][line_sel3]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel4) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel4]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel4], axis=0)
-                    linecenter[0] = (xmin+xmax)/2.0
-                    point_line_offset[ind[sel][line_sel4]] = linecenter - x[sel][line_sel4]
-                    point_line_sem[ind[sel][line_sel4]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                
-                if np.sum(sel) > NUM_POINT and np.var(alldist[sel]) < VAR_THRESH:
-                    center = np.array([(xmin+xmax)/2.0, (ymin+ymax)/2.0, np.mean(x[sel][:,2])])
-                    sel_global = ind[sel]
-                    point_boundary_mask_z[sel_global] = 1.0
-                    point_boundary_sem_z[sel_global] = np.array([center[0], center[1], center[2], xmax - xmin, ymax - ymin, np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                    point_boundary_offset_z[sel_global] = center - x[sel]
-                                    
-                ## Get left two lines
-                v1 = corners[3] - corners[2]
-                v2 = corners[2] - corners[0]
-                cp = np.cross(v1, v2)
-                d = -np.dot(cp,corners[0])
-                a,b,c = cp
-                plane_left_temp = np.array([a, b, c, d])
-                para_points = np.array([corners[4], corners[5], corners[6], corners[7]])
-                ### Normalize xy here
-                plane_left_temp /= np.linalg.norm(plane_left_temp[:3])
-                newd = np.sum(para_points * plane_left_temp[:3], 1)
-                if plane_left_temp[2] < LOWER_THRESH:
-                    plane_left = plane_left_temp#np.array([cls,res,tempsign,plane_left_temp[-1]]) 
-                    plane_right = np.array([plane_left_temp[0], plane_left_temp[1], plane_left_temp[2], -np.mean(newd)])
-                else:
-                    import pdb;pdb.set_trace()
-                    print ("error with upright")
-                ### Get the boundary points here
-                alldist = np.abs(np.sum(x*plane_left[:3], 1) + plane_left[-1])
-                mind = np.min(alldist)
-                sel = np.abs(alldist - mind) < DIST_THRESH
-                ## Get upper four lines
-                line_sel1, line_sel2 = get_linesel2(x[sel], ymin, ymax, zmin, zmax, axis=1)
-                if np.sum(line_sel1) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel1]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel1], axis=0)
-                    linecenter[2] = (zmin+zmax)/2.0
-                    point_line_offset[ind[sel][line_sel1]] = linecenter - x[sel][line_sel1]
-                    point_line_sem[ind[sel][line_sel1]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel2) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel2]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel2], axis=0)
-                    linecenter[2] = (zmin+zmax)/2.0
-                    point_line_offset[ind[sel][line_sel2]] = linecenter - x[sel][line_sel2]
-                    point_line_sem[ind[sel][line_sel2]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(sel) > NUM_POINT and np.var(alldist[sel]) < VAR_THRESH:
-                    center = np.array([np.mean(x[sel][:,0]), np.mean(x[sel][:,1]), (zmin+zmax)/2.0])
-                    sel_global = ind[sel]
-                    point_boundary_mask_xy[sel_global] = 1.0
-                    point_boundary_sem_xy[sel_global] = np.array([center[0], center[1], center[2], zmax - zmin, np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                    point_boundary_offset_xy[sel_global] = center - x[sel]
-                    
-                ### Get the boundary points here
-                alldist = np.abs(np.sum(x*plane_right[:3], 1) + plane_right[-1])
-                mind = np.min(alldist)
-                sel = np.abs(alldist - mind) < DIST_THRESH
-                line_sel1, line_sel2 = get_linesel2(x[sel], ymin, ymax,  zmin, zmax, axis=1)
-                if np.sum(line_sel1) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel1]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel1], axis=0)
-                    linecenter[2] = (zmin+zmax)/2.0
-                    point_line_offset[ind[sel][line_sel1]] = linecenter - x[sel][line_sel1]
-                    point_line_sem[ind[sel][line_sel1]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(line_sel2) > NUM_POINT_LINE:
-                    point_line_mask[ind[sel][line_sel2]] = 1.0
-                    linecenter = np.mean(x[sel][line_sel2], axis=0)
-                    linecenter[2] = (zmin+zmax)/2.0
-                    point_line_offset[ind[sel][line_sel2]] = linecenter - x[sel][line_sel2]
-                    point_line_sem[ind[sel][line_sel2]] = np.array([linecenter[0], linecenter[1], linecenter[2], np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                if np.sum(sel) > NUM_POINT and np.var(alldist[sel]) < VAR_THRESH:
-                    center = np.array([np.mean(x[sel][:,0]), np.mean(x[sel][:,1]), (zmin+zmax)/2.0])
-                    sel_global = ind[sel]
-                    point_boundary_mask_xy[sel_global] = 1.0
-                    point_boundary_sem_xy[sel_global] = np.array([center[0], center[1], center[2], zmax - zmin, np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                    point_boundary_offset_xy[sel_global] = center - x[sel]
-                                        
-                ### Get the boundary points here
-                v1 = corners[0] - corners[4]
-                v2 = corners[4] - corners[5]
-                cp = np.cross(v1, v2)
-                d = -np.dot(cp,corners[5])
-                a,b,c = cp
-                plane_front_temp = np.array([a, b, c, d])
-                para_points = np.array([corners[2], corners[3], corners[6], corners[7]])
-                plane_front_temp /= np.linalg.norm(plane_front_temp[:3])
-                newd = np.sum(para_points * plane_front_temp[:3], 1)
-                if plane_front_temp[2] < LOWER_THRESH:
-                    plane_front = plane_front_temp
-                    plane_back = np.array([plane_front_temp[0], plane_front_temp[1], plane_front_temp[2], -np.mean(newd)])
-                else:
-                    import pdb;pdb.set_trace()
-                    print ("error with upright")
-                ### Get the boundary points here
-                alldist = np.abs(np.sum(x*plane_front[:3], 1) + plane_front[-1])
-                mind = np.min(alldist)
-                sel = np.abs(alldist - mind) < DIST_THRESH
-                if np.sum(sel) > NUM_POINT and np.var(alldist[sel]) < VAR_THRESH:
-                    center = np.array([np.mean(x[sel][:,0]), np.mean(x[sel][:,1]), (zmin+zmax)/2.0])
-                    sel_global = ind[sel]
-                    point_boundary_mask_xy[sel_global] = 1.0
-                    point_boundary_sem_xy[sel_global] = np.array([center[0], center[1], center[2], zmax - zmin, np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                    point_boundary_offset_xy[sel_global] = center - x[sel]
-                                    
-                ### Get the boundary points here
-                alldist = np.abs(np.sum(x*plane_back[:3], 1) + plane_back[-1])
-                mind = np.min(alldist)
-                sel = np.abs(alldist - mind) < DIST_THRESH
-                if np.sum(sel) > NUM_POINT and np.var(alldist[sel]) < VAR_THRESH:
-                    center = np.array([np.mean(x[sel][:,0]), np.mean(x[sel][:,1]), (zmin+zmax)/2.0])
-                    sel_global = ind[sel]
-                    point_boundary_mask_xy[sel_global] = 1.0
-                    point_boundary_sem_xy[sel_global] = np.array([center[0], center[1], center[2], zmax - zmin, np.where(DC.nyu40ids == meta_vertices[ind[0],-1])[0][0]])
-                    point_boundary_offset_xy[sel_global] = center - x[sel]
-                    
         num_instance = len(obj_meta)
         obj_meta = np.array(obj_meta)
         obj_meta = obj_meta.reshape(-1, 9)
@@ -484,16 +510,16 @@ class ScannetDetectionDataset(Dataset):
         ret_dict['point_sem_cls_label'] = point_sem_label.astype(np.int64)
         ret_dict['box_label_mask'] = target_bboxes_mask.astype(np.float32)
 
-        ret_dict['point_boundary_mask_z'] = point_boundary_mask_z.astype(np.float32)
-        ret_dict['point_boundary_mask_xy'] = point_boundary_mask_xy.astype(np.float32)
-        ret_dict['point_boundary_offset_z'] = point_boundary_offset_z.astype(np.float32)
-        ret_dict['point_boundary_offset_xy'] = point_boundary_offset_xy.astype(np.float32)
-        ret_dict['point_boundary_sem_z'] = point_boundary_sem_z.astype(np.float32)
-        ret_dict['point_boundary_sem_xy'] = point_boundary_sem_xy.astype(np.float32)
+        ret_dict['point_boundary_mask_z'] = targets['point_boundary_mask_z'].astype(np.float32)
+        ret_dict['point_boundary_mask_xy'] = targets['point_boundary_mask_xy'].astype(np.float32)
+        ret_dict['point_boundary_offset_z'] = targets['point_boundary_offset_z'].astype(np.float32)
+        ret_dict['point_boundary_offset_xy'] = targets['point_boundary_offset_xy'].astype(np.float32)
+        ret_dict['point_boundary_sem_z'] = targets['point_boundary_sem_z'].astype(np.float32)
+        ret_dict['point_boundary_sem_xy'] = targets['point_boundary_sem_xy'].astype(np.float32)
 
-        ret_dict['point_line_mask'] = point_line_mask.astype(np.float32)
-        ret_dict['point_line_offset'] = point_line_offset.astype(np.float32)
-        ret_dict['point_line_sem'] = point_line_sem.astype(np.float32)
+        ret_dict['point_line_mask'] = targets['point_line_mask'].astype(np.float32)
+        ret_dict['point_line_offset'] = targets['point_line_offset'].astype(np.float32)
+        ret_dict['point_line_sem'] = targets['point_line_sem'].astype(np.float32)
         
         ret_dict['vote_label'] = point_votes.astype(np.float32)
         ret_dict['vote_label_mask'] = point_votes_mask.astype(np.int64)
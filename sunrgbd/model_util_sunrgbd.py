@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import numpy as np
+import torch
 import sys
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -36,6 +37,17 @@ class SunrgbdDatasetConfig(object):
             else:
                 self.class37_2_class10.update({i: -1})
 
+        # Lookup tables of the two maps for numpy indexing by 37-class id
+        self.class37_2_class10_arr = np.array([self.class37_2_class10[i] for i in range(38)])
+        # CSR form of the multi-label map: the classes of id i are ind[ptr[i]:ptr[i+1]]
+        self.class37_2_class10_multi_ptr = np.cumsum([0] + [len(self.class37_2_class10_multi[i]) for i in range(38)])
+        self.class37_2_class10_multi_ind = np.concatenate([self.class37_2_class10_multi[i] for i in range(38)])
+        # (38, num_class) membership, mask[i, c] iff c in class37_2_class10_multi[i]
+        self.class37_2_class10_multi_mask = np.zeros((38, self.num_class), dtype=bool)
+        rows = np.repeat(np.arange(38), np.diff(self.class37_2_class10_multi_ptr))
+        valid = self.class37_2_class10_multi_ind >= 0
+        self.class37_2_class10_multi_mask[rows[valid], self.class37_2_class10_multi_ind[valid]] = True
+
         self.class2type = {self.type2class[t]:t for t in self.type2class}
         self.type2onehotclass={'bed':0, 'table':1, 'sofa':2, 'chair':3, 'toilet':4, 'desk':5, 'dresser':6, 'night_stand':7, 'bookshelf':8, 'bathtub':9}
         self.type_mean_size = {'bathtub': np.array([0.765840,1.398258,0.472728]),
@@ -92,6 +104,19 @@ class SunrgbdDatasetConfig(object):
             angle = angle - 2*np.pi
         return angle
 
+    def class2size_batch(self, pred_cls, residual):
+        ''' class2size for torch tensors (...) and (...,3) '''
+        mean_size_arr = torch.from_numpy(self.mean_size_arr).to(residual)
+        return mean_size_arr[pred_cls] + residual
+
+    def class2angle_batch(self, pred_cls, residual, to_label_format=True):
+        ''' class2angle for torch tensors (...) and (...) '''
+        angle_per_class = 2*np.pi/float(self.num_heading_bin)
+        angle = pred_cls.to(residual) * angle_per_class + residual
+        if to_label_format:
+            angle = torch.where(angle>np.pi, angle - 2*np.pi, angle)
+        return angle
+
     def param2obb(self, center, heading_class, heading_residual, size_class, size_residual):
         heading_angle = self.class2angle(heading_class, heading_residual)
         box_size = self.class2size(int(size_class), size_residual)
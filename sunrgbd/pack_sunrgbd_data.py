@@ -0,0 +1,22 @@
+# coding: utf-8
+""" Convert the per scene SUN RGB-D files of a split into a packed, memmappable store.
+
+Usage: python pack_sunrgbd_data.py --data_path <dir with sunrgbd_pc_bbox_votes_50k_v1_*> --split train
+Writes <split dir>_packed/, used by SunrgbdDetectionVotesDataset(..., use_packed=True).
+"""
+import os
+import sys
+import argparse
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from sunrgbd_detection_dataset_hd import pack_scenes
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', required=True, help='path to dataset')
+    parser.add_argument('--split', default='train', help='train or val [default: train]')
+    FLAGS = parser.parse_args()
+
+    split_path = os.path.join(FLAGS.data_path, 'sunrgbd_pc_bbox_votes_50k_v1_' + FLAGS.split)
+    scan_names = pack_scenes(split_path, split_path + '_packed')
+    print('packed {} scans into {}'.format(len(scan_names), split_path + '_packed'))
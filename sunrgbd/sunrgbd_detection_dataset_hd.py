@@ -22,7 +22,9 @@ Date: 2019
 """
 import os
 import sys
+import zipfile
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
@@ -30,6 +32,7 @@ sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'utils'))
 import pc_util
 import sunrgbd_utils
+from box_util import rotz_batch_pytorch
 from sunrgbd_utils import extract_pc_in_box3d
 from model_util_sunrgbd import SunrgbdDatasetConfig
 
@@ -48,6 +51,60 @@ MIND_THRESH = 0.1
 
 NUM_POINT_SEM_THRESHOLD = 1
 
+# Arrays of the packed store, see pack_scenes; bbox has its own offsets
+PACKED_ARRAYS = [('pc', '_pc.npz'), ('votes', '_votes.npz'), ('bbox', '_bbox.npy')]
+
+def _saved_array_header(path):
+    ''' (shape, dtype) of the single array in a .npy or .npz file, without loading it '''
+    if path.endswith('.npz'):
+        with zipfile.ZipFile(path) as zf:
+            f = zf.open(zf.namelist()[0])
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            f.close()
+        return shape, dtype
+    arr = np.load(path, mmap_mode='r')
+    return arr.shape, arr.dtype
+
+def pack_scenes(data_path, packed_path):
+    ''' Convert the per scene files of a split into one memmappable array per kind.
+    @Args:
+        data_path: dir of <scan>_pc.npz, <scan>_votes.npz and <scan>_bbox.npy
+        packed_path: output dir of pc.npy, votes.npy, bbox.npy and index.npz
+    '''
+    scan_names = sorted(list(set([os.path.basename(x)[0:6] for x in os.listdir(data_path)])))
+    if not os.path.exists(packed_path):
+        os.makedirs(packed_path)
+    index = {'scan_names': np.array(scan_names)}
+    for key, suffix in PACKED_ARRAYS:
+        headers = [_saved_array_header(os.path.join(data_path, name)+suffix) for name in scan_names]
+        offsets = np.cumsum([0] + [shape[0] for shape, _ in headers])
+        out = np.lib.format.open_memmap(os.path.join(packed_path, key+'.npy'), mode='w+',
+                                        dtype=headers[0][1], shape=(int(offsets[-1]),) + headers[0][0][1:])
+        for i, name in enumerate(scan_names):
+            data = np.load(os.path.join(data_path, name)+suffix)
+            if suffix.endswith('.npz'):
+                data = data[data.files[0]]
+            out[offsets[i]:offsets[i+1]] = data
+        out.flush()
+        del out
+        index[key+'_offsets'] = offsets
+    np.savez(os.path.join(packed_path, 'index.npz'), **index)
+    return scan_names
+
+def load_packed_scenes(packed_path):
+    ''' Memmap a store written by pack_scenes read-only. Callers copy a
+    scene's rows out before augmenting them in place.
+    Returns scan_names and {kind: (array, offsets)}
+    '''
+    index = np.load(os.path.join(packed_path, 'index.npz'))
+    store = {}
+    for key, _ in PACKED_ARRAYS:
+        store[key] = (np.load(os.path.join(packed_path, key+'.npy'), mmap_mode='r'), index[key+'_offsets'])
+    return [str(x) for x in index['scan_names']], store
+
 def check_upright(para_points):
     return (para_points[0][-1] == para_points[1][-1]) and (para_points[1][-1] == para_points[2][-1]) and (para_points[2][-1] == para_points[3][-1])
 
@@ -63,46 +120,37 @@ def clockwise2counter(angle):
     '''
     return -((angle + np.pi / 2) % np.pi) + np.pi / 2;
 
-def point2line_dist(points, a, b): 
+# Corner pairs of the 12 box edges; get_linesel picks the four lower, four upper,
+# two left and two right ones
+BOX_EDGES = [(0, 2), (4, 6), (0, 4), (2, 6), (1, 3), (5, 7), (1, 5), (3, 7), (0, 1), (2, 3), (4, 5), (6, 7)]
+LINESEL_EDGES = {'lower': slice(0, 4), 'upper': slice(4, 8), 'left': slice(8, 10), 'right': slice(10, 12)}
+
+def point2edges_dist(points, corners, edges=BOX_EDGES):
     '''
     @Args:
         points: (N, 3)
-        a / b: (3,)
+        corners: (8, 3)
+        edges: E corner index pairs (a, b)
     @Returns:
-        distance: (N,)
+        distance: (N, E) distance of every point to every line through a and b
     '''
-    x = b - a 
-    t = np.dot(points - a, x) / np.dot(x, x) 
-    c = a + t[:, None] * np.tile(x, (t.shape[0], 1)) 
-    return np.linalg.norm(points - c, axis=1) 
-
-def get_linesel(points, corners, direction):
-    ''' corners:
+    a = corners[[e[0] for e in edges]]
+    x = corners[[e[1] for e in edges]] - a
+    # One (E, N) array per coordinate keeps every op contiguous
+    diff = [points[:, k] - a[:, k, None] for k in range(3)]
+    t = (diff[0] * x[:, 0, None] + diff[1] * x[:, 1, None] + diff[2] * x[:, 2, None]) / np.sum(x * x, 1)[:, None]
+    r = [diff[k] - t * x[:, k, None] for k in range(3)]
+    return np.sqrt(r[0] * r[0] + r[1] * r[1] + r[2] * r[2]).T
+
+def get_linesel(near_edge, direction):
+    ''' near_edge: (N, 12) point2edges_dist(points, corners) < LINE_THRESH
+    corners:
     [[xmin, ymin, zmin], [xmin, ymin, zmax], [xmin, ymax, zmin], [xmin, ymax, zmax],
      [xmax, ymin, zmin], [xmax, ymin, zmax], [xmax, ymax, zmin], [xmax, ymax, zmax]]
     '''
-    if direction == 'lower':
-        sel1 = point2line_dist(points, corners[0], corners[2]) < LINE_THRESH
-        sel2 = point2line_dist(points, corners[4], corners[6]) < LINE_THRESH
-        sel3 = point2line_dist(points, corners[0], corners[4]) < LINE_THRESH
-        sel4 = point2line_dist(points, corners[2], corners[6]) < LINE_THRESH
-        return sel1, sel2, sel3, sel4
-    elif direction == 'upper':
-        sel1 = point2line_dist(points, corners[1], corners[3]) < LINE_THRESH
-        sel2 = point2line_dist(points, corners[5], corners[7]) < LINE_THRESH
-        sel3 = point2line_dist(points, corners[1], corners[5]) < LINE_THRESH
-        sel4 = point2line_dist(points, corners[3], corners[7]) < LINE_THRESH
-        return sel1, sel2, sel3, sel4
-    elif direction == 'left':
-        sel1 = point2line_dist(points, corners[0], corners[1]) < LINE_THRESH
-        sel2 = point2line_dist(points, corners[2], corners[3]) < LINE_THRESH
-        return sel1, sel2
-    elif direction == 'right':
-        sel1 = point2line_dist(points, corners[4], corners[5]) < LINE_THRESH
-        sel2 = point2line_dist(points, corners[6], corners[7]) < LINE_THRESH
-        return sel1, sel2
-    else:
+    if direction not in LINESEL_EDGES:
         AssertionError('direction = lower / upper / left')
+    return tuple(near_edge[:, LINESEL_EDGES[direction]].T)
 
 
 def get_linesel2(points, ymin, ymax, zmin, zmax, axis=0):
@@ -143,10 +191,77 @@ def params2bbox(center, size, angle):
 
 
 
+def augment_batch_pytorch(batch_data_label, use_color=False, use_height=False):
+    ''' The flip, z rotation, color jitter and scaling of __getitem__ as batched ops
+    on a collated batch, on the batch's device. Meant for a dataset built with
+    augment=False; the targets are moved with the points instead of recomputed.
+    '''
+    pc = batch_data_label['point_clouds']
+    B, N = pc.shape[0:2]
+    device = pc.device
+    flip = torch.rand(B, device=device) > 0.5
+    sign = torch.ones(B, 3, device=device)
+    sign[:,0] = torch.where(flip, -1.0, 1.0)
+    rot_angle = (torch.rand(B, device=device)*np.pi/3) - np.pi/6 # -30 ~ +30 degree
+    scale_ratio = torch.rand(B, device=device)*0.3+0.85
+    # p -> mat p, for points, centers and votes alike
+    mat = scale_ratio.view(B, 1, 1) * torch.matmul(rotz_batch_pytorch(rot_angle), torch.diag_embed(sign))
+    mat_t = mat.transpose(1, 2)
+
+    pc[:,:,0:3] = torch.matmul(pc[:,:,0:3], mat_t)
+    if use_color:
+        mean_color = torch.tensor(MEAN_COLOR_RGB, dtype=pc.dtype, device=device)
+        rgb_color = pc[:,:,3:6] + mean_color
+        rgb_color = rgb_color * (1+0.4*torch.rand(B, 1, 3, device=device)-0.2) # brightness change for each channel
+        rgb_color = rgb_color + (0.1*torch.rand(B, 1, 3, device=device)-0.05) # color shift for each channel
+        rgb_color = rgb_color + (0.05*torch.rand(B, N, 1, device=device)-0.025) # jittering on each pixel
+        rgb_color = torch.clamp(rgb_color, 0, 1)
+        # randomly drop out 30% of the points' colors
+        rgb_color = rgb_color * (torch.rand(B, N, 1, device=device) > 0.3)
+        pc[:,:,3:6] = rgb_color - mean_color
+    if use_height:
+        pc[:,:,-1] *= scale_ratio.view(B, 1)
+
+    # Boxes: centers move with the points, sizes scale and headings flip and turn
+    mask = batch_data_label['box_label_mask']
+    batch_data_label['center_label'] = torch.matmul(batch_data_label['center_label'], mat_t)
+    size = batch_data_label['size_label']
+    new_size = size * scale_ratio.view(B, 1, 1)
+    batch_data_label['size_label'] = new_size
+    batch_data_label['size_residual_label'] = batch_data_label['size_residual_label'] + new_size - size
+    angle = batch_data_label['heading_label']
+    angle = torch.where(flip.view(B, 1), np.pi - angle, angle) - rot_angle.view(B, 1)
+    angle = angle * mask
+    batch_data_label['heading_label'] = angle
+    # DC.angle2class on every box
+    angle_per_class = 2*np.pi/float(DC.num_heading_bin)
+    shifted_angle = torch.remainder(torch.remainder(angle, 2*np.pi) + angle_per_class/2, 2*np.pi)
+    angle_class = torch.floor(shifted_angle/angle_per_class)
+    batch_data_label['heading_class_label'] = angle_class.long()
+    batch_data_label['heading_residual_label'] = shifted_angle - (angle_class*angle_per_class+angle_per_class/2)
+    max_bboxes = batch_data_label['max_gt_bboxes'].clone()
+    max_bboxes[:,:,0:3] = torch.matmul(max_bboxes[:,:,0:3], mat_t.to(max_bboxes.dtype))
+    max_bboxes[:,:,3:6] *= scale_ratio.view(B, 1, 1).to(max_bboxes.dtype)
+    max_bboxes[:,:,6] = angle.to(max_bboxes.dtype)
+    batch_data_label['max_gt_bboxes'] = max_bboxes
+
+    # Per point targets
+    votes = batch_data_label['vote_label']
+    batch_data_label['vote_label'] = torch.matmul(votes.view(B, -1, 3), mat_t).view(votes.shape)
+    for key in ['point_boundary_offset_z', 'point_boundary_offset_xy', 'point_line_offset',
+                'point_boundary_sem_z', 'point_boundary_sem_xy', 'point_line_sem']:
+        target = batch_data_label[key].clone()
+        target[:,:,0:3] = torch.matmul(target[:,:,0:3], mat_t)
+        batch_data_label[key] = target
+    # Box edge lengths of the surface targets
+    batch_data_label['point_boundary_sem_z'][:,:,3:5] *= scale_ratio.view(B, 1, 1)
+    batch_data_label['point_boundary_sem_xy'][:,:,3] *= scale_ratio.view(B, 1)
+    return batch_data_label
+
 class SunrgbdDetectionVotesDataset(Dataset):
     def __init__(self, data_path=None, split_set='train', num_points=20000,
         use_color=False, use_height=False, use_v1=False,
-        augment=False, scan_idx_list=None):
+        augment=False, scan_idx_list=None, use_packed=False):
 
         assert(num_points<=50000)
         self.use_v1 = use_v1 
@@ -157,8 +272,15 @@ class SunrgbdDetectionVotesDataset(Dataset):
             AssertionError("v2 data is not prepared")
 
         self.raw_data_path = os.path.join(ROOT_DIR, 'sunrgbd/sunrgbd_trainval')
-        self.scan_names = sorted(list(set([os.path.basename(x)[0:6] \
-            for x in os.listdir(self.data_path)])))
+        # Packed store written by pack_scenes next to the split dir
+        self.packed_path = self.data_path + '_packed' if use_packed else None
+        self.packed_store = None
+        if use_packed:
+            self.scan_names, _ = load_packed_scenes(self.packed_path)
+            self.packed_ids = dict([(name, i) for i, name in enumerate(self.scan_names)])
+        else:
+            self.scan_names = sorted(list(set([os.path.basename(x)[0:6] \
+                for x in os.listdir(self.data_path)])))
 
         if scan_idx_list is not None:
             self.scan_names = [self.scan_names[i] for i in scan_idx_list]
@@ -189,13 +311,23 @@ class SunrgbdDetectionVotesDataset(Dataset):
             max_gt_bboxes: unused
         """
         scan_name = self.scan_names[idx]
-        point_color_sem = np.load(os.path.join(self.data_path, scan_name)+'_pc.npz')['pc'] # Nx6
-        bboxes = np.load(os.path.join(self.data_path, scan_name)+'_bbox.npy') # K,8
-        point_votes = np.load(os.path.join(self.data_path, scan_name)+'_votes.npz')['point_votes'] # Nx10
+        if self.packed_path is None:
+            point_color_sem = np.load(os.path.join(self.data_path, scan_name)+'_pc.npz')['pc'] # Nx6
+            bboxes = np.load(os.path.join(self.data_path, scan_name)+'_bbox.npy') # K,8
+            point_votes = np.load(os.path.join(self.data_path, scan_name)+'_votes.npz')['point_votes'] # Nx10
+        else:
+            # Opened lazily so every dataloader worker maps the store itself
+            if self.packed_store is None:
+                _, self.packed_store = load_packed_scenes(self.packed_path)
+            i = self.packed_ids[scan_name]
+            scene = {}
+            for key, (arr, offsets) in self.packed_store.items():
+                # Private copy: augmentation below writes to these in place
+                scene[key] = np.array(arr[offsets[i]:offsets[i+1]])
+            point_color_sem, bboxes, point_votes = scene['pc'], scene['bbox'], scene['votes']
 
         semantics37 = point_color_sem[:, 6]
-        semantics10 = np.array([DC.class37_2_class10[k] for k in semantics37])
-        semantics10_multi = [DC.class37_2_class10_multi[k] for k in semantics37]
+        semantics10 = DC.class37_2_class10_arr[semantics37.astype(np.int64)]
         if not self.use_color:
             point_cloud = point_color_sem[:, 0:3]
         else:
@@ -315,7 +447,6 @@ class SunrgbdDetectionVotesDataset(Dataset):
         point_cloud, choices = pc_util.random_sampling(point_cloud, self.num_points, return_choices=True)
         semantics37 = semantics37[choices]
         semantics10 = semantics10[choices]
-        semantics10_multi = [semantics10_multi[i] for i in choices]
         point_votes_mask = point_votes[choices,0]
         point_votes = point_votes[choices,1:]
 
@@ -333,16 +464,14 @@ class SunrgbdDetectionVotesDataset(Dataset):
             # find point with same semantic as bbox, note semantics is 37 cls in sunrgbd
 
             # ind = ind_all_cls[np.where(semantics10[ind_all_cls] == bbox[7])[0]]
-            ind = []
-            for j in ind_all_cls:
-                if bbox[7] in semantics10_multi[j]:
-                    ind.append(j)
-            ind = np.array(ind)
+            ind = ind_all_cls[DC.class37_2_class10_multi_mask[semantics37[ind_all_cls].astype(np.int64), int(bbox[7])]]
 
             if ind.shape[0] < NUM_POINT_SEM_THRESHOLD:
                 pass
             else:
                 x = point_cloud[ind, :3]
+                # Closeness to all 12 edges at once, for the line selections below
+                near_edge = point2edges_dist(x, corners) < LINE_THRESH
 
                 ###Get bb planes and boundary points
                 plane_lower_temp = np.array([0,0,1,-corners[6,-1]])
@@ -366,7 +495,7 @@ class SunrgbdDetectionVotesDataset(Dataset):
                 #sel = (np.abs(alldist - mind) < DIST_THRESH) & (point_cloud[:,0] >= xmin) & (point_cloud[:,0] <= xmax) & (point_cloud[:,1] >= ymin) & (point_cloud[:,1] <= ymax)
 
                 ## Get lower four lines
-                line_sel1, line_sel2, line_sel3, line_sel4 = get_linesel(x[sel], corners, 'lower')
+                line_sel1, line_sel2, line_sel3, line_sel4 = get_linesel(near_edge[sel], 'lower')
                 if np.sum(line_sel1) > NUM_POINT_LINE:
                     point_line_mask[ind[sel][line_sel1]] = 1.0
                     linecenter = (corners[0] + corners[2]) / 2.0
@@ -424,7 +553,7 @@ class SunrgbdDetectionVotesDataset(Dataset):
                 #sel = (np.abs(alldist - mind) < DIST_THRESH) & (point_cloud[:,0] >= xmin) & (point_cloud[:,0] <= xmax) & (point_cloud[:,1] >= ymin) & (point_cloud[:,1] <= ymax)
 
                 ## Get upper four lines
-                line_sel1, line_sel2, line_sel3, line_sel4 = get_linesel(x[sel], corners, 'upper')
+                line_sel1, line_sel2, line_sel3, line_sel4 = get_linesel(near_edge[sel], 'upper')
                 if np.sum(line_sel1) > NUM_POINT_LINE:
                     point_line_mask[ind[sel][line_sel1]] = 1.0
                     linecenter = (corners[1] + corners[3]) / 2.0
@@ -479,7 +608,7 @@ class SunrgbdDetectionVotesDataset(Dataset):
                 sel = np.abs(alldist - mind) < DIST_THRESH
                 #sel = (np.abs(alldist - mind) < DIST_THRESH) & (point_cloud[:,2] >= zmin) & (point_cloud[:,2] <= zmax) & (point_cloud[:,1] >= ymin) & (point_cloud[:,1] <= ymax)
                 ## Get upper four lines
-                line_sel1, line_sel2 = get_linesel(x[sel], corners, 'left')
+                line_sel1, line_sel2 = get_linesel(near_edge[sel], 'left')
                 if np.sum(line_sel1) > NUM_POINT_LINE:
                     point_line_mask[ind[sel][line_sel1]] = 1.0
                     linecenter = (corners[0] + corners[1]) / 2.0
@@ -524,7 +653,7 @@ class SunrgbdDetectionVotesDataset(Dataset):
                 #mind = val[np.argmax(count)]
                 sel = np.abs(alldist - mind) < DIST_THRESH
                 #sel = (np.abs(alldist - mind) < DIST_THRESH) & (point_cloud[:,2] >= zmin) & (point_cloud[:,2] <= zmax) & (point_cloud[:,1] >= ymin) & (point_cloud[:,1] <= ymax)
-                line_sel1, line_sel2 = get_linesel(x[sel], corners, 'right')
+                line_sel1, line_sel2 = get_linesel(near_edge[sel], 'right')
                 if np.sum(line_sel1) > NUM_POINT_LINE:
                     point_line_mask[ind[sel][line_sel1]] = 1.0
                     linecenter = (corners[4] + corners[5]) / 2.0
@@ -37,7 +37,7 @@ sys.path.append(os.path.join(ROOT_DIR, 'pointnet2'))
 sys.path.append(os.path.join(ROOT_DIR, 'models'))
 from pytorch_utils import BNMomentumScheduler
 from tf_visualizer import Visualizer as TfVisualizer
-from ap_helper import APCalculator, parse_predictions, parse_groundtruths
+from ap_helper import APCalculatorStreaming, parse_predictions, parse_groundtruths
 from pc_util import compute_iou
 from dump_helper import dump_results
 
@@ -53,6 +53,7 @@ parser.add_argument('--num_target', type=int, default=256, help='Proposal number
 parser.add_argument('--vote_factor', type=int, default=1, help='Vote factor [default: 1]')
 parser.add_argument('--cluster_sampling', default='vote_fps', help='Sampling strategy for vote clusters: vote_fps, seed_fps, random [default: vote_fps]')
 parser.add_argument('--ap_iou_thresh', type=float, default=0.25, help='AP IoU threshold [default: 0.25]')
+parser.add_argument('--single_nms_ap', action='store_true', help='Score AP at 2*ap_iou_thresh on the NMS-0.25 predictions instead of a separate NMS-0.5 parse.')
 parser.add_argument('--max_epoch', type=int, default=360, help='Epoch to run [default: 180]')
 parser.add_argument('--refine_epoch', type=int, default=400, help='Epoch to run [default: 180]')
 parser.add_argument('--votenet_epoch', type=int, default=300, help='Epoch to run [default: 180]')
@@ -68,7 +69,10 @@ parser.add_argument('--use_objcue', action='store_true', help='Use support relat
 parser.add_argument('--opt_proposal', action='store_true', help='Use support relation in input.')
 parser.add_argument('--use_plane', action='store_true', help='Use support relation in input.')
 parser.add_argument('--get_data', action='store_true', help='Use support relation in input.')
+parser.add_argument('--use_packed_sunrgbd', action='store_true', help='Read SUN RGB-D from the store of sunrgbd/pack_sunrgbd_data.py')
 parser.add_argument('--use_sunrgbd_v2', action='store_true', help='Use V2 box labels for SUN RGB-D dataset')
+parser.add_argument('--label_cache_path', default=None, help='Dir of precomputed ScanNet point targets, see scannet/build_label_cache.py. Surface/line points are selected on the full, unaugmented scans, so the targets approximate the uncached ones [default: None]')
+parser.add_argument('--batch_augment', action='store_true', help='Augment collated training batches on the device instead of in the dataloader workers.')
 parser.add_argument('--overwrite', action='store_true', help='Overwrite existing log and dump folders.')
 parser.add_argument('--dump_results', action='store_true', help='Dump results.')
 FLAGS = parser.parse_args()
@@ -132,24 +136,28 @@ def my_worker_init_fn(worker_id):
 if FLAGS.dataset == 'sunrgbd':
     sys.path.append(os.path.join(ROOT_DIR, 'sunrgbd'))
     from sunrgbd_detection_dataset_hd import SunrgbdDetectionVotesDataset, MAX_NUM_OBJ
+    from sunrgbd_detection_dataset_hd import augment_batch_pytorch
     from model_util_sunrgbd import SunrgbdDatasetConfig
     DATASET_CONFIG = SunrgbdDatasetConfig()
+    AUGMENT_BATCH = lambda batch: augment_batch_pytorch(batch, FLAGS.use_color, not FLAGS.no_height)
     TRAIN_DATASET = SunrgbdDetectionVotesDataset(FLAGS.data_path, 'train', num_points=NUM_POINT,
-        augment=True,
+        augment=(not FLAGS.batch_augment),
         use_color=FLAGS.use_color, use_height=(not FLAGS.no_height),
-        use_v1=(not FLAGS.use_sunrgbd_v2))
+        use_v1=(not FLAGS.use_sunrgbd_v2), use_packed=FLAGS.use_packed_sunrgbd)
     TEST_DATASET = SunrgbdDetectionVotesDataset(FLAGS.data_path, 'val', num_points=NUM_POINT,
         augment=False,
         use_color=FLAGS.use_color, use_height=(not FLAGS.no_height),
-        use_v1=(not FLAGS.use_sunrgbd_v2))
+        use_v1=(not FLAGS.use_sunrgbd_v2), use_packed=FLAGS.use_packed_sunrgbd)
 elif FLAGS.dataset == 'scannet':
     sys.path.append(os.path.join(ROOT_DIR, 'scannet'))
     from scannet_detection_dataset_hd import ScannetDetectionDataset, MAX_NUM_OBJ
+    from scannet_detection_dataset_hd import augment_batch_pytorch as AUGMENT_BATCH
     from model_util_scannet import ScannetDatasetConfig
     DATASET_CONFIG = ScannetDatasetConfig()
     TRAIN_DATASET = ScannetDetectionDataset(FLAGS.data_path, 'train', num_points=NUM_POINT,
-                                            augment=True, use_angle=FLAGS.use_angle,
-                                            use_color=FLAGS.use_color, use_height=(not FLAGS.no_height))
+                                            augment=(not FLAGS.batch_augment), use_angle=FLAGS.use_angle,
+                                            use_color=FLAGS.use_color, use_height=(not FLAGS.no_height),
+                                            label_cache_path=FLAGS.label_cache_path)
     TEST_DATASET = ScannetDetectionDataset(FLAGS.data_path, 'val', num_points=NUM_POINT,
                                            augment=False, use_angle=FLAGS.use_angle,
                                            use_color=FLAGS.use_color, use_height=(not FLAGS.no_height))
@@ -227,14 +235,19 @@ TEST_VISUALIZER = TfVisualizer(FLAGS, 'test')
 # Used for AP calculation
 CONFIG_DICT = {'remove_empty_box':False, 'use_3d_nms':True,
     'nms_iou':0.25, 'use_old_type_nms':False, 'cls_nms':True,
+    'rotated_nms':False,
     'per_class_proposal': True, 'conf_thresh':0.05,
     'dataset_config':DATASET_CONFIG}
 
 CONFIG_DICT_L = {'remove_empty_box':False, 'use_3d_nms':True,
     'nms_iou':0.5, 'use_old_type_nms':False, 'cls_nms':True,
+    'rotated_nms':False,
     'per_class_proposal': True, 'conf_thresh':0.05,
     'dataset_config':DATASET_CONFIG}
 
+# 2*ap_iou_thresh is scored on the CONFIG_DICT_L predictions unless --single_nms_ap
+AP_IOU_THRESHS = [FLAGS.ap_iou_thresh, FLAGS.ap_iou_thresh*2] if FLAGS.single_nms_ap else FLAGS.ap_iou_thresh
+
 # ------------------------------------------------------------------------- GLOBAL CONFIG END
 def train_one_epoch():
     stat_dict = {} # collect statistics
@@ -247,6 +260,8 @@ def train_one_epoch():
         end_points = {}
         for key in batch_data_label:
             batch_data_label[key] = batch_data_label[key].to(device)
+        if FLAGS.batch_augment:
+            batch_data_label = AUGMENT_BATCH(batch_data_label)
     
         # Forward pass
         inputs = {'point_clouds': batch_data_label['point_clouds']}
@@ -280,10 +295,11 @@ def train_one_epoch():
 
 def evaluate_one_epoch():
     stat_dict = {} # collect statistics
-    ap_calculator = APCalculator(ap_iou_thresh=FLAGS.ap_iou_thresh,
-        class2type_map=DATASET_CONFIG.class2type)
-    ap_calculator_l = APCalculator(ap_iou_thresh=FLAGS.ap_iou_thresh*2,
+    ap_calculator = APCalculatorStreaming(ap_iou_thresh=AP_IOU_THRESHS,
         class2type_map=DATASET_CONFIG.class2type)
+    if not FLAGS.single_nms_ap:
+        ap_calculator_l = APCalculatorStreaming(ap_iou_thresh=FLAGS.ap_iou_thresh*2,
+            class2type_map=DATASET_CONFIG.class2type)
 
     net.eval() # set model to eval mode (for bn and dp)
     
@@ -313,9 +329,10 @@ def evaluate_one_epoch():
         batch_gt_map_cls = parse_groundtruths(end_points, CONFIG_DICT) 
         ap_calculator.step(batch_pred_map_cls, batch_gt_map_cls)
 
-        batch_pred_map_cls = parse_predictions(end_points, CONFIG_DICT_L, opt_ang=(FLAGS.dataset == 'sunrgbd'))
-        batch_gt_map_cls = parse_groundtruths(end_points, CONFIG_DICT_L) 
-        ap_calculator_l.step(batch_pred_map_cls, batch_gt_map_cls)
+        if not FLAGS.single_nms_ap:
+            batch_pred_map_cls = parse_predictions(end_points, CONFIG_DICT_L, opt_ang=(FLAGS.dataset == 'sunrgbd'))
+            batch_gt_map_cls = parse_groundtruths(end_points, CONFIG_DICT_L) 
+            ap_calculator_l.step(batch_pred_map_cls, batch_gt_map_cls)
 
         if FLAGS.dump_results:
             dump_results(end_points, DUMP_DIR+'/result/', DATASET_CONFIG, TEST_DATASET)
@@ -326,12 +343,13 @@ def evaluate_one_epoch():
     for key in sorted(stat_dict.keys()):
         log_string('eval mean %s: %f'%(key, stat_dict[key]/(float(batch_idx+1))))
 
-    metrics_dict = ap_calculator.compute_metrics()
-    for key in metrics_dict:
-        log_string('eval %s: %f'%(key, metrics_dict[key]))
-    metrics_dict = ap_calculator_l.compute_metrics()
-    for key in metrics_dict:
-        log_string('eval %s: %f'%(key, metrics_dict[key]))
+    if FLAGS.single_nms_ap:
+        metrics_list = ap_calculator.compute_metrics()
+    else:
+        metrics_list = [ap_calculator.compute_metrics(), ap_calculator_l.compute_metrics()]
+    for metrics_dict in metrics_list:
+        for key in metrics_dict:
+            log_string('eval %s: %f'%(key, metrics_dict[key]))
 
     mean_loss = stat_dict['loss']/float(batch_idx+1)
     return mean_loss
@@ -117,6 +117,150 @@ def box3d_iou(corners1, corners2):
     iou = inter_vol / (vol1 + vol2 - inter_vol)
     return iou, iou_2d
 
+def poly_area_batch(p):
+    ''' poly_area for arrays of polygons
+        p: [x1,...,xn,V,2] polygon vertices in order (either orientation)
+    Return:
+        [x1,...,xn]
+    '''
+    x = p[...,0]
+    y = p[...,1]
+    return 0.5*np.abs(np.sum(x*np.roll(y,1,-1), -1) - np.sum(y*np.roll(x,1,-1), -1))
+
+def convex_intersection_area(p1, p2, eps=1e-8):
+    ''' Intersection area of convex polygons, vectorized with numpy
+        p1: [x1,...,xn,V1,2]
+        p2: [x1,...,xn,V2,2] (broadcast against p1)
+        vertices in order, either orientation
+    Return:
+        [x1,...,xn]
+    Same algorithm as convex_intersection_area_pytorch.
+    '''
+    V1, V2 = p1.shape[-2], p2.shape[-2]
+    shape = np.broadcast_shapes(p1.shape[:-2], p2.shape[:-2])
+    p1 = np.broadcast_to(p1, shape+(V1,2))
+    p2 = np.broadcast_to(p2, shape+(V2,2))
+    # Edge crossings
+    a0 = np.expand_dims(p1, -2) # [...,V1,1,2]
+    r = np.expand_dims(np.roll(p1,-1,-2), -2) - a0
+    b0 = np.expand_dims(p2, -3) # [...,1,V2,2]
+    s = np.expand_dims(np.roll(p2,-1,-2), -3) - b0
+    denom = _cross2d(r, s)
+    safe = np.where(denom == 0, 1.0, denom)
+    t = _cross2d(b0 - a0, s)/safe
+    u = _cross2d(b0 - a0, r)/safe
+    cross_mask = (denom != 0) & (t >= -eps) & (t <= 1+eps) & (u >= -eps) & (u <= 1+eps)
+    cross_pts = a0 + t[...,None]*r
+    pts = np.concatenate((p1, p2, cross_pts.reshape(shape+(V1*V2,2))), -2)
+    mask = np.concatenate((_in_convex_polygon_np(p1, p2, eps), _in_convex_polygon_np(p2, p1, eps),
+        cross_mask.reshape(shape+(V1*V2,))), -1)
+
+    # Sort the hull vertices by angle, pad with the first one (adds no area)
+    maskf = mask[...,None].astype(pts.dtype)
+    center = np.sum(pts*maskf, -2, keepdims=True)/np.maximum(np.sum(maskf, -2, keepdims=True), 1)
+    d = pts - center
+    angle = np.where(mask, np.arctan2(d[...,1], d[...,0]), 10.0)
+    order = np.argsort(angle, -1, kind='stable')
+    angle = np.take_along_axis(angle, order, -1)
+    pts = np.take_along_axis(pts, order[...,None], -2)
+    pts = np.where((angle < 10.0)[...,None], pts, pts[...,0:1,:])
+    return poly_area_batch(pts)
+
+def _in_convex_polygon_np(q, p, eps=1e-8):
+    ''' numpy version of _in_convex_polygon '''
+    edge = np.roll(p,-1,-2) - p
+    orient = np.sign(np.sum(_cross2d(p, np.roll(p,-1,-2)), -1))
+    side = _cross2d(np.expand_dims(edge,-3), np.expand_dims(q,-2) - np.expand_dims(p,-3))
+    return np.all(side*orient[...,None,None] >= -eps, -1)
+
+def box3d_iou_batch(corners1, corners2):
+    ''' Pairwise box3d_iou of two sets of boxes, vectorized
+        corners1: (N,8,3), corners2: (M,8,3), assume up direction is negative Y
+    Output:
+        iou: (N,M) 3D bounding box IoU
+        iou_2d: (N,M) bird's eye view 2D bounding box IoU
+    '''
+    rect1 = corners1[:,0:4][...,[0,2]]
+    rect2 = corners2[:,0:4][...,[0,2]]
+    area1 = poly_area_batch(rect1)
+    area2 = poly_area_batch(rect2)
+    inter_area = convex_intersection_area(rect1[:,None], rect2[None,:])
+    iou_2d = inter_area/(area1[:,None]+area2[None,:]-inter_area)
+    ymax = np.minimum(corners1[:,None,0,1], corners2[None,:,0,1])
+    ymin = np.maximum(corners1[:,None,4,1], corners2[None,:,4,1])
+    inter_vol = inter_area * np.maximum(0.0, ymax-ymin)
+    vol1 = box3d_vol_batch(corners1)
+    vol2 = box3d_vol_batch(corners2)
+    iou = inter_vol / (vol1[:,None] + vol2[None,:] - inter_vol)
+    return iou, iou_2d
+
+def box3d_vol_batch(corners):
+    ''' corners: (...,8,3) no assumption on axis direction '''
+    a = np.sqrt(np.sum((corners[...,0,:] - corners[...,1,:])**2, -1))
+    b = np.sqrt(np.sum((corners[...,1,:] - corners[...,2,:])**2, -1))
+    c = np.sqrt(np.sum((corners[...,0,:] - corners[...,4,:])**2, -1))
+    return a*b*c
+
+def poly_area_batch_pytorch(p):
+    ''' poly_area for torch tensors
+        p: [x1,...,xn,V,2] polygon vertices in order (either orientation)
+    Return:
+        [x1,...,xn]
+    '''
+    x = p[...,0]
+    y = p[...,1]
+    return 0.5*torch.abs((x*y.roll(1,-1)).sum(-1) - (y*x.roll(1,-1)).sum(-1))
+
+def _cross2d(a, b):
+    return a[...,0]*b[...,1] - a[...,1]*b[...,0]
+
+def _in_convex_polygon(q, p, eps=1e-8):
+    ''' q: [...,Q,2] points, p: [...,V,2] convex polygon in either orientation
+        return [...,Q] bool, points on the boundary count as inside '''
+    edge = p.roll(-1,-2) - p # [...,V,2]
+    orient = torch.sign(_cross2d(p, p.roll(-1,-2)).sum(-1)) # [...]
+    side = _cross2d(edge.unsqueeze(-3), q.unsqueeze(-2) - p.unsqueeze(-3)) # [...,Q,V]
+    return (side*orient.unsqueeze(-1).unsqueeze(-1) >= -eps).all(-1)
+
+def convex_intersection_area_pytorch(p1, p2, eps=1e-8):
+    ''' Intersection area of convex polygons, vectorized on their device
+        p1: [x1,...,xn,V1,2]
+        p2: [x1,...,xn,V2,2] (broadcast against p1)
+        vertices in order, either orientation
+    Return:
+        [x1,...,xn]
+    The intersection is the convex hull of the vertices of either polygon
+    inside the other and of the edge crossings, ordered by angle around
+    their centroid.
+    '''
+    V1, V2 = p1.shape[-2], p2.shape[-2]
+    shape = torch.broadcast_shapes(p1.shape[:-2], p2.shape[:-2])
+    p1 = p1.expand(shape+(V1,2))
+    p2 = p2.expand(shape+(V2,2))
+    # Edge crossings
+    a0 = p1.unsqueeze(-2) # [...,V1,1,2]
+    r = p1.roll(-1,-2).unsqueeze(-2) - a0
+    b0 = p2.unsqueeze(-3) # [...,1,V2,2]
+    s = p2.roll(-1,-2).unsqueeze(-3) - b0
+    denom = _cross2d(r, s)
+    safe = torch.where(denom == 0, torch.ones_like(denom), denom)
+    t = _cross2d(b0 - a0, s)/safe
+    u = _cross2d(b0 - a0, r)/safe
+    cross_mask = (denom != 0) & (t >= -eps) & (t <= 1+eps) & (u >= -eps) & (u <= 1+eps)
+    cross_pts = a0 + t.unsqueeze(-1)*r
+    pts = torch.cat((p1, p2, cross_pts.flatten(-3,-2)), -2) # [...,V1+V2+V1*V2,2]
+    mask = torch.cat((_in_convex_polygon(p1, p2, eps), _in_convex_polygon(p2, p1, eps), cross_mask.flatten(-2)), -1)
+
+    # Sort the hull vertices by angle, pad with the first one (adds no area)
+    maskf = mask.to(pts.dtype).unsqueeze(-1)
+    center = (pts*maskf).sum(-2, keepdim=True)/maskf.sum(-2, keepdim=True).clamp(min=1)
+    d = pts - center
+    angle = torch.where(mask, torch.atan2(d[...,1], d[...,0]), torch.full_like(d[...,0], 10.0))
+    angle, order = torch.sort(angle, -1)
+    pts = torch.gather(pts, -2, order.unsqueeze(-1).expand_as(pts))
+    pts = torch.where((angle < 10.0).unsqueeze(-1), pts, pts[...,0:1,:])
+    return poly_area_batch_pytorch(pts)
+
 
 def get_iou(bb1, bb2):
     """
@@ -213,7 +357,7 @@ def roty_batch_pytorch(t):
     return: (x1,x2,...,xn,3,3)
     """
     input_shape = t.shape
-    output = torch.zeros(tuple(list(input_shape)+[3,3])).cuda()
+    output = torch.zeros(tuple(list(input_shape)+[3,3]), dtype=t.dtype, device=t.device)
     c = torch.cos(t)
     s = torch.sin(t)
     output[...,0,0] = c
@@ -230,7 +374,7 @@ def rotz_batch_pytorch(t):
     return: (x1,x2,...,xn,3,3)
     """
     input_shape = t.shape
-    output = torch.zeros(tuple(list(input_shape)+[3,3])).cuda()
+    output = torch.zeros(tuple(list(input_shape)+[3,3]), dtype=t.dtype, device=t.device)
     c = torch.cos(t)
     s = torch.sin(t)
     output[...,0,0] = c
@@ -279,6 +423,87 @@ def get_3d_box_batch(box_size, heading_angle, center):
     corners_3d = np.matmul(corners_3d, np.transpose(R, tuple(tlist)))
     corners_3d += np.expand_dims(center, -2)
     return corners_3d
+
+def get_3d_box_batch_pytorch(box_size, heading_angle, center):
+    ''' get_3d_box_batch for torch tensors, on their device
+        box_size: [x1,x2,...,xn,3]
+        heading_angle: [x1,x2,...,xn]
+        center: [x1,x2,...,xn,3]
+    Return:
+        [x1,x3,...,xn,8,3]
+    '''
+    R = roty_batch_pytorch(heading_angle)
+    l = box_size[...,0:1] # [x1,...,xn,1]
+    w = box_size[...,1:2]
+    h = box_size[...,2:3]
+    corners_3d = torch.stack((torch.cat((l/2,l/2,-l/2,-l/2,l/2,l/2,-l/2,-l/2), -1),
+                              torch.cat((h/2,h/2,h/2,h/2,-h/2,-h/2,-h/2,-h/2), -1),
+                              torch.cat((w/2,-w/2,-w/2,w/2,w/2,-w/2,-w/2,w/2), -1)), -1)
+    corners_3d = torch.matmul(corners_3d, R.transpose(-1,-2))
+    corners_3d += center.unsqueeze(-2)
+    return corners_3d
+
+# Upper bound on the number of points gathered per block of boxes
+MAX_BLOCK_ELEMS = 1 << 22
+
+def box3d_point_count_batch_pytorch(pc, corners, grid_size=32):
+    ''' Number of points inside each box (boundary included), on their device
+        pc: [B,N,3] points
+        corners: [B,K,8,3] box corners in the same coords (get_3d_box order)
+        grid_size: cells per side of the pre-filter grid
+    Return:
+        [B,K] int64
+    A point is inside if its projections on the box edges c0c1, c0c3 and
+    c0c4 all fall within the edges. Points are bucketed into a grid of
+    columns over axes 0 and 2 and a box only projects the points of the
+    columns overlapping its axis aligned extent.
+    '''
+    B, K, N = corners.shape[0], corners.shape[1], pc.shape[1]
+    device = corners.device
+    pc = pc.to(corners.dtype)
+    origin = corners[:,:,0] # B,K,3
+    axes = torch.stack((corners[:,:,1], corners[:,:,3], corners[:,:,4]), 2) - origin.unsqueeze(2) # B,K,3,3
+    lo = (axes*origin.unsqueeze(2)).sum(-1) # B,K,3
+    hi = lo + (axes*axes).sum(-1)
+
+    # Sort the points by (batch, grid column)
+    count = torch.zeros((B,K), dtype=torch.int64, device=device)
+    if B*K*N == 0:
+        return count
+    pc_xz = pc[...,[0,2]]
+    grid_origin = pc_xz.min(1, keepdim=True)[0] # B,1,2
+    cell = ((pc_xz.max(1, keepdim=True)[0] - grid_origin)/grid_size).clamp(min=1e-6)
+    def column(p):
+        c = ((p - grid_origin.unsqueeze(1)) / cell.unsqueeze(1)).floor().clamp(0, grid_size-1).long()
+        return c[...,0], c[...,1]
+    batch_inds = torch.arange(B, device=device).view(B,1)
+    cx, cz = column(pc_xz.unsqueeze(1))
+    key = (batch_inds*grid_size + cx[:,0])*grid_size + cz[:,0] # B,N
+    key, order = torch.sort(key.view(-1))
+    pc = pc.view(-1,3)[order]
+
+    # Box extents in grid columns
+    box_xz = corners[...,[0,2]]
+    bx0, bz0 = column(box_xz.min(2)[0].unsqueeze(2))
+    bx1, bz1 = column(box_xz.max(2)[0].unsqueeze(2))
+    bx0, bz0, bx1, bz1 = bx0[...,0], bz0[...,0], bx1[...,0], bz1[...,0] # B,K
+    step = max(1, MAX_BLOCK_ELEMS//(B*K*3))
+    for d in range(int((bx1-bx0).max())+1):
+        # Points of the columns (bx0+d, bz0..bz1) are contiguous
+        row = (batch_inds*grid_size + bx0 + d)*grid_size
+        begin = torch.searchsorted(key, (row + bz0).view(-1)).view(B,K)
+        end = torch.searchsorted(key, (row + bz1).view(-1), right=True).view(B,K)
+        end = torch.where(bx0 + d <= bx1, end, begin)
+        L = int((end-begin).max())
+        for start in range(0, L, step):
+            slot = begin.unsqueeze(-1) + torch.arange(start, min(L, start+step), device=device) # B,K,l
+            valid = slot < end.unsqueeze(-1)
+            pts = pc[slot.clamp(max=B*N-1)] # B,K,l,3
+            for a in range(3):
+                proj = pts[...,0]*axes[:,:,a,0:1] + pts[...,1]*axes[:,:,a,1:2] + pts[...,2]*axes[:,:,a,2:3] # B,K,l
+                valid &= (proj >= lo[:,:,a:a+1]) & (proj <= hi[:,:,a:a+1])
+            count += valid.sum(-1)
+    return count
 '''
 def get_surface_line_points_batch_pytorch(box_size, heading_angle, center):
     input_shape = heading_angle.shape
@@ -66,99 +66,126 @@ def get_iou(bb1, bb2):
     iou3d = calc_iou(bb1, bb2)
     return iou3d
 
-from box_util import box3d_iou
+from box_util import box3d_iou, box3d_iou_batch
 def get_iou_obb(bb1,bb2):
     iou3d, iou2d = box3d_iou(bb1,bb2)
     return iou3d
 
+def get_iou_obb_batch(bbs1,bbs2):
+    iou3d, iou2d = box3d_iou_batch(bbs1,bbs2)
+    return iou3d
+
+# Pairwise functions with a vectorized (N,M) IoU matrix counterpart
+BATCH_IOU_FUNCS = {get_iou_obb: get_iou_obb_batch}
+
 def get_iou_main(get_iou_func, args):
     return get_iou_func(*args)
 
+def get_iou_matrix(get_iou_func, bbs1, bbs2):
+    """ IoU matrix (len(bbs1), len(bbs2)) of two lists of boxes """
+    if len(bbs1) == 0 or len(bbs2) == 0:
+        return np.zeros((len(bbs1), len(bbs2)))
+    if get_iou_func in BATCH_IOU_FUNCS:
+        ious = BATCH_IOU_FUNCS[get_iou_func](bbs1, bbs2)
+    else:
+        ious = np.array([[get_iou_main(get_iou_func, (bb1, bb2)) for bb2 in bbs2] for bb1 in bbs1])
+    return np.nan_to_num(ious, nan=-np.inf) # degenerate boxes never match
+
+def match_dets(BB, BBGT, get_iou_func=get_iou):
+    """ Best groundtruth box of every detection of one image and class.
+        Input:
+            BB: (nd,...) detected boxes
+            BBGT: (ngt,...) groundtruth boxes
+        Output:
+            jmax: (nd,) int index of the best groundtruth box
+            ovmax: (nd,) its iou, -inf if there is none
+    """
+    ious = get_iou_matrix(get_iou_func, BB, BBGT)
+    if ious.shape[1] == 0:
+        return np.zeros(len(BB), dtype=np.int64), np.full(len(BB), -np.inf)
+    jmax = np.argmax(ious, 1) # first of the best overlaps
+    return jmax, ious[np.arange(len(BB)), jmax]
+
+def eval_det_cls_from_matches(confidence, gt_ids, ovmax, npos, ovthresh=0.25, use_07_metric=False):
+    """ Precision/recall of one class from its per detection matches.
+        Input:
+            confidence: (nd,) detection scores
+            gt_ids: (nd,) id (unique over all images) of the best groundtruth box
+            ovmax: (nd,) iou with that box
+            npos: number of groundtruth boxes
+            ovthresh, use_07_metric: see eval_det_cls
+        Output:
+            rec, prec, ap as in eval_det_cls
+    """
+    multi_thresh = isinstance(ovthresh, (list, tuple))
+
+    # sort by confidence
+    sorted_ind = np.argsort(-confidence)
+    gt_ids = gt_ids[sorted_ind]
+    ovmax = ovmax[sorted_ind]
+    nd = len(sorted_ind)
+
+    rec, prec, ap = [], [], []
+    for thresh in (ovthresh if multi_thresh else [ovthresh]):
+        # go down dets: the first one above thresh of every groundtruth box
+        # is a TP, all others are FPs
+        hit = np.where(ovmax > thresh)[0]
+        first = np.unique(gt_ids[hit], return_index=True)[1]
+        tp = np.zeros(nd)
+        tp[hit[first]] = 1.
+        fp = 1. - tp
+
+        # compute precision recall
+        fp = np.cumsum(fp)
+        tp = np.cumsum(tp)
+        rec.append(tp / float(npos))
+        #print('NPOS: ', npos)
+        # avoid divide by zero in case the first detection matches a difficult
+        # ground truth
+        prec.append(tp / np.maximum(tp + fp, np.finfo(np.float64).eps))
+        ap.append(voc_ap(rec[-1], prec[-1], use_07_metric))
+
+    if not multi_thresh:
+        return rec[0], prec[0], ap[0]
+    return rec, prec, ap
+
 def eval_det_cls(pred, gt, ovthresh=0.25, use_07_metric=False, get_iou_func=get_iou):
     """ Generic functions to compute precision/recall for object detection
         for a single class.
         Input:
             pred: map of {img_id: [(bbox, score)]} where bbox is numpy array
             gt: map of {img_id: [bbox]}
-            ovthresh: scalar, iou threshold
+            ovthresh: scalar, iou threshold, or a list of thresholds that
+                share one IoU computation
             use_07_metric: bool, if True use VOC07 11 point method
         Output:
             rec: numpy array of length nd
             prec: numpy array of length nd
             ap: scalar, average precision
+            (lists of them, one per threshold, if ovthresh is a list)
     """
 
     # construct gt objects
-    class_recs = {} # {img_id: {'bbox': bbox list, 'det': matched list}}
+    gt_offset = {} # {img_id: id of its first gt box}
     npos = 0
     for img_id in gt.keys():
-        bbox = np.array(gt[img_id])
-        det = [False] * len(bbox)
-        npos += len(bbox)
-        class_recs[img_id] = {'bbox': bbox, 'det': det}
-    # pad empty list to all other imgids
-    for img_id in pred.keys():
-        if img_id not in gt:
-            class_recs[img_id] = {'bbox': np.array([]), 'det': []}
+        gt_offset[img_id] = npos
+        npos += len(gt[img_id])
 
-    # construct dets
-    image_ids = []
+    # construct dets, matched with the gt boxes of their image
     confidence = []
-    BB = []
+    gt_ids = [np.zeros(0, dtype=np.int64)]
+    ovmax = [np.zeros(0)]
     for img_id in pred.keys():
-        for box,score in pred[img_id]:
-            image_ids.append(img_id)
-            confidence.append(score)
-            BB.append(box)
-    confidence = np.array(confidence)
-    BB = np.array(BB) # (nd,4 or 8,3 or 6)
-
-    # sort by confidence
-    sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
-    BB = BB[sorted_ind, ...]
-    image_ids = [image_ids[x] for x in sorted_ind]
-
-    # go down dets and mark TPs and FPs
-    nd = len(image_ids)
-    tp = np.zeros(nd)
-    fp = np.zeros(nd)
-    for d in range(nd):
-        #if d%100==0: print(d)
-        R = class_recs[image_ids[d]]
-        bb = BB[d,...].astype(float)
-        ovmax = -np.inf
-        BBGT = R['bbox'].astype(float)
-
-        if BBGT.size > 0:
-            # compute overlaps
-            for j in range(BBGT.shape[0]):
-                iou = get_iou_main(get_iou_func, (bb, BBGT[j,...]))
-                if iou > ovmax:
-                    ovmax = iou
-                    jmax = j
-
-        #print d, ovmax
-        if ovmax > ovthresh:
-            if not R['det'][jmax]:
-                tp[d] = 1.
-                R['det'][jmax] = 1
-            else:
-                fp[d] = 1.
-        else:
-            fp[d] = 1.
-
-    # compute precision recall
-    fp = np.cumsum(fp)
-    tp = np.cumsum(tp)
-    rec = tp / float(npos)
-    #print('NPOS: ', npos)
-    # avoid divide by zero in case the first detection matches a difficult
-    # ground truth
-    prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
-    ap = voc_ap(rec, prec, use_07_metric)
+        BB = np.array([box for box,score in pred[img_id]]).astype(float) # (n,4 or 8,3 or 6)
+        BBGT = np.array(gt.get(img_id, [])).astype(float)
+        jmax, ov = match_dets(BB, BBGT, get_iou_func)
+        confidence += [score for box,score in pred[img_id]]
+        gt_ids.append(jmax + gt_offset.get(img_id, 0))
+        ovmax.append(ov)
 
-    return rec, prec, ap
+    return eval_det_cls_from_matches(np.array(confidence), np.concatenate(gt_ids),
+        np.concatenate(ovmax), npos, ovthresh, use_07_metric)
 
 def eval_det_cls_wrapper(arguments):
     pred, gt, ovthresh, use_07_metric, get_iou_func = arguments
@@ -171,7 +198,7 @@ def eval_det(pred_all, gt_all, ovthresh=0.25, use_07_metric=False, get_iou_func=
         Input:
             pred_all: map of {img_id: [(classname, bbox, score)]}
             gt_all: map of {img_id: [(classname, bbox)]}
-            ovthresh: scalar, iou threshold
+            ovthresh: scalar, iou threshold (or a list, see eval_det_cls)
             use_07_metric: bool, if true use VOC07 11 point method
         Output:
             rec: {classname: rec}
@@ -206,47 +233,144 @@ def eval_det(pred_all, gt_all, ovthresh=0.25, use_07_metric=False, get_iou_func=
     
     return rec, prec, ap 
 
+import atexit
+import shutil
+import tempfile
 from multiprocessing import Pool
-def eval_det_multiprocessing(pred_all, gt_all, ovthresh=0.25, use_07_metric=False, get_iou_func=get_iou):
+# Worker pool of eval_det_multiprocessing, kept alive across calls (and eval
+# epochs) until close_pool or interpreter exit. Only APCalculator uses it;
+# APCalculatorStreaming, as run by train.py and eval.py, never creates it.
+POOL = None
+POOL_SIZE = 0
+
+def get_pool(processes=10):
+    """ The shared worker pool, (re)created if its size changes """
+    global POOL, POOL_SIZE
+    if POOL is None or POOL_SIZE != processes:
+        close_pool()
+        POOL = Pool(processes=processes)
+        POOL_SIZE = processes
+    return POOL
+
+def close_pool():
+    """ Terminate the shared worker pool, if any. Runs at exit as well """
+    global POOL, POOL_SIZE
+    if POOL is not None:
+        POOL.terminate()
+        POOL.join()
+        POOL = None
+        POOL_SIZE = 0
+
+atexit.register(close_pool)
+
+def match_scenes_wrapper(arguments):
+    """ Match the dets of a range of scenes with their gt boxes of the same
+        class. Boxes and classes are read from the memmapped .npy files in
+        data_dir; returns the global gt row and iou of the best match of
+        every det in the range. """
+    data_dir, scenes, get_iou_func = arguments
+    pred_boxes = np.load(os.path.join(data_dir, 'pred_boxes.npy'), mmap_mode='r')
+    pred_cls = np.load(os.path.join(data_dir, 'pred_cls.npy'), mmap_mode='r')
+    gt_boxes = np.load(os.path.join(data_dir, 'gt_boxes.npy'), mmap_mode='r')
+    gt_cls = np.load(os.path.join(data_dir, 'gt_cls.npy'), mmap_mode='r')
+    gt_ids = []
+    ovmax = []
+    for p0, p1, g0, g1 in scenes:
+        scene_gt_ids = np.zeros(p1-p0, dtype=np.int64)
+        scene_ovmax = np.full(p1-p0, -np.inf)
+        for c in np.unique(pred_cls[p0:p1]):
+            det_rows = np.where(pred_cls[p0:p1] == c)[0]
+            gt_rows = g0 + np.where(gt_cls[g0:g1] == c)[0]
+            jmax, ov = match_dets(pred_boxes[p0+det_rows].astype(float), gt_boxes[gt_rows].astype(float), get_iou_func)
+            if len(gt_rows) > 0:
+                scene_gt_ids[det_rows] = gt_rows[jmax]
+            scene_ovmax[det_rows] = ov
+        gt_ids.append(scene_gt_ids)
+        ovmax.append(scene_ovmax)
+    return gt_ids, ovmax
+
+def eval_det_multiprocessing(pred_all, gt_all, ovthresh=0.25, use_07_metric=False, get_iou_func=get_iou, processes=10):
     """ Generic functions to compute precision/recall for object detection
         for multiple classes.
+        The boxes are packed into memmapped arrays in a temporary dir (removed
+        before returning) and the (det, gt) matching is spread over a
+        persistent pool of processes by scene, see get_pool/close_pool; only
+        the final sort and cumulative sums run per class.
         Input:
             pred_all: map of {img_id: [(classname, bbox, score)]}
             gt_all: map of {img_id: [(classname, bbox)]}
-            ovthresh: scalar, iou threshold
+            ovthresh: scalar, iou threshold (or a list, see eval_det_cls)
             use_07_metric: bool, if true use VOC07 11 point method
+            processes: int, size of the worker pool
         Output:
             rec: {classname: rec}
             prec: {classname: prec_all}
             ap: {classname: scalar}
     """
-    pred = {} # map {classname: pred}
-    gt = {} # map {classname: gt}
+    # Pack dets and gts scene by scene, classes as int codes in the order of
+    # eval_det (predicted classes first)
+    codes = {} # {classname: code}
+    pred_boxes, pred_cls, scores, pred_counts = [], [], [], []
     for img_id in pred_all.keys():
         for classname, bbox, score in pred_all[img_id]:
-            if classname not in pred: pred[classname] = {}
-            if img_id not in pred[classname]:
-                pred[classname][img_id] = []
-            if classname not in gt: gt[classname] = {}
-            if img_id not in gt[classname]:
-                gt[classname][img_id] = []
-            pred[classname][img_id].append((bbox,score))
+            pred_boxes.append(bbox)
+            pred_cls.append(codes.setdefault(classname, len(codes)))
+            scores.append(score)
+        pred_counts.append(len(pred_all[img_id]))
+    pred_classes = set(codes)
+    gt_boxes, gt_cls = {}, {}
     for img_id in gt_all.keys():
-        for classname, bbox in gt_all[img_id]:
-            if classname not in gt: gt[classname] = {}
-            if img_id not in gt[classname]:
-                gt[classname][img_id] = []
-            gt[classname][img_id].append(bbox)
+        gt_boxes[img_id] = [bbox for classname, bbox in gt_all[img_id]]
+        gt_cls[img_id] = [codes.setdefault(classname, len(codes)) for classname, bbox in gt_all[img_id]]
+    # gts in the scene order of the dets (gt only scenes need no matching)
+    img_ids = list(pred_all.keys()) + [img_id for img_id in gt_all.keys() if img_id not in pred_all]
+    gt_counts = [len(gt_boxes.get(img_id, [])) for img_id in img_ids]
+    gt_box_list = [bbox for img_id in img_ids for bbox in gt_boxes.get(img_id, [])]
+    gt_cls_list = [c for img_id in img_ids for c in gt_cls.get(img_id, [])]
+
+    scores = np.array(scores)
+    pred_cls = np.array(pred_cls, dtype=np.int64)
+    gt_cls_list = np.array(gt_cls_list, dtype=np.int64)
+    nd = len(scores)
+    gt_ids = np.zeros(nd, dtype=np.int64)
+    ovmax = np.full(nd, -np.inf)
+    if nd > 0:
+        data_dir = tempfile.mkdtemp(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        try:
+            np.save(os.path.join(data_dir, 'pred_boxes.npy'), np.array(pred_boxes))
+            np.save(os.path.join(data_dir, 'pred_cls.npy'), pred_cls)
+            np.save(os.path.join(data_dir, 'gt_boxes.npy'), np.array(gt_box_list) if len(gt_box_list) > 0 else np.zeros((0,)+np.array(pred_boxes[0]).shape))
+            np.save(os.path.join(data_dir, 'gt_cls.npy'), gt_cls_list)
+
+            # Scene ranges, split into tasks of about the same number of dets
+            p_end = np.cumsum(pred_counts)
+            g_end = np.cumsum(gt_counts[:len(pred_counts)])
+            scenes = [(int(p_end[k]-pred_counts[k]), int(p_end[k]), int(g_end[k]-gt_counts[k]), int(g_end[k]))
+                for k in range(len(pred_counts)) if pred_counts[k] > 0]
+            num_tasks = min(len(scenes), 4*processes)
+            bounds = np.searchsorted([s[1] for s in scenes], np.linspace(0, nd, num_tasks+1)[1:-1])
+            tasks = [(data_dir, list(part), get_iou_func) for part in np.array_split(np.array(scenes), bounds) if len(part) > 0]
+            rows = 0
+            for task_gt_ids, task_ovmax in get_pool(processes).map(match_scenes_wrapper, tasks):
+                for scene_gt_ids, scene_ovmax in zip(task_gt_ids, task_ovmax):
+                    gt_ids[rows:rows+len(scene_gt_ids)] = scene_gt_ids
+                    ovmax[rows:rows+len(scene_ovmax)] = scene_ovmax
+                    rows += len(scene_gt_ids)
+        finally:
+            shutil.rmtree(data_dir)
 
     rec = {}
     prec = {}
     ap = {}
-    p = Pool(processes=10)
-    ret_values = p.map(eval_det_cls_wrapper, [(pred[classname], gt[classname], ovthresh, use_07_metric, get_iou_func) for classname in gt.keys() if classname in pred])
-    p.close()
-    for i, classname in enumerate(gt.keys()):
-        if classname in pred:
-            rec[classname], prec[classname], ap[classname] = ret_values[i]
+    for classname, c in codes.items():
+        if classname in pred_classes:
+            mask = pred_cls == c
+            rec[classname], prec[classname], ap[classname] = eval_det_cls_from_matches(scores[mask],
+                gt_ids[mask], ovmax[mask], int(np.sum(gt_cls_list == c)), ovthresh, use_07_metric)
+        elif isinstance(ovthresh, (list, tuple)):
+            rec[classname] = [0] * len(ovthresh)
+            prec[classname] = [0] * len(ovthresh)
+            ap[classname] = [0] * len(ovthresh)
         else:
             rec[classname] = 0
             prec[classname] = 0
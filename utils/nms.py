@@ -4,7 +4,12 @@
 # LICENSE file in the root directory of this source tree.
 
 import numpy as np
+import torch
 from pc_util import bbox_corner_dist_measure
+from box_util import poly_area_batch_pytorch, convex_intersection_area_pytorch
+
+# Polygon pairs intersected at once by nms_rotated_batch_pytorch
+MAX_PAIRS = 1 << 15
 
 # boxes are axis aigned 2D boxes of shape (n,5) in FLOAT numbers with (x1,y1,x2,y2,score)
 ''' Ref: https://www.pyimagesearch.com/2015/02/16/faster-non-maximum-suppression-python/
@@ -154,6 +159,103 @@ def nms_3d_faster_samecls(boxes, overlap_threshold, old_type=False):
 
     return pick
 
+def nms_faster_batch_pytorch(boxes, score, overlap_threshold, old_type=False, cls=None, valid=None):
+    """ Batched axis aligned NMS in torch (CPU or GPU) with the same picks as
+    nms_2d_faster / nms_3d_faster (cls=None) and nms_3d_faster_samecls on
+    every scene, up to the order of exactly equal scores.
+
+    boxes: (B,K,2*D) tensor of (x1,y1[,z1],x2,y2[,z2]) for D=2 or 3
+    score: (B,K) tensor
+    cls: (B,K) tensor, only suppress boxes of the same class if given
+    valid: (B,K) bool tensor, boxes that take part in the NMS
+    return: (B,K) bool tensor of the picked boxes
+    """
+    B, K, D = boxes.shape[0], boxes.shape[1], boxes.shape[2]//2
+    boxes = boxes.double()
+    order = torch.sort(score, dim=1, descending=True, stable=True)[1]
+    boxes = torch.gather(boxes, 1, order.unsqueeze(-1).expand(-1,-1,2*D))
+    mins, maxs = boxes[...,:D], boxes[...,D:]
+    area = maxs[...,0]-mins[...,0]
+    for d in range(1, D):
+        area = area*(maxs[...,d]-mins[...,d]) # (B,K)
+
+    # Pairwise overlap of the higher scored box i (rows) with box j (columns)
+    side = torch.clamp(torch.min(maxs.unsqueeze(2), maxs.unsqueeze(1)) - torch.max(mins.unsqueeze(2), mins.unsqueeze(1)), min=0)
+    inter = side[...,0]
+    for d in range(1, D):
+        inter = inter*side[...,d] # (B,K,K)
+    if old_type:
+        o = inter / area.unsqueeze(1)
+    else:
+        o = inter / (area.unsqueeze(2) + area.unsqueeze(1) - inter)
+    return _nms_greedy_batch(o, order, overlap_threshold, cls, valid)
+
+def nms_rotated_batch_pytorch(corners, score, overlap_threshold, old_type=False, cls=None, valid=None, use_3d=True):
+    """ Batched oriented box NMS in torch (CPU or GPU). The overlap is the bird's
+    eye view polygon intersection of the rotated boxes, times the height overlap
+    if use_3d, so heavily rotated boxes are compared by their true footprint
+    instead of their axis aligned extents.
+
+    corners: (B,K,8,3) tensor of upright camera box corners (get_3d_box order)
+    score, cls, valid and the return value as in nms_faster_batch_pytorch
+    """
+    corners = corners.double()
+    order = torch.sort(score, dim=1, descending=True, stable=True)[1]
+    corners = torch.gather(corners, 1, order.view(order.shape+(1,1)).expand(-1,-1,8,3))
+    rect = corners[:,:,0:4][...,[0,2]] # (B,K,4,2) in (x,z)
+    area = poly_area_batch_pytorch(rect)
+
+    # Polygon intersections only for the pairs whose axis aligned footprints
+    # overlap (the rest is 0), once per unordered pair
+    lo, hi = rect.min(2)[0], rect.max(2)[0]
+    cand = (torch.min(hi.unsqueeze(2), hi.unsqueeze(1)) > torch.max(lo.unsqueeze(2), lo.unsqueeze(1))).all(-1)
+    cand = torch.triu(cand, diagonal=1)
+    if cls is not None:
+        cls_sorted = torch.gather(cls, 1, order)
+        cand &= cls_sorted.unsqueeze(2) == cls_sorted.unsqueeze(1)
+    if valid is not None:
+        valid_sorted = torch.gather(valid, 1, order)
+        cand &= valid_sorted.unsqueeze(2) & valid_sorted.unsqueeze(1)
+    b, i, j = cand.nonzero(as_tuple=True)
+    inter = torch.zeros_like(cand, dtype=rect.dtype)
+    for start in range(0, b.shape[0], MAX_PAIRS):
+        sl = slice(start, start+MAX_PAIRS)
+        inter[b[sl],i[sl],j[sl]] = convex_intersection_area_pytorch(rect[b[sl],i[sl]], rect[b[sl],j[sl]])
+    inter = inter + inter.transpose(1,2)
+    inter = torch.diagonal_scatter(inter, area, 0, 1, 2)
+    if use_3d:
+        ymax = corners[:,:,0,1]
+        ymin = corners[:,:,4,1]
+        area = area*(ymax-ymin)
+        inter = inter*torch.clamp(torch.min(ymax.unsqueeze(2), ymax.unsqueeze(1)) - torch.max(ymin.unsqueeze(2), ymin.unsqueeze(1)), min=0)
+    if old_type:
+        o = inter / area.unsqueeze(1)
+    else:
+        o = inter / (area.unsqueeze(2) + area.unsqueeze(1) - inter)
+    return _nms_greedy_batch(o, order, overlap_threshold, cls, valid)
+
+def _nms_greedy_batch(o, order, overlap_threshold, cls=None, valid=None):
+    ''' o: (B,K,K) overlap of the boxes sorted by order (B,K) '''
+    B, K = order.shape
+    if cls is not None:
+        cls = torch.gather(cls, 1, order)
+        o = o * (cls.unsqueeze(2) == cls.unsqueeze(1))
+    overlap = o > overlap_threshold
+
+    # Greedy pass over the ranks, all scenes at once
+    if valid is None:
+        removed = torch.zeros((B,K), dtype=torch.bool, device=o.device)
+    else:
+        removed = ~torch.gather(valid, 1, order)
+    keep = torch.zeros((B,K), dtype=torch.bool, device=o.device)
+    for r in range(K):
+        keep[:,r] = ~removed[:,r]
+        removed |= overlap[:,r] & keep[:,r:r+1]
+
+    pick = torch.zeros_like(keep)
+    pick.scatter_(1, order, keep)
+    return pick
+
 
 def nms_crnr_dist(boxes, conf, overlap_threshold):
         
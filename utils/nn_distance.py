@@ -10,6 +10,10 @@ Author: Charles R. Qi
 import torch
 import torch.nn as nn
 import numpy as np
+from scipy.spatial import cKDTree
+
+# Upper bound on the number of elements in a (B, chunk, M, C) difference block
+MAX_BLOCK_ELEMS = 1 << 24
 
 
 def huber_loss(error, delta=1.0):
@@ -31,33 +35,73 @@ def huber_loss(error, delta=1.0):
     loss = 0.5 * quadratic**2 + delta * linear
     return loss
 
-def nn_distance(pc1, pc2, l1smooth=False, delta=1.0, l1=False):
+def _pair_dist(pc_diff, l1smooth=False, delta=1.0, l1=False):
+    if l1smooth:
+        return torch.sum(huber_loss(pc_diff, delta), dim=-1)
+    elif l1:
+        return torch.sum(torch.abs(pc_diff), dim=-1)
+    else:
+        return torch.sum(pc_diff**2, dim=-1)
+
+def _nn_index(pc1, pc2, l1smooth=False, delta=1.0, l1=False):
+    """ Nearest neighbor indices in both directions, computed on blocks of
+    rows of the (B,N,M) distance matrix so the full difference tensor is
+    never built.
+    """
+    B, N, C = pc1.shape
+    M = pc2.shape[1]
+    idx1 = torch.zeros((B,N), dtype=torch.long, device=pc1.device)
+    dist2 = torch.full((B,M), float('inf'), dtype=pc1.dtype, device=pc1.device)
+    idx2 = torch.zeros((B,M), dtype=torch.long, device=pc1.device)
+    step = max(1, MAX_BLOCK_ELEMS // max(1, B*M*C))
+    for start in range(0, N, step):
+        pc_dist = _pair_dist(pc1[:,start:start+step].unsqueeze(2) - pc2.unsqueeze(1), l1smooth, delta, l1) # (B,step,M)
+        idx1[:,start:start+step] = torch.min(pc_dist, dim=2)[1]
+        block_dist2, block_idx2 = torch.min(pc_dist, dim=1)
+        closer = block_dist2 < dist2
+        dist2 = torch.where(closer, block_dist2, dist2)
+        idx2 = torch.where(closer, block_idx2 + start, idx2)
+    return idx1, idx2
+
+def _nn_index_kdtree(pc1, pc2, l1=False):
+    """ Nearest neighbor indices in both directions with one KD-tree per
+    cloud (CPU only, L2 or L1 metric).
+    """
+    p = 1 if l1 else 2
+    pc1_np = pc1.detach().numpy()
+    pc2_np = pc2.detach().numpy()
+    idx1 = np.stack([cKDTree(pc2_np[b]).query(pc1_np[b], p=p)[1] for b in range(pc1_np.shape[0])])
+    idx2 = np.stack([cKDTree(pc1_np[b]).query(pc2_np[b], p=p)[1] for b in range(pc1_np.shape[0])])
+    return torch.from_numpy(idx1).long(), torch.from_numpy(idx2).long()
+
+def nn_distance(pc1, pc2, l1smooth=False, delta=1.0, l1=False, use_kdtree=False):
     """
     Input:
         pc1: (B,N,C) torch tensor
         pc2: (B,M,C) torch tensor
         l1smooth: bool, whether to use l1smooth loss
         delta: scalar, the delta used in l1smooth loss
+        l1: bool, whether to use l1 distance
+        use_kdtree: bool, find the neighbors with scipy KD-trees when the
+            inputs are on the CPU (not for l1smooth)
     Output:
         dist1: (B,N) torch float32 tensor
         idx1: (B,N) torch int64 tensor
         dist2: (B,M) torch float32 tensor
         idx2: (B,M) torch int64 tensor
     """
-    N = pc1.shape[1]
-    M = pc2.shape[1]
-    pc1_expand_tile = pc1.unsqueeze(2).repeat(1,1,M,1)
-    pc2_expand_tile = pc2.unsqueeze(1).repeat(1,N,1,1)
-    pc_diff = pc1_expand_tile - pc2_expand_tile
-    
-    if l1smooth:
-        pc_dist = torch.sum(huber_loss(pc_diff, delta), dim=-1) # (B,N,M)
-    elif l1:
-        pc_dist = torch.sum(torch.abs(pc_diff), dim=-1) # (B,N,M)
-    else:
-        pc_dist = torch.sum(pc_diff**2, dim=-1) # (B,N,M)
-    dist1, idx1 = torch.min(pc_dist, dim=2) # (B,N)
-    dist2, idx2 = torch.min(pc_dist, dim=1) # (B,M)
+    with torch.no_grad():
+        if use_kdtree and not l1smooth and pc1.device.type == 'cpu':
+            idx1, idx2 = _nn_index_kdtree(pc1, pc2, l1)
+        else:
+            idx1, idx2 = _nn_index(pc1, pc2, l1smooth, delta, l1)
+
+    # Only the distances of the nearest pairs carry gradients, as with torch.min
+    C = pc1.shape[2]
+    pc2_nn = torch.gather(pc2, 1, idx1.unsqueeze(-1).expand(-1,-1,C))
+    pc1_nn = torch.gather(pc1, 1, idx2.unsqueeze(-1).expand(-1,-1,C))
+    dist1 = _pair_dist(pc1 - pc2_nn, l1smooth, delta, l1) # (B,N)
+    dist2 = _pair_dist(pc1_nn - pc2, l1smooth, delta, l1) # (B,M)
     return dist1, idx1, dist2, idx2
 
 def demo_nn_distance():
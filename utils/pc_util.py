@@ -63,6 +63,36 @@ def random_sampling(pc, num_sample, replace=None, return_choices=False):
     else:
         return pc[choices]
 
+def instance_covering_sampling(pc, labels, num_sample, replace=None, return_choices=False):
+    """ random_sampling that keeps at least one point of every label in labels (N,).
+    Draws exactly like random_sampling; each label the draw missed then takes the
+    place of a random surplus point (one of a label drawn more than once).
+    Needs num_sample >= the number of distinct labels.
+    """
+    if replace is None: replace = (pc.shape[0]<num_sample)
+    _, inv = np.unique(labels, return_inverse=True)
+    inv = inv.reshape(-1)
+    assert inv.max()+1 <= num_sample, 'cannot cover %d labels with %d points' % (inv.max()+1, num_sample)
+    choices = np.random.choice(pc.shape[0], num_sample, replace=replace)
+    present = np.zeros(inv.max()+1, dtype=bool)
+    present[inv[choices]] = True
+    if not present.all():
+        # A random point of every missing label
+        perm = np.random.permutation(pc.shape[0])
+        perm = perm[~present[inv[perm]]]
+        _, first = np.unique(inv[perm], return_index=True)
+        picks = perm[first]
+        # Random slots that are not the only one of their label
+        slots = np.random.permutation(num_sample)
+        _, keep = np.unique(inv[choices[slots]], return_index=True)
+        # As many surplus slots as missing labels, given the assert above
+        surplus = np.delete(slots, keep)
+        choices[surplus[:len(picks)]] = picks
+    if return_choices:
+        return pc[choices], choices
+    else:
+        return pc[choices]
+
 # ----------------------------------------
 # Point Cloud/Volume Conversions
 # ----------------------------------------